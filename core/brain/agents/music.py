@@ -1,24 +1,38 @@
 from dataclasses import dataclass, field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, NamedTuple, Sequence, Tuple
+import time
+import heapq
 import logging
-from core.brain.music_library import MusicLibrary, TrackMetadata, Energy
+import numpy as np
+from core.brain.music_library import MusicLibrary, TrackMetadata, Energy, Genre
 from core.brain.radio_automation import PlaylistOptimizer, Track
 
 logger = logging.getLogger(__name__)
 
+# Energy enum -> 0.0-1.0 float used by the automation side
+ENERGY_VALUES = {
+    Energy.LOW: 0.2,
+    Energy.MEDIUM_LOW: 0.4,
+    Energy.MEDIUM: 0.6,
+    Energy.MEDIUM_HIGH: 0.8,
+    Energy.HIGH: 1.0
+}
+
+# craft_set defaults
+BEAM_WIDTH = 8  # Partial sets kept per step
+BRANCH_FACTOR = 12  # Candidates tried per partial set
+CRAFT_TIME_BUDGET = 0.5  # Seconds before the search narrows to a greedy finish
+ENERGY_CURVE_WEIGHT = 0.5  # Penalty per unit of distance from the energy target
+ARTIST_REPEAT_PENALTY = 0.3  # Same artist within ARTIST_SEPARATION tracks
+ARTIST_SEPARATION = 3
+DEFAULT_TRACK_SECONDS = 180
+
 def metadata_to_track(meta: TrackMetadata) -> Track:
     """Convert Library Metadata to Automation Track."""
     energy_val = 0.5
     if meta.energy:
         # Convert Enum to 0.0-1.0 float
-        mapping = {
-            Energy.LOW: 0.2,
-            Energy.MEDIUM_LOW: 0.4,
-            Energy.MEDIUM: 0.6,
-            Energy.MEDIUM_HIGH: 0.8,
-            Energy.HIGH: 1.0
-        }
-        energy_val = mapping.get(meta.energy, 0.5)
+        energy_val = ENERGY_VALUES.get(meta.energy, 0.5)
 
     return Track(
         title=meta.title,
@@ -28,9 +42,45 @@ def metadata_to_track(meta: TrackMetadata) -> Track:
         album=meta.album,
         genre=meta.genre.value if meta.genre else None,
         bpm=meta.bpm,
-        energy=energy_val
+        energy=energy_val,
+        key=meta.key,
+        envelope=meta.envelope
     )
 
+def nearest_energy(value: Optional[float]) -> Energy:
+    """Map a 0.0-1.0 energy back to the closest Energy level."""
+    if value is None:
+        return Energy.MEDIUM
+    return min(ENERGY_VALUES, key=lambda level: abs(ENERGY_VALUES[level] - value))
+
+class _Probe(NamedTuple):
+    """Similarity query for a track that need not be in the library."""
+    genre: Optional[Genre]
+    bpm: Optional[int]
+    energy: Energy
+    key: Optional[str]
+    loudness_lufs: Optional[float]
+    file_hash: Optional[str] = None
+    file_path: str = ""
+
+def _probe_for(track: Track) -> _Probe:
+    try:
+        genre = Genre(track.genre) if track.genre else None
+    except ValueError:
+        genre = Genre.OTHER
+    return _Probe(genre, track.bpm, nearest_energy(track.energy), track.key, None)
+
+class _SetState(NamedTuple):
+    """One partial set in the beam."""
+    score: float  # Sum of step scores
+    keys: Tuple[str, ...]
+    duration: int
+
+    @property
+    def rank(self) -> float:
+        # Mean step score, so sets of different lengths compare fairly
+        return self.score / max(1, len(self.keys) - 1)
+
 @dataclass
 class CrateDigger:
     """
@@ -77,62 +127,138 @@ class FlowMaster:
     def analyze_segue(self, track_a: Track, track_b: Track) -> Dict[str, Any]:
         """Calculates the best transition between two tracks."""
         score = self.optimizer.calculate_transition_score(track_a, track_b)
-        crossfade = self.optimizer.suggest_crossfade(track_a, track_b)
-        
+        crossfade = self.optimizer.suggest_crossfade_duration(track_a, track_b)
+
         return {
             "score": score,
             "crossfade_duration": crossfade,
-            "energy_change": track_b.metadata.energy.value - track_a.metadata.energy.value if track_a.metadata.energy and track_b.metadata.energy else 0,
-            "bpm_diff": abs(track_a.metadata.bpm - track_b.metadata.bpm) if track_a.metadata.bpm and track_b.metadata.bpm else 0
+            "energy_change": track_b.energy - track_a.energy if track_a.energy is not None and track_b.energy is not None else 0,
+            "bpm_diff": abs(track_a.bpm - track_b.bpm) if track_a.bpm and track_b.bpm else 0
         }
 
-    def craft_set(self, seed_track: Track, length_minutes: int, library: MusicLibrary) -> List[Track]:
+    def craft_set(
+        self,
+        seed_track: Track,
+        length_minutes: int,
+        library: MusicLibrary,
+        energy_curve: Optional[Sequence[float]] = None,
+        beam_width: int = BEAM_WIDTH,
+        branch: int = BRANCH_FACTOR,
+        time_budget: float = CRAFT_TIME_BUDGET
+    ) -> List[Track]:
         """
         Builds a coherent set of music starting from a seed track.
+
+        Beam search: every step extends each of the best ``beam_width``
+        partial sets with its top candidates. Candidates come from the
+        library's similarity index, queried for every set's last track
+        (steered to the energy the curve wants next) in one batch, and are
+        scored with the transition matrix plus the distance from the energy
+        curve. Once ``time_budget`` is spent the beam narrows to one set,
+        which is finished greedily, so a full-length set still comes back.
+
+        Args:
+            seed_track: First track of the set
+            length_minutes: Target set length
+            library: Library to draw tracks from
+            energy_curve: Target energies (0.0-1.0) spread evenly over the
+                set, e.g. [0.4, 0.8, 0.6]; None keeps only transition flow
+            beam_width: Partial sets kept per step
+            branch: Candidates tried per partial set
+            time_budget: Seconds of full-width search
+
+        Returns:
+            Tracks in play order, starting with the seed
         """
-        playlist = [seed_track]
-        current_duration = seed_track.metadata.duration or 180
         target_duration = length_minutes * 60
-        
-        current_track = seed_track
-        
-        # Simple greedy selection for now
-        # In a full implementation, this would use beam search or similar
-        attempts = 0
-        while current_duration < target_duration and attempts < 100:
-            attempts += 1
-            # Find candidates (naive: random for now, but should use CrateDigger logic)
-            # This shows the need for collaboration between agents
-            
-            # Using internal logic for now to demonstrate FlowMaster responsibility
-            candidates = list(library.tracks.values())
-            best_next = None
-            best_score = -1
-            
-            import random
-            random.shuffle(candidates) # randomize check order
-            
-            for candidate in candidates[:20]: # Check 20 random candidates
-                if candidate in playlist:
-                    continue
-                
-                score = self.optimizer.calculate_transition_score(current_track, candidate)
-                if score > best_score:
-                    best_score = score
-                    best_next = candidate
-            
-            if best_next and best_score > 0.6: # Quality threshold
-                playlist.append(best_next)
-                current_track = best_next
-                current_duration += best_next.metadata.duration or 180
-                attempts = 0 # Reset attempts on success
-            elif attempts > 50:
-                 # Fallback if no good match found quickly
-                 if candidates:
-                     fallback = random.choice(candidates)
-                     if fallback not in playlist:
-                         playlist.append(fallback)
-                         current_track = fallback
-                         current_duration += fallback.metadata.duration or 180
-
-        return playlist
+        deadline = time.perf_counter() + time_budget
+
+        seed_meta = library.get_by_path(seed_track.path) if seed_track.path else None
+        seed_key = (seed_meta.file_hash or seed_meta.file_path) if seed_meta else "__seed__"
+        tracks: Dict[str, Track] = {seed_key: seed_track}
+        probes: Dict[str, _Probe] = {seed_key: _probe_for(seed_track)}
+        if seed_meta is not None:
+            probes[seed_key] = _Probe(seed_meta.genre, seed_meta.bpm, seed_meta.energy, seed_meta.key, seed_meta.loudness_lufs)
+
+        def seconds(track: Track) -> int:
+            return track.duration or DEFAULT_TRACK_SECONDS
+
+        def energy_target(elapsed: int) -> Optional[float]:
+            if not energy_curve:
+                return None
+            positions = np.linspace(0.0, 1.0, len(energy_curve))
+            return float(np.interp(min(1.0, elapsed / max(1, target_duration)), positions, energy_curve))
+
+        beam = [_SetState(0.0, (seed_key,), seconds(seed_track))]
+        finished: List[_SetState] = []
+
+        while beam:
+            if time.perf_counter() > deadline and beam_width > 1:
+                logger.debug("craft_set time budget spent, finishing greedily")
+                beam_width, branch = 1, min(branch, 4)
+                beam = beam[:1]
+
+            # One batched similarity query, steered towards each set's next energy target
+            queries = []
+            for state in beam:
+                tail = probes[state.keys[-1]]
+                wanted = energy_target(state.duration)
+                if wanted is not None:
+                    tail = tail._replace(energy=nearest_energy(wanted))
+                queries.append(tail)
+            limit = branch + max(len(state.keys) for state in beam)
+            neighbours = library.find_similar_batch(queries, limit=limit, exclude_seeds=False)
+
+            for found in neighbours:
+                for meta in found:
+                    key = meta.file_hash or meta.file_path
+                    if key not in tracks:
+                        tracks[key] = metadata_to_track(meta)
+                        probes[key] = _Probe(meta.genre, meta.bpm, meta.energy, meta.key, meta.loudness_lufs)
+
+            # Transition scores between every tail and every candidate of this step
+            step_keys = list(dict.fromkeys(
+                [state.keys[-1] for state in beam]
+                + [meta.file_hash or meta.file_path for found in neighbours for meta in found]
+            ))
+            column = {key: i for i, key in enumerate(step_keys)}
+            matrix = self.optimizer.transition_matrix([tracks[key] for key in step_keys])
+
+            expanded: List[_SetState] = []
+            for state, found in zip(beam, neighbours):
+                used = set(state.keys)
+                recent_artists = {tracks[key].artist for key in state.keys[-ARTIST_SEPARATION:]}
+                wanted = energy_target(state.duration)
+                row = matrix[column[state.keys[-1]]]
+
+                options = []
+                for meta in found:
+                    key = meta.file_hash or meta.file_path
+                    if key in used:
+                        continue
+                    track = tracks[key]
+                    step = float(row[column[key]])
+                    if wanted is not None and track.energy is not None:
+                        step -= ENERGY_CURVE_WEIGHT * abs(track.energy - wanted)
+                    if track.artist in recent_artists:
+                        step -= ARTIST_REPEAT_PENALTY
+                    options.append((step, key))
+
+                for step, key in heapq.nlargest(branch, options):
+                    grown = _SetState(
+                        state.score + step,
+                        state.keys + (key,),
+                        state.duration + seconds(tracks[key])
+                    )
+                    (finished if grown.duration >= target_duration else expanded).append(grown)
+                if not options:
+                    finished.append(state)  # Library exhausted for this set
+
+            beam = heapq.nlargest(beam_width, expanded, key=lambda s: s.rank)
+
+        complete = [s for s in finished if s.duration >= target_duration] or finished
+        best = max(complete, key=lambda s: s.rank, default=None)
+        if best is None:
+            return [seed_track]
+        logger.info(f"Crafted a {len(best.keys)}-track set ({best.duration // 60} min, flow {best.rank:.2f})")
+        return [tracks[key] for key in best.keys]
@@ -1,6 +1,8 @@
 import logging
 import random
 
+from core.brain.loudness import TARGET_LUFS
+
 logger = logging.getLogger("AEN.Spectre")
 
 class SpectreAgent:
@@ -10,7 +12,7 @@ class SpectreAgent:
     """
     
     def __init__(self):
-        self.target_lufs = -14
+        self.target_lufs = TARGET_LUFS
         
     def mix_track(self, track_data: dict) -> dict:
         """
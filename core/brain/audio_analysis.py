@@ -0,0 +1,518 @@
+"""
+Audio Analysis for Neon Frequency
+=================================
+Offline analysis that fills the BPM, key, loudness, ramp and envelope
+fields of library tracks.
+
+Audio is decoded in fixed-size chunks and reduced to frame-level features
+(RMS, spectral flux, chroma, fingerprint band energies) with vectorized
+NumPy DSP, so memory stays flat regardless of track length. Loudness is
+measured on the same chunks before they are mixed down to mono (see
+loudness.py). Files are analysed across a process pool and results are
+cached by file hash.
+"""
+
+import os
+import wave
+import logging
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict
+from typing import Optional, List, Dict, Any, Iterator, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from core.brain.fingerprint import band_matrix, compute_fingerprint, to_hex
+from core.brain.envelope import compute_envelope
+from core.brain.loudness import LoudnessMeter
+
+logger = logging.getLogger("AEN.AudioAnalysis")
+
+
+ANALYSIS_RATE = 22050
+FRAME_SIZE = 2048
+HOP_SIZE = 512
+CHUNK_SECONDS = 10
+ANALYSIS_CHANNELS = 2  # Loudness is measured per channel
+
+# Bumped when stored results must be recomputed (2: K-weighted, gated loudness)
+ANALYSIS_VERSION = 2
+
+MIN_BPM = 60
+MAX_BPM = 200
+
+# Level used to find where the main body of a track starts and ends,
+# relative to its loud (90th percentile) short-term level
+BODY_THRESHOLD_DB = 6.0
+LEVEL_WINDOW_SECONDS = 1.0
+HOOK_WINDOW_SECONDS = 15.0
+
+PITCH_CLASSES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+
+# Krumhansl-Kessler key profiles
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+
+@dataclass
+class AnalysisResult:
+    """Analysed properties of one audio file."""
+    duration_seconds: float
+    bpm: Optional[int] = None
+    key: Optional[str] = None  # e.g., "Am", "C#"
+    loudness_lufs: Optional[float] = None
+    intro_seconds: float = 0.0
+    outro_seconds: float = 0.0
+    hook_start: Optional[float] = None
+    fingerprint: Optional[str] = None  # Hex acoustic fingerprint
+    envelope: Optional[str] = None  # Encoded edge envelopes (see envelope.py)
+    version: int = ANALYSIS_VERSION
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "AnalysisResult":
+        fields = cls.__dataclass_fields__
+        return cls(**{k: v for k, v in data.items() if k in fields})
+
+
+# ================== Decoding ==================
+
+def wav_samples(raw: bytes, width: int) -> np.ndarray:
+    """Convert raw little-endian PCM frames to interleaved float32 in [-1, 1)."""
+    if width == 1:
+        return (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    if width == 2:
+        return np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768
+    if width == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        ints = np.where(ints & 0x800000, ints - 0x1000000, ints)
+        return ints.astype(np.float32) / 8388608
+    return np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648
+
+
+def _read_wav_chunks(path: str, chunk_seconds: float) -> Tuple[int, Iterator[np.ndarray]]:
+    """Decode a PCM WAV file natively, without ffmpeg, keeping its channels."""
+    wav = wave.open(path, "rb")
+    rate = wav.getframerate()
+    channels = wav.getnchannels()
+    width = wav.getsampwidth()
+    frames_per_chunk = max(1, int(rate * chunk_seconds))
+
+    def chunks() -> Iterator[np.ndarray]:
+        with wav:
+            while True:
+                raw = wav.readframes(frames_per_chunk)
+                if not raw:
+                    break
+                yield wav_samples(raw, width).reshape(-1, channels)
+
+    return rate, chunks()
+
+
+def _read_ffmpeg_chunks(path: str, rate: int, channels: int, chunk_seconds: float) -> Iterator[np.ndarray]:
+    """Decode any format ffmpeg understands to float32 PCM."""
+    cmd = [
+        "ffmpeg", "-v", "error", "-nostdin", "-i", path,
+        "-f", "f32le", "-ac", str(channels), "-ar", str(rate), "-"
+    ]
+    frame_bytes = 4 * channels
+    chunk_bytes = int(rate * chunk_seconds) * frame_bytes
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        while True:
+            raw = process.stdout.read(chunk_bytes)
+            if not raw:
+                break
+            usable = len(raw) - len(raw) % frame_bytes
+            yield np.frombuffer(raw[:usable], dtype="<f4").reshape(-1, channels)
+    finally:
+        process.stdout.close()
+        stderr = process.stderr.read()
+        process.stderr.close()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to decode {path}: {stderr.decode(errors='replace').strip()}")
+
+
+def decode_chunks(
+    path: str,
+    rate: int = ANALYSIS_RATE,
+    chunk_seconds: float = CHUNK_SECONDS,
+    channels: int = ANALYSIS_CHANNELS
+) -> Tuple[int, Iterator[np.ndarray]]:
+    """
+    Open an audio file as a stream of (frames, channels) float32 chunks.
+
+    WAV files are read natively at their own rate and channel count;
+    everything else is decoded by ffmpeg to ``rate`` and ``channels``.
+
+    Returns:
+        (sample_rate, chunk iterator)
+    """
+    if path.lower().endswith(".wav"):
+        try:
+            return _read_wav_chunks(path, chunk_seconds)
+        except wave.Error:
+            pass  # Compressed WAV; let ffmpeg handle it
+    return rate, _read_ffmpeg_chunks(path, rate, channels, chunk_seconds)
+
+
+# ================== Feature extraction ==================
+
+class FrameFeatures:
+    """
+    Streaming frame-level feature extractor.
+
+    Feed chunks of mono samples; frames continue seamlessly across chunk
+    boundaries. Collects per-hop mean square, spectral flux, per-frame
+    fingerprint band energies and a track-wide chroma profile.
+    """
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self._window = np.hanning(FRAME_SIZE).astype(np.float32)
+        self._buffer = np.zeros(0, dtype=np.float32)
+        self._prev_spectrum: Optional[np.ndarray] = None
+        self._flux: List[np.ndarray] = []
+        self._power: List[np.ndarray] = []
+        self._bands: List[np.ndarray] = []
+        self.chroma = np.zeros(12)
+        self.samples = 0
+
+        freqs = np.fft.rfftfreq(FRAME_SIZE, 1.0 / rate)
+        bins = np.where((freqs >= 55.0) & (freqs <= 5000.0))[0]
+        pitch = np.round(69 + 12 * np.log2(freqs[bins] / 440.0)).astype(int) % 12
+        self._chroma_map = np.zeros((len(freqs), 12), dtype=np.float32)
+        self._chroma_map[bins, pitch] = 1.0
+        self._band_map = band_matrix(rate, FRAME_SIZE)
+
+    @property
+    def frame_rate(self) -> float:
+        """Feature frames per second."""
+        return self.rate / HOP_SIZE
+
+    def feed(self, samples: np.ndarray):
+        self.samples += len(samples)
+        buffer = np.concatenate([self._buffer, samples.astype(np.float32, copy=False)])
+        if len(buffer) < FRAME_SIZE:
+            self._buffer = buffer
+            return
+
+        frames = sliding_window_view(buffer, FRAME_SIZE)[::HOP_SIZE]
+        consumed = len(frames) * HOP_SIZE
+        self._buffer = buffer[consumed:]
+
+        # Each hop's leading samples tile the consumed region exactly once
+        self._power.append(np.mean(np.square(frames[:, :HOP_SIZE]), axis=1))
+
+        magnitude = np.abs(np.fft.rfft(frames * self._window, axis=1))
+        spectrum = np.log1p(magnitude)
+        previous = spectrum[:-1]
+        if self._prev_spectrum is not None:
+            previous = np.vstack([self._prev_spectrum[None, :], previous])
+        else:
+            previous = np.vstack([spectrum[:1], previous])
+        self._flux.append(np.maximum(spectrum - previous, 0.0).sum(axis=1))
+        self._prev_spectrum = spectrum[-1]
+
+        energy = np.square(magnitude)
+        self.chroma += energy.sum(axis=0) @ self._chroma_map
+        self._bands.append(energy @ self._band_map)
+
+    @property
+    def band_energy(self) -> np.ndarray:
+        """Per-frame fingerprint band energies: (frames, bands)."""
+        if not self._bands:
+            return np.zeros((0, self._band_map.shape[1]), dtype=np.float32)
+        return np.concatenate(self._bands)
+
+    def finish(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Flush the remaining samples.
+
+        Returns:
+            (per-hop mean square power, per-frame onset strength)
+        """
+        tail = self._buffer
+        if len(tail):
+            hops = len(tail) // HOP_SIZE + (1 if len(tail) % HOP_SIZE else 0)
+            padded = np.zeros(hops * HOP_SIZE, dtype=np.float32)
+            padded[:len(tail)] = tail
+            self._power.append(np.mean(np.square(padded.reshape(hops, HOP_SIZE)), axis=1))
+            self._buffer = np.zeros(0, dtype=np.float32)
+
+        power = np.concatenate(self._power) if self._power else np.zeros(0)
+        flux = np.concatenate(self._flux) if self._flux else np.zeros(0)
+        return power, flux
+
+
+def estimate_bpm(onset: np.ndarray, frame_rate: float) -> Optional[int]:
+    """Estimate tempo from the autocorrelation of an onset envelope."""
+    if len(onset) < frame_rate * 4 or not np.any(onset):
+        return None
+
+    envelope = onset - onset.mean()
+    n = len(envelope)
+    size = 1 << int(np.ceil(np.log2(2 * n)))
+    spectrum = np.fft.rfft(envelope, size)
+    autocorr = np.fft.irfft(spectrum * np.conj(spectrum), size)[:n]
+
+    min_lag = int(np.floor(frame_rate * 60 / MAX_BPM))
+    max_lag = min(n - 1, int(np.ceil(frame_rate * 60 / MIN_BPM)))
+    if max_lag <= min_lag:
+        return None
+
+    lags = np.arange(max(1, min_lag), max_lag + 1)
+    bpms = 60.0 * frame_rate / lags
+    # Mild log-normal preference for tempos around 120 BPM resolves
+    # half/double-time ambiguity the way a listener would
+    prior = np.exp(-0.5 * np.square(np.log2(bpms / 120.0)))
+    scores = autocorr[lags] * prior
+    best = int(np.argmax(scores))
+    if scores[best] <= 0:
+        return None
+
+    # Parabolic interpolation around the peak for sub-frame lag accuracy
+    lag = float(lags[best])
+    if 0 < best < len(lags) - 1:
+        a, b, c = autocorr[lags[best] - 1], autocorr[lags[best]], autocorr[lags[best] + 1]
+        denom = a - 2 * b + c
+        if denom != 0:
+            lag += 0.5 * (a - c) / denom
+    return int(round(60.0 * frame_rate / lag))
+
+
+def estimate_key(chroma: np.ndarray) -> Optional[str]:
+    """Estimate the musical key from a chroma profile (Krumhansl-Schmuckler)."""
+    if not np.any(chroma):
+        return None
+
+    profile = chroma / chroma.max()
+    best_score, best_key = -np.inf, None
+    for tonic in range(12):
+        rotated = np.roll(profile, -tonic)
+        for template, suffix in ((MAJOR_PROFILE, ""), (MINOR_PROFILE, "m")):
+            score = np.corrcoef(rotated, template)[0, 1]
+            if score > best_score:
+                best_score, best_key = score, PITCH_CLASSES[tonic] + suffix
+    return best_key
+
+
+def _moving_average(values: np.ndarray, width: int) -> np.ndarray:
+    width = max(1, min(width, len(values)))
+    cumsum = np.concatenate([[0.0], np.cumsum(values)])
+    averaged = (cumsum[width:] - cumsum[:-width]) / width
+    # Centre the window and pad the edges with the nearest value
+    pad_left = (width - 1) // 2
+    pad_right = len(values) - len(averaged) - pad_left
+    return np.pad(averaged, (pad_left, pad_right), mode="edge")
+
+
+def find_ramps(power: np.ndarray, frame_rate: float) -> Tuple[float, float, Optional[float]]:
+    """
+    Locate the intro, outro and hook from short-term levels.
+
+    The intro ends where the level first comes within BODY_THRESHOLD_DB of
+    the track's loud level; the outro starts where it last does. The hook
+    is the loudest HOOK_WINDOW_SECONDS window after the intro.
+
+    Returns:
+        (intro_seconds, outro_seconds, hook_start)
+    """
+    if not len(power) or not np.any(power):
+        return 0.0, 0.0, None
+
+    level = _moving_average(power, int(LEVEL_WINDOW_SECONDS * frame_rate))
+    with np.errstate(divide="ignore"):
+        level_db = 10 * np.log10(level)
+    threshold = np.percentile(level_db[np.isfinite(level_db)], 90) - BODY_THRESHOLD_DB
+    body = np.flatnonzero(level_db >= threshold)
+
+    intro_frames = int(body[0])
+    outro_frames = len(power) - int(body[-1]) - 1
+    intro = round(intro_frames / frame_rate, 2)
+    outro = round(outro_frames / frame_rate, 2)
+
+    hook = None
+    window = int(HOOK_WINDOW_SECONDS * frame_rate)
+    if len(power) - intro_frames > window:
+        cumsum = np.concatenate([[0.0], np.cumsum(power[intro_frames:])])
+        sums = cumsum[window:] - cumsum[:-window]
+        hook = round((intro_frames + int(np.argmax(sums))) / frame_rate, 2)
+    return intro, outro, hook
+
+
+def analyze_chunks(rate: int, chunks: Iterator[np.ndarray]) -> AnalysisResult:
+    """Analyse a stream of sample chunks, mono or (frames, channels)."""
+    features = FrameFeatures(rate)
+    meter = LoudnessMeter(rate)
+    for chunk in chunks:
+        meter.feed(chunk)
+        features.feed(chunk.mean(axis=1) if chunk.ndim == 2 else chunk)
+    power, flux = features.finish()
+
+    intro, outro, hook = find_ramps(power, features.frame_rate)
+    fingerprint = compute_fingerprint(features.band_energy)
+    envelope = compute_envelope(power, flux, features.frame_rate)
+    return AnalysisResult(
+        duration_seconds=round(features.samples / rate, 2),
+        bpm=estimate_bpm(flux, features.frame_rate),
+        key=estimate_key(features.chroma),
+        loudness_lufs=meter.integrated(),
+        intro_seconds=intro,
+        outro_seconds=outro,
+        hook_start=hook,
+        fingerprint=to_hex(fingerprint) if fingerprint is not None else None,
+        envelope=envelope.encode() if envelope is not None else None
+    )
+
+
+def analyze_file(path: str) -> AnalysisResult:
+    """
+    Analyse one audio file.
+
+    Module-level so it can run in worker processes.
+    """
+    rate, chunks = decode_chunks(path)
+    return analyze_chunks(rate, chunks)
+
+
+def _analyze_safe(path: str) -> Tuple[Optional[AnalysisResult], Optional[str]]:
+    try:
+        return analyze_file(path), None
+    except Exception as e:
+        return None, str(e)
+
+
+# ================== Batch engine ==================
+
+class AudioAnalyzer:
+    """
+    Batch analysis engine.
+
+    Results are cached in the library store by file hash, so each file is
+    decoded once no matter how often it is rescanned or moved.
+    """
+
+    def __init__(self, store: Any = None, max_workers: Optional[int] = None):
+        self.store = store
+        self.max_workers = max_workers or os.cpu_count() or 1
+
+    def analyze(
+        self,
+        files: List[Tuple[str, str]],
+        force: bool = False
+    ) -> Iterator[Tuple[str, AnalysisResult]]:
+        """
+        Analyse files, serving cached results where possible.
+
+        Args:
+            files: (file_hash, path) pairs
+            force: Re-analyse even when a cached result exists
+
+        Yields:
+            (file_hash, result) for every file that could be analysed
+        """
+        cached: Dict[str, Dict[str, Any]] = {}
+        if self.store is not None and not force:
+            cached = self.store.get_analysis([file_hash for file_hash, _ in files])
+
+        pending = []
+        for file_hash, path in files:
+            # Results from older analysers are re-analysed
+            if file_hash in cached and cached[file_hash].get("version", 1) >= ANALYSIS_VERSION:
+                yield file_hash, AnalysisResult.from_dict(cached[file_hash])
+            else:
+                pending.append((file_hash, path))
+
+        if not pending:
+            return
+
+        logger.info(f"Analysing {len(pending)} files ({len(files) - len(pending)} cached)")
+        for (file_hash, path), (result, error) in zip(pending, self._run(pending)):
+            if result is None:
+                logger.error(f"Analysis failed for {path}: {error}")
+                continue
+            if self.store is not None:
+                self.store.put_analysis({file_hash: result.to_dict()})
+            yield file_hash, result
+
+    def _run(self, pending: List[Tuple[str, str]]) -> Iterator[Tuple[Optional[AnalysisResult], Optional[str]]]:
+        paths = [path for _, path in pending]
+        if len(paths) == 1 or self.max_workers == 1:
+            yield from map(_analyze_safe, paths)
+            return
+
+        with ProcessPoolExecutor(max_workers=min(self.max_workers, len(paths))) as executor:
+            yield from executor.map(_analyze_safe, paths)
+
+
+def apply_analysis(track: Any, result: AnalysisResult) -> None:
+    """Copy analysis onto a TrackMetadata, keeping BPM, key and loudness already set."""
+    if track.bpm is None:
+        track.bpm = result.bpm
+    if track.key is None:
+        track.key = result.key
+    if track.loudness_lufs is None:
+        track.loudness_lufs = result.loudness_lufs
+    if not track.duration_seconds:
+        track.duration_seconds = int(round(result.duration_seconds))
+    track.intro_seconds = result.intro_seconds
+    track.outro_seconds = result.outro_seconds
+    track.hook_start = result.hook_start
+    if result.fingerprint:
+        track.fingerprint = result.fingerprint
+    if result.envelope:
+        track.envelope = result.envelope
+
+
+def analyze_library(
+    library: Any,
+    tracks: List[Any],
+    max_workers: Optional[int] = None,
+    force: bool = False
+) -> int:
+    """
+    Fill BPM, key, loudness, duration and ramp fields from the audio.
+
+    Analysis is cached by file hash, so only files never analysed
+    before are decoded. BPM, key and loudness already set (e.g. from
+    tags) are kept; intro, outro and hook always come from the audio.
+
+    Args:
+        library: MusicLibrary the tracks belong to
+        tracks: Tracks to analyse
+        max_workers: Worker pool size (defaults to CPU count)
+        force: Re-analyse even when a cached result exists
+
+    Returns:
+        Number of tracks updated
+    """
+    by_hash: Dict[str, List[Any]] = {}
+    for track in tracks:
+        if os.path.exists(track.file_path):
+            by_hash.setdefault(track.file_hash or track.file_path, []).append(track)
+    if not by_hash:
+        return 0
+
+    analyzer = AudioAnalyzer(library.store, max_workers=max_workers)
+    files = [(file_hash, group[0].file_path) for file_hash, group in by_hash.items()]
+    catalog = library.tracks
+    updated = []
+    for file_hash, result in analyzer.analyze(files, force=force):
+        for track in by_hash[file_hash]:
+            apply_analysis(track, result)
+            key = track.file_hash or track.file_path
+            stored = catalog.get(key)
+            if stored is not None and stored.file_path == track.file_path:
+                # Compact catalogs hand out views, so update the row too
+                if stored is not track:
+                    apply_analysis(stored, result)
+                updated.append(key)
+
+    library.update_tracks(updated)
+    logger.info(f"Analysed {len(files)} files, updated {len(updated)} library tracks")
+    return len(updated)
@@ -0,0 +1,220 @@
+"""
+Bed Cache for Neon Frequency
+============================
+Decoded music beds, kept ready to mix.
+
+Beds are short loops reused hundreds of times a day. The first mix with a
+bed decodes it once to float32 PCM at the mix format; later mixes read
+that array directly. Arrays are held in a bounded in-memory LRU and,
+optionally, saved as ``.npy`` files that are memory-mapped back in, so
+other processes and restarts skip decoding as well.
+"""
+
+import os
+import glob
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Tuple
+
+import numpy as np
+
+from core.brain.mix_engine import PCMReader, MIX_RATE, MIX_CHANNELS, BLOCK_FRAMES
+from core.brain.loudness import integrated_loudness
+
+logger = logging.getLogger("AEN.BedCache")
+
+
+DEFAULT_MAX_MB = 256
+
+_Key = Tuple[str, int, int, int, int]  # path, mtime_ns, size, rate, channels
+
+
+class BedCache:
+    """
+    LRU of decoded beds, bounded by total size in bytes.
+
+    Entries are keyed by the file's path, modification time and size (so
+    an edited bed is decoded again) and by the mix format. Arrays are
+    read-only; a bed larger than the whole budget is returned but not kept
+    in memory. A cache sent to a worker process arrives as that process's
+    own cache with the same configuration, so workers keep beds decoded
+    across jobs.
+    """
+
+    def __init__(
+        self,
+        max_bytes: Optional[int] = None,
+        cache_dir: Optional[str] = None,
+        rate: int = MIX_RATE,
+        channels: int = MIX_CHANNELS
+    ):
+        if max_bytes is None:
+            max_bytes = int(os.getenv("BED_CACHE_MB", DEFAULT_MAX_MB)) * 1024 * 1024
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.rate = rate
+        self.channels = channels
+        self._entries: "OrderedDict[_Key, np.ndarray]" = OrderedDict()
+        self._loudness: Dict[_Key, Optional[float]] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def __reduce__(self):
+        return (_shared_cache, (self.max_bytes, self.cache_dir, self.rate, self.channels))
+
+    def _key(self, path: str) -> _Key:
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        return (path, stat.st_mtime_ns, stat.st_size, self.rate, self.channels)
+
+    def get(self, path: str) -> np.ndarray:
+        """
+        Decoded PCM of a bed, (frames, channels) float32.
+
+        Raises:
+            OSError, RuntimeError: If the bed cannot be read or decoded
+        """
+        key = self._key(path)
+        with self._lock:
+            samples = self._entries.get(key)
+            if samples is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return samples
+
+        samples = self._load(key)
+        if samples is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            samples = self._decode(path)
+            self._save(key, samples)
+
+        self._remember(key, samples)
+        return samples
+
+    def _decode(self, path: str) -> np.ndarray:
+        blocks = []
+        with PCMReader(path, self.rate, self.channels) as reader:
+            while True:
+                block = reader.read(BLOCK_FRAMES * 16)
+                if not len(block):
+                    break
+                blocks.append(block)
+        samples = np.concatenate(blocks) if blocks else np.zeros((0, self.channels), dtype=np.float32)
+        samples.flags.writeable = False
+        logger.info(f"Decoded bed {os.path.basename(path)} ({len(samples) / self.rate:.1f}s)")
+        return samples
+
+    def _remember(self, key: _Key, samples: np.ndarray):
+        if samples.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            self._entries[key] = samples
+            self._bytes += samples.nbytes
+            while self._bytes > self.max_bytes:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._loudness.pop(evicted_key, None)
+                self._bytes -= evicted.nbytes
+
+    def loudness(self, path: str, samples: Optional[np.ndarray] = None) -> Optional[float]:
+        """
+        Integrated loudness of a bed (LUFS), measured once while it is cached.
+
+        ``samples`` is the bed's decoded PCM if the caller already has it.
+        """
+        key = self._key(path)
+        with self._lock:
+            if key in self._loudness:
+                return self._loudness[key]
+        value = integrated_loudness(samples if samples is not None else self.get(path), self.rate)
+        with self._lock:
+            if key in self._entries:
+                self._loudness[key] = value
+        return value
+
+    # Disk tier
+
+    def _disk_path(self, key: _Key) -> str:
+        source = hashlib.sha1(key[0].encode("utf-8")).hexdigest()[:16]
+        version = hashlib.sha1(repr(key[1:]).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{source}-{version}.npy")
+
+    def _load(self, key: _Key) -> Optional[np.ndarray]:
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            samples = np.load(path, mmap_mode="r")
+        except (OSError, ValueError) as e:
+            logger.warning(f"Discarding unreadable bed cache file {path}: {e}")
+            return None
+        if samples.ndim != 2 or samples.shape[1] != self.channels or samples.dtype != np.float32:
+            return None
+        return samples
+
+    def _save(self, key: _Key, samples: np.ndarray):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"  # Threads may save one bed at once
+        try:
+            with open(tmp_path, "wb") as f:
+                np.save(f, samples)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write bed cache file {path}: {e}")
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            return
+        # Older decodes of the same file are stale now
+        source = os.path.basename(path).split("-")[0]
+        for stale in glob.glob(os.path.join(self.cache_dir, f"{source}-*.npy")):
+            if stale != path:
+                try:
+                    os.unlink(stale)
+                except OSError:
+                    pass
+
+    def clear(self):
+        """Drop all in-memory entries (disk files are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self._loudness.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+
+_shared: Dict[tuple, BedCache] = {}
+
+
+def _shared_cache(max_bytes: int, cache_dir: Optional[str], rate: int, channels: int) -> BedCache:
+    """This process's BedCache for a configuration."""
+    config = (max_bytes, cache_dir, rate, channels)
+    cache = _shared.get(config)
+    if cache is None:
+        cache = _shared[config] = BedCache(max_bytes, cache_dir, rate, channels)
+    return cache
@@ -0,0 +1,555 @@
+"""
+Compact Catalog for Neon Frequency
+==================================
+Array-backed track storage for very large libraries.
+
+Instead of one ``TrackMetadata`` object per track (an instance dict, two
+lists, enum references and datetimes), every field lives in a NumPy
+column and strings live in shared tables. ``TrackView`` objects expose a
+row with the same attributes as ``TrackMetadata``, so existing callers
+keep working.
+
+This falls short of an order-of-magnitude saving. On a 50k-track
+synthetic catalog the rows take about 265 B per track, against about
+770 B as TrackMetadata objects, so roughly 3x. Paths, titles and hashes
+alone are over 100 B of UTF-8 per track, and the key -> row dict still
+holds one Python string per track. The library's indexes are not
+columnar either. With them, a whole library holds about 2.6 KB per track
+in compact mode against 2.9 KB without it. Most of that is the search
+index postings (about 1.3 KB) and the rotation entries (about 0.5 KB).
+Those would have to move onto arrays to close the gap.
+
+A catalog can be saved as a versioned binary snapshot and re-opened with
+its columns and string blobs memory-mapped copy-on-write, so a process
+starts without decoding any track and the OS shares the pages between
+processes.
+"""
+
+import os
+import json
+import struct
+import logging
+import tempfile
+from array import array
+from datetime import datetime
+from typing import Optional, List, Dict, Any, Iterator, Tuple
+from collections.abc import MutableMapping
+
+import numpy as np
+
+from core.brain.music_library import TrackMetadata, Genre, Energy
+
+logger = logging.getLogger("AEN.CompactCatalog")
+
+
+GENRES = list(Genre)
+GENRE_CODES = {genre: i for i, genre in enumerate(GENRES)}
+
+
+class StringTable:
+    """
+    Interned strings for low-cardinality columns (artist, album, key...).
+
+    Each distinct value is stored once and referenced by an int32 id;
+    -1 stands for None.
+    """
+
+    def __init__(self, values: List[Any] = None):
+        self.values: List[Any] = list(values or [])
+        self._ids: Optional[Dict[Any, int]] = None  # Built on first intern
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def intern(self, value: Any) -> int:
+        if value is None:
+            return -1
+        if self._ids is None:
+            self._ids = {v: i for i, v in enumerate(self.values)}
+        i = self._ids.get(value)
+        if i is None:
+            i = self._ids[value] = len(self.values)
+            self.values.append(value)
+        return i
+
+    def get(self, i: int) -> Any:
+        return None if i < 0 else self.values[i]
+
+
+class BlobStrings:
+    """
+    Append-only UTF-8 storage for high-cardinality strings (paths, titles).
+
+    Strings are packed into one byte buffer with an offsets array and
+    decoded on access, avoiding a Python object per value. A read-only
+    base (e.g. memory-mapped from a snapshot) can sit underneath; new
+    strings are appended after it.
+    """
+
+    def __init__(self, base_blob: np.ndarray = None, base_offsets: np.ndarray = None):
+        self._base_blob = base_blob
+        self._base_offsets = base_offsets
+        self._base_count = len(base_offsets) - 1 if base_offsets is not None else 0
+        self._blob = bytearray()
+        self._offsets = array("Q", [0])
+
+    def __len__(self) -> int:
+        return self._base_count + len(self._offsets) - 1
+
+    def append(self, value: Optional[str]) -> int:
+        if value is None:
+            return -1
+        self._blob += value.encode("utf-8")
+        self._offsets.append(len(self._blob))
+        return self._base_count + len(self._offsets) - 2
+
+    def get(self, i: int) -> Optional[str]:
+        if i < 0:
+            return None
+        if i < self._base_count:
+            start, end = self._base_offsets[i], self._base_offsets[i + 1]
+            return self._base_blob[start:end].tobytes().decode("utf-8")
+        i -= self._base_count
+        return self._blob[self._offsets[i]:self._offsets[i + 1]].decode("utf-8")
+
+    def packed(self) -> Tuple[bytes, np.ndarray]:
+        """All strings as one (blob, offsets) pair, base included."""
+        local_offsets = np.frombuffer(self._offsets, dtype=np.uint64)
+        if self._base_offsets is None:
+            return bytes(self._blob), local_offsets.copy()
+        base_end = self._base_offsets[-1]
+        blob = self._base_blob[:base_end].tobytes() + bytes(self._blob)
+        offsets = np.concatenate([self._base_offsets, local_offsets[1:] + base_end])
+        return blob, offsets
+
+    @property
+    def nbytes(self) -> int:
+        base = 0
+        if self._base_offsets is not None:
+            base = int(self._base_offsets[-1]) + self._base_offsets.nbytes
+        return base + len(self._blob) + self._offsets.itemsize * len(self._offsets)
+
+
+# Column name -> (dtype, missing value)
+NUMERIC_COLUMNS: Dict[str, Tuple[Any, Any]] = {
+    "genre": (np.int8, -1),
+    "bpm": (np.int16, -1),
+    "duration_seconds": (np.int32, 0),
+    "energy": (np.int8, Energy.MEDIUM.value),
+    "year": (np.int16, -1),
+    "sample_rate": (np.int32, 44100),
+    "bitrate": (np.int16, 320),
+    "loudness_lufs": (np.float32, np.nan),
+    "last_played": (np.float64, np.nan),
+    "play_count": (np.int32, 0),
+    "intro_seconds": (np.float32, 0.0),
+    "outro_seconds": (np.float32, 0.0),
+    "hook_start": (np.float32, np.nan),
+    "is_generated": (np.bool_, False),
+}
+
+# Interned string columns (low cardinality); tags/mood intern whole tuples
+INTERNED_COLUMNS = ["artist", "album", "key", "rotation_category", "generation_source", "tags", "mood"]
+
+# Packed string columns (mostly unique per track)
+BLOB_COLUMNS = ["file_path", "title", "generation_prompt", "file_hash", "fingerprint", "envelope"]
+
+# String id meaning "same as the row's catalog key" (tracks are keyed by hash)
+KEY_STRING = -2
+
+SNAPSHOT_MAGIC = b"AENSNAP\0"
+SNAPSHOT_VERSION = 2  # v2: envelope column
+_SNAPSHOT_HEADER = struct.Struct("<8sIQ")  # magic, version, manifest length
+_ALIGN = 64
+
+
+def _encode(field: str, value: Any) -> Any:
+    """Convert a TrackMetadata attribute to its column representation."""
+    missing = NUMERIC_COLUMNS[field][1]
+    if value is None:
+        return missing
+    if field == "genre":
+        return GENRE_CODES[value]
+    if field == "energy":
+        return value.value
+    if field == "last_played":
+        return value.timestamp()
+    return value
+
+
+def _decode(field: str, value: Any) -> Any:
+    """Convert a column value back to the TrackMetadata representation."""
+    if field == "genre":
+        return GENRES[int(value)] if value >= 0 else Genre.OTHER
+    if field == "energy":
+        return Energy(int(value))
+    if field == "is_generated":
+        return bool(value)
+    if field in ("loudness_lufs", "hook_start"):
+        return None if np.isnan(value) else float(value)
+    if field == "last_played":
+        return None if np.isnan(value) else datetime.fromtimestamp(float(value))
+    if field in ("intro_seconds", "outro_seconds"):
+        return float(value)
+    if field in ("bpm", "year"):
+        return None if value < 0 else int(value)
+    return int(value)
+
+
+class _Field:
+    """Descriptor mapping a TrackView attribute onto its catalog column."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __get__(self, view: "TrackView", owner=None):
+        if view is None:
+            return self
+        return view._catalog.get_field(view._row, self.name)
+
+    def __set__(self, view: "TrackView", value: Any):
+        view._catalog.set_field(view._row, self.name, value)
+
+
+class TrackView:
+    """
+    Lightweight, attribute-compatible view of one catalog row.
+
+    Reads and writes go straight to the columns. List fields (tags, mood)
+    come back as fresh lists: assign a new list to change them.
+    """
+
+    __slots__ = ("_catalog", "_row")
+
+    def __init__(self, catalog: "CompactCatalog", row: int):
+        self._catalog = catalog
+        self._row = row
+
+    # Share behaviour with TrackMetadata rather than duplicating it
+    to_dict = TrackMetadata.to_dict
+    matches_search = TrackMetadata.matches_search
+
+    def to_track(self) -> TrackMetadata:
+        """Materialise a standalone TrackMetadata copy."""
+        return TrackMetadata.from_dict(self.to_dict())
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, TrackView) and other._catalog is self._catalog:
+            return other._row == self._row
+        if isinstance(other, (TrackView, TrackMetadata)):
+            return self.to_dict() == other.to_dict()
+        return NotImplemented
+
+    __hash__ = None  # Mutable, like TrackMetadata
+
+    def __repr__(self) -> str:
+        return f"TrackView({self.artist!r} - {self.title!r})"
+
+
+for _name in TrackMetadata.__dataclass_fields__:
+    setattr(TrackView, _name, _Field(_name))
+
+
+class CompactCatalog(MutableMapping):
+    """
+    Columnar mapping of track key -> TrackView.
+
+    Drop-in replacement for the library's ``Dict[str, TrackMetadata]``.
+    Rows of removed tracks are reused; their packed strings are not
+    reclaimed until the catalog is rebuilt.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._capacity = 0
+        self._columns: Dict[str, np.ndarray] = {
+            name: np.empty(0, dtype=dtype) for name, (dtype, _) in NUMERIC_COLUMNS.items()
+        }
+        self._string_ids: Dict[str, np.ndarray] = {
+            name: np.empty(0, dtype=np.int32) for name in INTERNED_COLUMNS + BLOB_COLUMNS
+        }
+        self._interned = {name: StringTable() for name in INTERNED_COLUMNS}
+        self._blobs = {name: BlobStrings() for name in BLOB_COLUMNS}
+        self._grow(capacity)
+
+        self._rows: Dict[str, int] = {}
+        self._keys: List[Optional[str]] = []
+        self._free: List[int] = []
+
+    def _grow(self, capacity: int):
+        old = self._capacity
+        if capacity <= old:
+            return
+        for name, (dtype, missing) in NUMERIC_COLUMNS.items():
+            grown = np.full(capacity, missing, dtype=dtype)
+            grown[:old] = self._columns[name][:old]
+            self._columns[name] = grown
+        for name, ids in self._string_ids.items():
+            grown = np.full(capacity, -1, dtype=np.int32)
+            grown[:old] = ids[:old]
+            self._string_ids[name] = grown
+        self._capacity = capacity
+
+    # ---- field access ----
+
+    def get_field(self, row: int, name: str) -> Any:
+        if name in self._columns:
+            return _decode(name, self._columns[name][row])
+        i = int(self._string_ids[name][row])
+        if i == KEY_STRING:
+            return self._keys[row]
+        if name in self._blobs:
+            value = self._blobs[name].get(i)
+        else:
+            value = self._interned[name].get(i)
+        if name in ("tags", "mood"):
+            return list(value) if value else []
+        return value
+
+    def set_field(self, row: int, name: str, value: Any):
+        if name in self._columns:
+            self._columns[name][row] = _encode(name, value)
+        elif name in self._blobs:
+            if value is not None and value == self._keys[row]:
+                self._string_ids[name][row] = KEY_STRING
+            else:
+                self._string_ids[name][row] = self._blobs[name].append(value)
+        else:
+            if name in ("tags", "mood"):
+                value = tuple(value) if value else None
+            self._string_ids[name][row] = self._interned[name].intern(value)
+
+    # ---- mapping interface ----
+
+    def __getitem__(self, key: str) -> TrackView:
+        return TrackView(self, self._rows[key])
+
+    def __setitem__(self, key: str, track: Any):
+        row = self._rows.get(key)
+        if row is None:
+            if self._free:
+                row = self._free.pop()
+                self._keys[row] = key
+            else:
+                row = len(self._keys)
+                if row >= self._capacity:
+                    self._grow(max(1024, self._capacity * 2))
+                self._keys.append(key)
+            self._rows[key] = row
+
+        if isinstance(track, TrackView) and track._catalog is self and track._row == row:
+            return
+        for name in TrackMetadata.__dataclass_fields__:
+            self.set_field(row, name, getattr(track, name))
+
+    def __delitem__(self, key: str):
+        row = self._rows.pop(key)
+        self._keys[row] = None
+        self._free.append(row)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._rows)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._rows
+
+    def pop(self, key: str, *default: Any) -> Any:
+        """Remove a track, returning a standalone copy of it."""
+        if key not in self._rows:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        track = self[key].to_track()
+        del self[key]
+        return track
+
+    def column(self, name: str) -> np.ndarray:
+        """Raw numeric column over allocated rows (including free ones)."""
+        return self._columns[name][:len(self._keys)]
+
+    def _decoded_column(self, name: str, n: int) -> List[Any]:
+        """Decode one field for rows [0, n) in bulk."""
+        if name in self._columns:
+            column = self._columns[name][:n]
+            if name == "genre":
+                return [GENRES[c] if c >= 0 else Genre.OTHER for c in column.tolist()]
+            if name == "energy":
+                energies = {e.value: e for e in Energy}
+                return [energies[c] for c in column.tolist()]
+            if name == "last_played":
+                return [None if v != v else datetime.fromtimestamp(v) for v in column.tolist()]
+            if name in ("loudness_lufs", "hook_start"):
+                return [None if v != v else v for v in column.tolist()]
+            if name in ("bpm", "year"):
+                return [None if v < 0 else v for v in column.tolist()]
+            return column.tolist()
+
+        ids = self._string_ids[name][:n].tolist()
+        if name in self._blobs:
+            blob = self._blobs[name]
+            return [self._keys[row] if i == KEY_STRING else blob.get(i) for row, i in enumerate(ids)]
+        values = self._interned[name].values
+        if name in ("tags", "mood"):
+            return [list(values[i]) if i >= 0 else [] for i in ids]
+        return [values[i] if i >= 0 else None for i in ids]
+
+    def iter_tracks(self) -> Iterator[Tuple[str, TrackMetadata]]:
+        """
+        Materialise every track as a standalone TrackMetadata.
+
+        Decodes column by column, which is far faster than reading each
+        field through a view when the whole catalog is needed (e.g. to
+        build indexes).
+        """
+        n = len(self._keys)
+        names = list(TrackMetadata.__dataclass_fields__)
+        columns = [self._decoded_column(name, n) for name in names]
+        for row, values in enumerate(zip(*columns)):
+            key = self._keys[row]
+            if key is not None:
+                yield key, TrackMetadata(**dict(zip(names, values)))
+
+    @classmethod
+    def from_tracks(cls, tracks: Dict[str, Any]) -> "CompactCatalog":
+        """Build a catalog from a key -> TrackMetadata mapping."""
+        catalog = cls(capacity=max(1024, len(tracks)))
+        for key, track in tracks.items():
+            catalog[key] = track
+        return catalog
+
+    # ---- snapshots ----
+
+    def save(self, path: str, meta: Dict[str, Any] = None):
+        """
+        Write the catalog as a binary snapshot (atomically replacing ``path``).
+
+        Layout: header, JSON manifest, then 64-byte aligned sections for
+        every column, string id array and string blob.
+        """
+        n = len(self._keys)
+        sections: List[Tuple[str, bytes]] = []
+        manifest: Dict[str, Any] = {
+            "version": SNAPSHOT_VERSION,
+            "rows": n,
+            "free": list(self._free),
+            "meta": meta or {},
+            "columns": {},
+            "string_ids": {},
+            "blobs": {},
+            "interned": {},
+        }
+
+        for name, column in self._columns.items():
+            manifest["columns"][name] = column.dtype.str
+            sections.append((f"column:{name}", column[:n].tobytes()))
+        for name, ids in self._string_ids.items():
+            sections.append((f"ids:{name}", ids[:n].tobytes()))
+        for name, blob in self._blobs.items():
+            data, offsets = blob.packed()
+            sections.append((f"blob:{name}", data))
+            sections.append((f"offsets:{name}", offsets.astype(np.uint64).tobytes()))
+        for name, table in self._interned.items():
+            manifest["interned"][name] = [list(v) if isinstance(v, tuple) else v for v in table.values]
+
+        keys = BlobStrings()
+        for key in self._keys:
+            keys.append(key or "")
+        data, offsets = keys.packed()
+        sections.append(("blob:__keys__", data))
+        sections.append(("offsets:__keys__", offsets.astype(np.uint64).tobytes()))
+
+        # Offsets are relative to the aligned start of the data area
+        position = 0
+        layout = {}
+        for name, payload in sections:
+            layout[name] = [position, len(payload)]
+            position += len(payload) + (-len(payload) % _ALIGN)
+        manifest["sections"] = layout
+
+        manifest_bytes = json.dumps(manifest).encode("utf-8")
+        header = _SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(manifest_bytes))
+        prefix = len(header) + len(manifest_bytes)
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".snapshot-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(header)
+                f.write(manifest_bytes)
+                f.write(b"\0" * (-prefix % _ALIGN))
+                for _, payload in sections:
+                    f.write(payload)
+                    f.write(b"\0" * (-len(payload) % _ALIGN))
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        logger.info(f"Saved catalog snapshot of {len(self)} tracks to {path}")
+
+    @classmethod
+    def load(cls, path: str) -> Tuple["CompactCatalog", Dict[str, Any]]:
+        """
+        Open a snapshot with its arrays memory-mapped copy-on-write.
+
+        Nothing is decoded except the keys; edits stay private to this
+        process and never touch the file.
+
+        Returns:
+            (catalog, meta saved with the snapshot)
+        """
+        with open(path, "rb") as f:
+            magic, version, manifest_length = _SNAPSHOT_HEADER.unpack(f.read(_SNAPSHOT_HEADER.size))
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not a catalog snapshot")
+            if version != SNAPSHOT_VERSION:
+                raise ValueError(f"Unsupported snapshot version {version}")
+            manifest = json.loads(f.read(manifest_length))
+
+        prefix = _SNAPSHOT_HEADER.size + manifest_length
+        data_start = prefix + (-prefix % _ALIGN)
+        # Plain ndarray views skip np.memmap's per-access Python overhead;
+        # they keep the mapping alive through their base
+        mapped = np.memmap(path, dtype=np.uint8, mode="c").view(np.ndarray)
+        layout = manifest["sections"]
+        n = manifest["rows"]
+
+        def section(name: str, dtype: Any) -> np.ndarray:
+            offset, length = layout[name]
+            start = data_start + offset
+            return mapped[start:start + length].view(dtype)
+
+        catalog = cls(capacity=0)
+        for name, dtype in manifest["columns"].items():
+            if name in catalog._columns:
+                catalog._columns[name] = section(f"column:{name}", np.dtype(dtype))
+        for name in catalog._string_ids:
+            catalog._string_ids[name] = section(f"ids:{name}", np.int32)
+        for name in BLOB_COLUMNS:
+            catalog._blobs[name] = BlobStrings(
+                section(f"blob:{name}", np.uint8), section(f"offsets:{name}", np.uint64)
+            )
+        for name, values in manifest["interned"].items():
+            if name in ("tags", "mood"):
+                values = [tuple(v) for v in values]
+            catalog._interned[name] = StringTable(values)
+        catalog._capacity = n
+
+        keys = BlobStrings(section("blob:__keys__", np.uint8), section("offsets:__keys__", np.uint64))
+        free = set(manifest["free"])
+        catalog._keys = [None if row in free else keys.get(row) for row in range(n)]
+        catalog._rows = {key: row for row, key in enumerate(catalog._keys) if key is not None}
+        catalog._free = list(manifest["free"])
+        return catalog, manifest["meta"]
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by columns and string tables."""
+        total = sum(c.nbytes for c in self._columns.values())
+        total += sum(ids.nbytes for ids in self._string_ids.values())
+        total += sum(blob.nbytes for blob in self._blobs.values())
+        return total
@@ -1,6 +1,5 @@
 print("DEBUG: STARTING CORTEX...")
 import asyncio
-import hashlib
 import telnetlib3
 import logging
 import os
@@ -153,9 +152,9 @@ async def generate_host_script(state: RadioState):
     
     # Generate voice audio using ElevenLabs
     try:
+        # Repeated scripts are served from the TTS cache and linked here
         cache_dir = os.getenv("AUDIO_CACHE_DIR", "/tmp")
-        script_hash = hashlib.sha256(script.encode("utf-8")).hexdigest()
-        audio_path = os.path.join(cache_dir, f"voice_{script_hash}.mp3")
+        audio_path = os.path.join(cache_dir, f"voice_{voice_client.cache_key(script)}.mp3")
         audio = await asyncio.to_thread(voice_client.generate, script, output_path=audio_path)
         if audio:
             state["voice_audio_path"] = audio_path
@@ -0,0 +1,259 @@
+"""
+Track Envelopes for Neon Frequency
+==================================
+Coarse loudness and energy envelopes of each track's edges, and segue
+planning from them.
+
+Analysis reduces the first and last EDGE_SECONDS of a track to short-term
+level (dB) and onset energy at ENVELOPE_RATE frames per second, quantised
+to one byte each and stored with the track (a few hundred bytes). Planning
+a segue then reads those bytes only: no audio is decoded at decision time,
+and a whole queue of segues is planned with a few array operations.
+"""
+
+import base64
+import struct
+import logging
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, List, Sequence
+
+import numpy as np
+
+logger = logging.getLogger("AEN.Envelope")
+
+
+ENVELOPE_VERSION = 1
+ENVELOPE_RATE = 2  # Frames per second
+EDGE_SECONDS = 30  # Length of the head and tail envelopes
+EDGE_FRAMES = EDGE_SECONDS * ENVELOPE_RATE
+
+# Level bytes are 0.5 dB steps below full scale; 255 is silence
+LEVEL_STEP_DB = 0.5
+SILENT_LEVEL = 255
+# Energy bytes are onset strength relative to the body (255 = body level or more)
+
+_HEADER = struct.Struct("<BBhHHf")  # version, rate, body level (0.5 dB), head, tail, duration
+
+# Segue planning, relative to each track's body (90th percentile) level
+FADE_DROP_DB = 6.0  # Below this the outgoing track is fading out
+AUDIBLE_DROP_DB = 30.0  # Below this a track's edge is effectively silent
+MIN_OVERLAP = 0.5
+MAX_OVERLAP = 12.0
+COLD_OVERLAP = 1.0  # Hard ending into a hot start
+CLASH_OVERLAP = 2.0  # Two energetic edges whose tempos do not match
+ENERGETIC = 0.6  # Edge energy (fraction of body) counted as energetic
+TEMPO_MATCH = 0.03  # Tempos within 3% can overlap for longer
+
+
+@dataclass
+class Envelope:
+    """Decoded edge envelopes of one track."""
+    duration: float
+    body_db: float
+    head_db: np.ndarray
+    head_energy: np.ndarray  # 0.0-1.0
+    tail_db: np.ndarray
+    tail_energy: np.ndarray
+
+    def encode(self) -> str:
+        """Pack into a compact ASCII string for catalog storage."""
+        def level_bytes(db: np.ndarray) -> bytes:
+            return np.clip(np.round(-db / LEVEL_STEP_DB), 0, SILENT_LEVEL).astype(np.uint8).tobytes()
+
+        def energy_bytes(energy: np.ndarray) -> bytes:
+            return np.clip(np.round(energy * 255), 0, 255).astype(np.uint8).tobytes()
+
+        header = _HEADER.pack(
+            ENVELOPE_VERSION, ENVELOPE_RATE, int(round(self.body_db / LEVEL_STEP_DB)),
+            len(self.head_db), len(self.tail_db), self.duration
+        )
+        payload = (
+            header + level_bytes(self.head_db) + energy_bytes(self.head_energy)
+            + level_bytes(self.tail_db) + energy_bytes(self.tail_energy)
+        )
+        return base64.b64encode(payload).decode("ascii")
+
+
+@lru_cache(maxsize=4096)
+def decode_envelope(text: str) -> Optional[Envelope]:
+    """Unpack an encoded envelope (cached; returns None if unreadable)."""
+    try:
+        payload = base64.b64decode(text)
+        version, rate, body, head, tail, duration = _HEADER.unpack_from(payload)
+    except (ValueError, struct.error):
+        return None
+    if version != ENVELOPE_VERSION or rate != ENVELOPE_RATE:
+        return None
+    data = np.frombuffer(payload, dtype=np.uint8, offset=_HEADER.size)
+    if len(data) != 2 * (head + tail):
+        return None
+
+    def levels(raw: np.ndarray) -> np.ndarray:
+        return raw.astype(np.float32) * -LEVEL_STEP_DB
+
+    def energies(raw: np.ndarray) -> np.ndarray:
+        return raw.astype(np.float32) / 255
+
+    return Envelope(
+        duration=float(duration),
+        body_db=body * LEVEL_STEP_DB,
+        head_db=levels(data[:head]),
+        head_energy=energies(data[head:2 * head]),
+        tail_db=levels(data[2 * head:2 * head + tail]),
+        tail_energy=energies(data[2 * head + tail:])
+    )
+
+
+def compute_envelope(power: np.ndarray, onset: np.ndarray, frame_rate: float) -> Optional[Envelope]:
+    """
+    Reduce per-hop power and onset strength to edge envelopes.
+
+    Args:
+        power: Per-hop mean square power
+        onset: Per-frame onset strength (spectral flux)
+        frame_rate: Hops per second
+
+    Returns:
+        Envelope, or None for silent audio
+    """
+    if not len(power) or not np.any(power):
+        return None
+
+    hop = max(1, int(round(frame_rate / ENVELOPE_RATE)))
+    frames = -(-len(power) // hop)
+
+    def pool(values: np.ndarray) -> np.ndarray:
+        padded = np.zeros(frames * hop)
+        padded[:min(len(values), len(padded))] = values[:len(padded)]
+        return padded.reshape(frames, hop).mean(axis=1)
+
+    with np.errstate(divide="ignore"):
+        level_db = 10 * np.log10(pool(power))
+    level_db = np.maximum(level_db, -SILENT_LEVEL * LEVEL_STEP_DB)
+    body_db = float(np.percentile(level_db, 90))
+
+    energy = pool(onset)
+    body_energy = np.percentile(energy, 90)
+    energy = energy / body_energy if body_energy > 0 else np.zeros_like(energy)
+
+    edge = min(EDGE_FRAMES, frames)
+    return Envelope(
+        duration=len(power) / frame_rate,
+        body_db=body_db,
+        head_db=level_db[:edge],
+        head_energy=energy[:edge],
+        tail_db=level_db[-edge:],
+        tail_energy=energy[-edge:]
+    )
+
+
+@dataclass
+class Segue:
+    """How one track hands over to the next."""
+    start_next_at: float  # Seconds into the outgoing track to start the next
+    fade_out: float  # Seconds the outgoing track fades over, from start_next_at
+    next_offset: float  # Seconds of leading silence to skip in the next track
+    crossfade_ms: int
+
+    def to_dict(self):
+        return {
+            "start_next_at": self.start_next_at,
+            "fade_out": self.fade_out,
+            "next_offset": self.next_offset,
+            "crossfade_ms": self.crossfade_ms,
+        }
+
+
+def _stack(rows: Sequence[np.ndarray], fill: float, from_end: bool = False) -> np.ndarray:
+    """Stack ragged edge envelopes into (n, EDGE_FRAMES), padding with ``fill``."""
+    out = np.full((len(rows), EDGE_FRAMES), fill, dtype=np.float32)
+    for i, row in enumerate(rows):
+        row = row[-EDGE_FRAMES:] if from_end else row[:EDGE_FRAMES]
+        if from_end:
+            out[i, EDGE_FRAMES - len(row):] = row
+        else:
+            out[i, :len(row)] = row
+    return out
+
+
+def _first_at_or_above(values: np.ndarray, threshold: np.ndarray) -> np.ndarray:
+    """Index of the first column >= threshold per row (width if none)."""
+    hit = values >= threshold[:, None]
+    return np.where(hit.any(axis=1), hit.argmax(axis=1), values.shape[1])
+
+
+def _last_at_or_above(values: np.ndarray, threshold: np.ndarray) -> np.ndarray:
+    """Index of the last column >= threshold per row (-1 if none)."""
+    hit = values[:, ::-1] >= threshold[:, None]
+    return np.where(hit.any(axis=1), values.shape[1] - 1 - hit.argmax(axis=1), -1)
+
+
+def plan_segues(
+    outgoing: Sequence[Envelope],
+    incoming: Sequence[Envelope],
+    outgoing_bpm: Optional[Sequence[Optional[float]]] = None,
+    incoming_bpm: Optional[Sequence[Optional[float]]] = None
+) -> List[Segue]:
+    """
+    Plan the segue for each (outgoing[i], incoming[i]) pair at once.
+
+    The outgoing track starts fading where its level last sits within
+    FADE_DROP_DB of its body, and is done where it drops AUDIBLE_DROP_DB
+    below it. The overlap covers that natural fade, stretched to the
+    incoming track's quiet intro, and kept short for a cold ending into a
+    hot start or when two energetic edges would clash in tempo.
+    """
+    n = len(outgoing)
+    if n == 0:
+        return []
+    frame = 1.0 / ENVELOPE_RATE
+
+    out_body = np.array([e.body_db for e in outgoing], dtype=np.float32)
+    out_duration = np.array([e.duration for e in outgoing], dtype=np.float32)
+    tail_db = _stack([e.tail_db for e in outgoing], -SILENT_LEVEL * LEVEL_STEP_DB, from_end=True)
+    tail_energy = _stack([e.tail_energy for e in outgoing], 0.0, from_end=True)
+    in_body = np.array([e.body_db for e in incoming], dtype=np.float32)
+    head_db = _stack([e.head_db for e in incoming], -SILENT_LEVEL * LEVEL_STEP_DB)
+    head_energy = _stack([e.head_energy for e in incoming], 0.0)
+
+    # Outgoing: times measured back from the end of the track
+    tail_start = out_duration - EDGE_FRAMES * frame
+    fade_frame = _last_at_or_above(tail_db, out_body - FADE_DROP_DB) + 1
+    end_frame = _last_at_or_above(tail_db, out_body - AUDIBLE_DROP_DB) + 1
+    fade_start = np.maximum(0.0, tail_start + fade_frame * frame)
+    audible_end = np.clip(tail_start + end_frame * frame, fade_start, out_duration)
+    natural_fade = audible_end - fade_start
+
+    # Incoming: skip leading silence, then measure the ramp up to the body
+    start_frame = np.minimum(_first_at_or_above(head_db, in_body - AUDIBLE_DROP_DB), EDGE_FRAMES - 1)
+    ramp_frame = _first_at_or_above(head_db, in_body - FADE_DROP_DB)
+    next_offset = start_frame * frame
+    ramp = np.maximum(0.0, (ramp_frame - start_frame) * frame)
+
+    overlap = np.where(natural_fade > frame, np.maximum(natural_fade, ramp), np.maximum(ramp, COLD_OVERLAP))
+    overlap = np.clip(overlap, MIN_OVERLAP, MAX_OVERLAP)
+
+    # Energy where the two edges meet
+    rows = np.arange(n)
+    meet = np.clip(((audible_end - overlap - tail_start) / frame).astype(int), 0, EDGE_FRAMES - 1)
+    out_hot = tail_energy[rows, meet] >= ENERGETIC
+    in_hot = head_energy[rows, np.minimum(ramp_frame, EDGE_FRAMES - 1)] >= ENERGETIC
+    tempo_match = np.zeros(n, dtype=bool)
+    if outgoing_bpm is not None and incoming_bpm is not None:
+        a = np.array([b or np.nan for b in outgoing_bpm], dtype=np.float32)
+        b = np.array([b or np.nan for b in incoming_bpm], dtype=np.float32)
+        with np.errstate(invalid="ignore"):
+            tempo_match = np.abs(a - b) <= TEMPO_MATCH * np.fmax(a, b)
+    overlap = np.where(out_hot & in_hot & ~tempo_match, np.minimum(overlap, CLASH_OVERLAP), overlap)
+
+    start_next_at = np.maximum(0.0, audible_end - overlap)
+    return [
+        Segue(
+            start_next_at=round(float(start_next_at[i]), 2),
+            fade_out=round(float(audible_end[i] - start_next_at[i]), 2),
+            next_offset=round(float(next_offset[i]), 2),
+            crossfade_ms=int(round(float(overlap[i]) * 1000))
+        )
+        for i in range(n)
+    ]
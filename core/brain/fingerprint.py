@@ -0,0 +1,199 @@
+"""
+Acoustic Fingerprints for Neon Frequency
+========================================
+Compact audio fingerprints and a locality-sensitive index for finding
+near-duplicate tracks (re-encodes, other bitrates, re-tagged copies).
+
+A fingerprint is 256 bits: the track is cut into equal time segments,
+each reduced to log energies in a set of frequency bands, and every bit is
+the sign of an energy difference across both time and frequency
+(Haitsma-Kalker style). Lossy encoding barely moves those signs, so copies
+of the same recording land within a small Hamming distance.
+
+The index splits fingerprints into bands of bits (LSH banding): two
+fingerprints only become candidates if one whole band matches exactly,
+so an insert touches a handful of hash buckets rather than the library.
+"""
+
+import logging
+from typing import Optional, List, Dict, Set, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("AEN.Fingerprint")
+
+
+FINGERPRINT_BANDS = 17  # Frequency bands -> 16 band differences
+FINGERPRINT_SEGMENTS = 17  # Time segments -> 16 segment differences
+FINGERPRINT_BITS = (FINGERPRINT_BANDS - 1) * (FINGERPRINT_SEGMENTS - 1)
+MIN_FREQ = 200.0
+MAX_FREQ = 5000.0
+
+# Frames quieter than this (relative to the loudest) are trimmed from the ends
+SILENCE_DB = -60.0
+# Band energies are floored this far below the loudest band, so empty bands
+# compare equal instead of flipping on noise
+FLOOR_DB = -50.0
+# Differences within this many log10 units count as zero (bit 0)
+DEAD_ZONE = 0.02
+
+# LSH banding: 16 bands of 16 bits
+LSH_BANDS = 16
+MAX_DISTANCE = 24  # Hamming bits (~9%) still considered the same recording
+
+
+def band_matrix(rate: int, frame_size: int) -> np.ndarray:
+    """Map rfft bins to log-spaced fingerprint bands: (bins, bands)."""
+    freqs = np.fft.rfftfreq(frame_size, 1.0 / rate)
+    edges = np.geomspace(MIN_FREQ, min(MAX_FREQ, rate / 2), FINGERPRINT_BANDS + 1)
+    band = np.searchsorted(edges, freqs, side="right") - 1
+    matrix = np.zeros((len(freqs), FINGERPRINT_BANDS), dtype=np.float32)
+    inside = (band >= 0) & (band < FINGERPRINT_BANDS)
+    matrix[np.flatnonzero(inside), band[inside]] = 1.0
+    return matrix
+
+
+def compute_fingerprint(band_energy: np.ndarray) -> Optional[int]:
+    """
+    Reduce per-frame band energies (frames, bands) to a fingerprint.
+
+    Returns:
+        FINGERPRINT_BITS-bit integer, or None for silent or very short audio
+    """
+    if band_energy.ndim != 2 or len(band_energy) < FINGERPRINT_SEGMENTS:
+        return None
+
+    total = band_energy.sum(axis=1)
+    peak = total.max()
+    if peak <= 0:
+        return None
+    audible = np.flatnonzero(total >= peak * 10 ** (SILENCE_DB / 10))
+    frames = band_energy[audible[0]:audible[-1] + 1]
+    if len(frames) < FINGERPRINT_SEGMENTS:
+        return None
+
+    bounds = np.linspace(0, len(frames), FINGERPRINT_SEGMENTS + 1).astype(int)
+    segments = np.add.reduceat(frames, bounds[:-1], axis=0) / np.diff(bounds)[:, None]
+    floor = segments.max() * 10 ** (FLOOR_DB / 10)
+    log_energy = np.log10(np.maximum(segments, floor))
+
+    freq_diff = np.diff(log_energy, axis=1)
+    bits = (np.diff(freq_diff, axis=0) > DEAD_ZONE).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def to_hex(fingerprint: int) -> str:
+    return f"{fingerprint:0{FINGERPRINT_BITS // 4}x}"
+
+
+def from_hex(text: str) -> int:
+    return int(text, 16)
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class FingerprintIndex:
+    """
+    LSH index over fingerprints with exact Hamming verification.
+
+    Candidates share at least one LSH band exactly; only those are
+    compared bit-for-bit against ``max_distance``.
+    """
+
+    def __init__(self, max_distance: int = MAX_DISTANCE, bands: int = LSH_BANDS):
+        self.max_distance = max_distance
+        self.bands = bands
+        self._band_bits = FINGERPRINT_BITS // bands
+        self._fingerprints: Dict[str, int] = {}
+        self._buckets: List[Dict[int, Set[str]]] = [{} for _ in range(bands)]
+
+    def __len__(self) -> int:
+        return len(self._fingerprints)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._fingerprints
+
+    def _band_values(self, fingerprint: int) -> List[int]:
+        mask = (1 << self._band_bits) - 1
+        return [(fingerprint >> (i * self._band_bits)) & mask for i in range(self.bands)]
+
+    def add(self, key: str, fingerprint: int) -> List[Tuple[str, int]]:
+        """
+        Index a fingerprint, returning the near-duplicates already present.
+
+        Returns:
+            (key, distance) pairs, closest first
+        """
+        self.remove(key)
+        matches = self.query(fingerprint)
+        self._fingerprints[key] = fingerprint
+        for buckets, value in zip(self._buckets, self._band_values(fingerprint)):
+            buckets.setdefault(value, set()).add(key)
+        return matches
+
+    def remove(self, key: str):
+        fingerprint = self._fingerprints.pop(key, None)
+        if fingerprint is None:
+            return
+        for buckets, value in zip(self._buckets, self._band_values(fingerprint)):
+            bucket = buckets.get(value)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del buckets[value]
+
+    def _candidates(self, fingerprint: int) -> Set[str]:
+        candidates: Set[str] = set()
+        for buckets, value in zip(self._buckets, self._band_values(fingerprint)):
+            candidates.update(buckets.get(value, ()))
+        return candidates
+
+    def query(self, fingerprint: int, exclude: Optional[str] = None) -> List[Tuple[str, int]]:
+        """Find indexed fingerprints within ``max_distance``, closest first."""
+        matches = []
+        for key in self._candidates(fingerprint):
+            if key == exclude:
+                continue
+            distance = hamming(fingerprint, self._fingerprints[key])
+            if distance <= self.max_distance:
+                matches.append((key, distance))
+        matches.sort(key=lambda m: m[1])
+        return matches
+
+    def clusters(self) -> List[List[str]]:
+        """
+        Group every indexed key into near-duplicate clusters (union-find).
+
+        Returns:
+            Clusters with more than one member, largest first
+        """
+        parent: Dict[str, str] = {}
+
+        def find(key: str) -> str:
+            root = parent.setdefault(key, key)
+            while root != parent[root]:
+                root = parent[root]
+            while parent[key] != root:
+                parent[key], key = root, parent[key]
+            return root
+
+        checked: Set[Tuple[str, str]] = set()
+        for buckets in self._buckets:
+            for bucket in buckets.values():
+                if len(bucket) < 2:
+                    continue
+                members = sorted(bucket)
+                for i, a in enumerate(members):
+                    for b in members[i + 1:]:
+                        if (a, b) in checked:
+                            continue
+                        checked.add((a, b))
+                        if hamming(self._fingerprints[a], self._fingerprints[b]) <= self.max_distance:
+                            parent[find(a)] = find(b)
+
+        groups: Dict[str, List[str]] = {}
+        for key in parent:
+            groups.setdefault(find(key), []).append(key)
+        return sorted((g for g in groups.values() if len(g) > 1), key=len, reverse=True)
@@ -0,0 +1,101 @@
+"""
+Harmonic Mixing for Neon Frequency
+==================================
+Musical key compatibility on the Camelot wheel.
+
+Keys are encoded as small integers (0-23: wheel position 1-12, minor "A"
+or major "B"), and compatibility between every pair of codes is a single
+precomputed table, so scoring keys across a whole library is one array
+lookup. Index -1 (unknown key) lands on a padding row of zeros.
+"""
+
+import re
+import logging
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger("AEN.Harmony")
+
+
+CAMELOT_CODES = 24
+UNKNOWN_KEY = -1
+
+NOTE_PITCHES = {"C": 0, "D": 2, "E": 4, "F": 5, "G": 7, "A": 9, "B": 11}
+_NOTE_KEY = re.compile(r"^([A-Ga-g])([#♯b♭]?)\s*(m|min|minor|maj|major)?$")
+_CAMELOT_KEY = re.compile(r"^(1[0-2]|[1-9])\s*([ABab])$")
+
+# Compatibility of two keys on the wheel
+SAME_KEY = 1.0
+ADJACENT = 0.8  # One step around the wheel, same mode
+RELATIVE = 0.8  # Relative major/minor (same number)
+DIAGONAL = 0.5  # One step around and a mode change
+BOOST = 0.4  # Two steps around, same mode
+
+
+def camelot_code(key: Optional[str]) -> int:
+    """
+    Encode a key ("Am", "C#", "Dbm", "F# minor", "8A", ...) as 0-23.
+
+    Returns:
+        (number - 1) * 2 + (1 for major, 0 for minor), or UNKNOWN_KEY
+    """
+    if not key:
+        return UNKNOWN_KEY
+    text = key.strip()
+
+    match = _CAMELOT_KEY.match(text)
+    if match:
+        number, letter = int(match.group(1)), match.group(2).upper()
+        return (number - 1) * 2 + (letter == "B")
+
+    match = _NOTE_KEY.match(text)
+    if not match:
+        return UNKNOWN_KEY
+    note, accidental, suffix = match.groups()
+    pitch = NOTE_PITCHES[note.upper()]
+    if accidental in ("#", "♯"):
+        pitch += 1
+    elif accidental in ("b", "♭"):
+        pitch -= 1
+    minor = suffix is not None and suffix.lower().startswith("m") and not suffix.lower().startswith("ma")
+    if minor:
+        pitch += 3  # Same wheel number as the relative major
+    # C major is 8B; each fifth up is one step clockwise
+    number = (pitch * 7 + 7) % 12 + 1
+    return (number - 1) * 2 + (not minor)
+
+
+def camelot_name(code: int) -> Optional[str]:
+    """Decode a code back to Camelot notation, e.g. 14 -> "8A"."""
+    if not 0 <= code < CAMELOT_CODES:
+        return None
+    return f"{code // 2 + 1}{'B' if code % 2 else 'A'}"
+
+
+def _build_table() -> np.ndarray:
+    table = np.zeros((CAMELOT_CODES + 1, CAMELOT_CODES + 1))
+    for a in range(CAMELOT_CODES):
+        for b in range(CAMELOT_CODES):
+            steps = abs(a // 2 - b // 2)
+            steps = min(steps, 12 - steps)
+            same_mode = a % 2 == b % 2
+            if steps == 0:
+                table[a, b] = SAME_KEY if same_mode else RELATIVE
+            elif steps == 1:
+                table[a, b] = ADJACENT if same_mode else DIAGONAL
+            elif steps == 2 and same_mode:
+                table[a, b] = BOOST
+    return table
+
+
+# (25, 25): row/column 24 is the all-zero padding that UNKNOWN_KEY indexes
+COMPATIBILITY = _build_table()
+
+
+def key_compatibility(a: Optional[str], b: Optional[str]) -> Optional[float]:
+    """Compatibility (0.0-1.0) of two keys, or None if either is unknown."""
+    code_a, code_b = camelot_code(a), camelot_code(b)
+    if code_a == UNKNOWN_KEY or code_b == UNKNOWN_KEY:
+        return None
+    return float(COMPATIBILITY[code_a, code_b])
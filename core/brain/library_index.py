@@ -0,0 +1,329 @@
+"""
+Library Indexes for Neon Frequency
+==================================
+In-memory indexes maintained alongside the music library catalog, so
+queries cost proportional to their result instead of the library size.
+"""
+
+import re
+import math
+import heapq
+import logging
+from bisect import bisect_left, bisect_right
+from typing import Optional, List, Dict, Any, Iterable, Tuple
+
+logger = logging.getLogger("AEN.LibraryIndex")
+
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Relative weight of a match in each field
+SEARCH_FIELD_WEIGHTS = {
+    "title": 3.0,
+    "artist": 2.0,
+    "album": 1.0,
+    "tags": 1.0,
+    "generation_prompt": 0.5,
+}
+
+# A prefix-only match counts for less than a whole-token match
+PREFIX_MATCH_FACTOR = 0.6
+POPULARITY_WEIGHT = 0.1
+
+
+class SortedBuffer:
+    """
+    A sorted list that defers sorting until it is read.
+
+    Appends are O(1); the next read re-sorts, which is close to linear
+    because the bulk of the list is already in order. This keeps bulk
+    catalog loads from paying an O(n) list insert per item.
+    """
+
+    def __init__(self):
+        self._items: List[Any] = []
+        self._dirty = False
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def items(self) -> List[Any]:
+        """The sorted items (do not mutate)."""
+        if self._dirty:
+            self._items.sort()
+            self._dirty = False
+        return self._items
+
+    def add(self, item: Any):
+        self._items.append(item)
+        self._dirty = True
+
+    def remove(self, item: Any) -> bool:
+        items = self.items
+        i = bisect_left(items, item)
+        if i < len(items) and items[i] == item:
+            del items[i]
+            return True
+        return False
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Split text into lowercase search tokens."""
+    if not text:
+        return []
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _track_field_tokens(track: Any) -> Dict[str, float]:
+    """Collect each token of a track with its best field weight."""
+    fields = {
+        "title": track.title,
+        "artist": track.artist,
+        "album": track.album,
+        "tags": " ".join(track.tags),
+        "generation_prompt": track.generation_prompt if track.is_generated else None,
+    }
+
+    weights: Dict[str, float] = {}
+    for name, text in fields.items():
+        weight = SEARCH_FIELD_WEIGHTS[name]
+        for token in tokenize(text):
+            if weights.get(token, 0.0) < weight:
+                weights[token] = weight
+
+    if track.is_generated:
+        weights.setdefault("generated", SEARCH_FIELD_WEIGHTS["generation_prompt"])
+    return weights
+
+
+class SearchIndex:
+    """
+    Token and prefix inverted index over track text fields.
+
+    Every query token must match (AND semantics), either as a whole token
+    or as the prefix of one. Results are ranked by field weight, with play
+    count as a small popularity boost.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, float]] = {}  # token -> key -> weight
+        self._vocabulary = SortedBuffer()  # tokens, for prefix ranges
+        self._doc_tokens: Dict[str, Dict[str, float]] = {}  # key -> token -> weight
+        self._popularity: Dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._doc_tokens)
+
+    def add(self, key: str, track: Any):
+        """Index a track (replacing any previous entry for the key)."""
+        if key in self._doc_tokens:
+            self.remove(key)
+
+        tokens = _track_field_tokens(track)
+        self._doc_tokens[key] = tokens
+        for token, weight in tokens.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                self._vocabulary.add(token)
+            postings[key] = weight
+
+        self.update_popularity(key, track.play_count)
+
+    def remove(self, key: str):
+        """Drop a track from the index."""
+        tokens = self._doc_tokens.pop(key, None)
+        if tokens is None:
+            return
+
+        for token in tokens:
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(key, None)
+            if not postings:
+                del self._postings[token]
+                self._vocabulary.remove(token)
+
+        self._popularity.pop(key, None)
+
+    def update_popularity(self, key: str, play_count: int):
+        """Refresh the popularity boost after a play-count change."""
+        if key in self._doc_tokens:
+            self._popularity[key] = POPULARITY_WEIGHT * math.log1p(play_count)
+
+    def _expand(self, token: str) -> Iterable[str]:
+        """
+        Yield ``token`` if indexed, then every token it prefixes, in order.
+
+        Lazy, so ``_match`` stops paying for short prefixes once it has
+        enough results.
+        """
+        vocabulary = self._vocabulary.items
+        i = bisect_left(vocabulary, token)
+        while i < len(vocabulary) and vocabulary[i].startswith(token):
+            yield vocabulary[i]
+            i += 1
+
+    def _match(
+        self,
+        token: str,
+        within: Optional[Dict[str, float]] = None,
+        limit: Optional[int] = None
+    ) -> Dict[str, float]:
+        """
+        Best score per key for a single query token.
+
+        Args:
+            within: Only score these keys (the matches of earlier tokens)
+            limit: Results wanted; expansion stops once that many keys (or
+                all of ``within``) score as well as any prefix match could
+        """
+        scores: Dict[str, float] = {}
+        ceiling = PREFIX_MATCH_FACTOR * max(SEARCH_FIELD_WEIGHTS.values())
+        wanted = len(within) if within is not None else limit
+        settled = 0
+        for candidate in self._expand(token):
+            factor = 1.0 if candidate == token else PREFIX_MATCH_FACTOR
+            postings = self._postings[candidate]
+            if within is None:
+                hits = postings.items()
+            elif len(within) < len(postings):
+                hits = ((key, postings[key]) for key in within if key in postings)
+            else:
+                hits = ((key, weight) for key, weight in postings.items() if key in within)
+            for key, weight in hits:
+                score = weight * factor
+                previous = scores.get(key, 0.0)
+                if previous < score:
+                    scores[key] = score
+                    if previous < ceiling <= score:
+                        settled += 1
+            if wanted is not None and settled >= wanted:
+                break  # Further prefixes could only add lower-ranked keys
+        return scores
+
+    def search(self, query: str, limit: int = 50) -> List[Tuple[str, float]]:
+        """
+        Find the best matching keys for a query.
+
+        Returns:
+            (key, score) pairs, best first, at most ``limit`` long
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return []
+
+        # Match the most selective (longest) tokens first, so intersections
+        # shrink as early as possible.
+        tokens.sort(key=len, reverse=True)
+        totals: Optional[Dict[str, float]] = None
+        for token in tokens:
+            if totals is None:
+                totals = self._match(token, limit=limit if len(tokens) == 1 else None)
+            else:
+                scores = self._match(token, within=totals)
+                totals = {k: s + scores[k] for k, s in totals.items() if k in scores}
+            if not totals:
+                return []
+
+        popularity = self._popularity
+        return heapq.nlargest(
+            limit,
+            ((key, score + popularity.get(key, 0.0)) for key, score in totals.items()),
+            key=lambda item: item[1]
+        )
+
+
+class AttributeIndex:
+    """
+    Hash buckets of track keys per value of one attribute.
+
+    Buckets are insertion-ordered dicts used as sets, so results keep the
+    catalog's order.
+    """
+
+    def __init__(self, attribute: str):
+        self.attribute = attribute
+        self._buckets: Dict[Any, Dict[str, None]] = {}
+        self._values: Dict[str, Any] = {}  # key -> indexed value
+
+    def add(self, key: str, track: Any):
+        if key in self._values:
+            self.remove(key)
+        value = getattr(track, self.attribute)
+        self._values[key] = value
+        self._buckets.setdefault(value, {})[key] = None
+
+    def remove(self, key: str):
+        if key not in self._values:
+            return
+        value = self._values.pop(key)
+        bucket = self._buckets.get(value)
+        if bucket is not None:
+            bucket.pop(key, None)
+            if not bucket:
+                del self._buckets[value]
+
+    def get(self, value: Any) -> Dict[str, None]:
+        """Keys with the given value (do not mutate)."""
+        return self._buckets.get(value, {})
+
+    def counts(self) -> Dict[Any, int]:
+        """Number of keys per value."""
+        return {value: len(bucket) for value, bucket in self._buckets.items()}
+
+
+class RangeIndex:
+    """
+    Sorted (value, key) pairs of one numeric attribute, queried by bisection.
+
+    Tracks with no value for the attribute are not indexed.
+    """
+
+    def __init__(self, attribute: str):
+        self.attribute = attribute
+        self._entries = SortedBuffer()
+        self._values: Dict[str, Any] = {}
+
+    def add(self, key: str, track: Any):
+        if key in self._values:
+            self.remove(key)
+        value = getattr(track, self.attribute)
+        if value is None:
+            return
+        self._values[key] = value
+        self._entries.add((value, key))
+
+    def remove(self, key: str):
+        value = self._values.pop(key, None)
+        if value is not None:
+            self._entries.remove((value, key))
+
+    def range(self, low: Any, high: Any) -> List[str]:
+        """Keys whose value lies in [low, high], in ascending value order."""
+        entries = self._entries.items
+        start = bisect_left(entries, (low,))
+        # Any (high, key) sorts below (high, <higher type>), so probe with a
+        # tuple that is greater than every key at the upper bound.
+        end = bisect_right(entries, (high, chr(0x10FFFF)))
+        return [key for _, key in entries[start:end]]
+
+
+def intersect_keys(key_sets: List[Any]) -> List[str]:
+    """
+    Intersect candidate key collections, smallest first.
+
+    The result keeps the order of the smallest collection, and the cost is
+    proportional to it rather than to the library.
+    """
+    if not key_sets:
+        return []
+
+    ordered = sorted(key_sets, key=len)
+    others = [
+        keys if isinstance(keys, (set, frozenset, dict)) else set(keys)
+        for keys in ordered[1:]
+    ]
+    return [key for key in ordered[0] if all(key in other for other in others)]
@@ -0,0 +1,450 @@
+"""
+Library Scanner for Neon Frequency
+==================================
+Parallel, streaming directory scanner for the music library.
+
+Discovery is a cheap stat-only walk; hashing and tag extraction for new or
+changed files are fanned out to a worker pool as the walk finds them and
+streamed back as they complete. ``scan_library`` and ``apply_file_changes``
+commit the results to a MusicLibrary and its catalog.
+"""
+
+import os
+import hashlib
+import logging
+from pathlib import Path
+from itertools import chain, islice
+from concurrent.futures import (
+    Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+)
+from dataclasses import dataclass
+from typing import Optional, List, Dict, Any, Iterator, Iterable, Callable, Tuple
+
+logger = logging.getLogger("AEN.LibraryScanner")
+
+
+AUDIO_EXTENSIONS = {'.mp3', '.wav', '.flac', '.ogg', '.m4a', '.aac'}
+HASH_CHUNK = 1024 * 1024
+
+
+@dataclass
+class ScanResult:
+    """A probed file, with the scan's progress at the time it completed."""
+    file_path: str
+    size: int
+    mtime: float
+    track: Optional[Any] = None  # TrackMetadata, None if probing failed
+    error: Optional[str] = None
+    processed: int = 0
+    total: int = 0  # Files found to probe so far (final once the walk is done)
+
+
+def hash_file(file_path: str) -> str:
+    """
+    Generate a hash for file deduplication.
+
+    Only the first and last 1MB are read for speed; mixing in the size and
+    the tail keeps files that share a long prefix (same header, different
+    audio) apart. Re-encodes of the same song are caught by the acoustic
+    fingerprint instead.
+    """
+    hasher = hashlib.md5()
+    size = os.path.getsize(file_path)
+    hasher.update(str(size).encode())
+    with open(file_path, 'rb') as f:
+        hasher.update(f.read(HASH_CHUNK))
+        if size > HASH_CHUNK:
+            f.seek(max(HASH_CHUNK, size - HASH_CHUNK))
+            hasher.update(f.read(HASH_CHUNK))
+    return hasher.hexdigest()
+
+
+def walk_audio_files(root: str) -> Iterator[Tuple[str, int, float]]:
+    """
+    Recursively list audio files under a directory.
+
+    Yields:
+        (path, size, mtime) for every file with an audio extension
+    """
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif os.path.splitext(entry.name)[1].lower() in AUDIO_EXTENSIONS:
+                            stat = entry.stat()
+                            yield entry.path, stat.st_size, stat.st_mtime
+                    except OSError as e:
+                        logger.warning(f"Cannot stat {entry.path}: {e}")
+        except OSError as e:
+            logger.warning(f"Cannot read directory {directory}: {e}")
+
+
+def _probe_batch(probe: Callable[[str], Any], paths: List[str]) -> List[Tuple[Any, Optional[str]]]:
+    """Worker entry point: probe a batch of files."""
+    results = []
+    for path in paths:
+        try:
+            results.append((probe(path), None))
+        except Exception as e:
+            results.append((None, str(e)))
+    return results
+
+
+class LibraryScanner:
+    """
+    Fans file probing out to a process pool.
+
+    ``probe`` must be a picklable, module-level function taking a file path
+    and returning its track metadata. Small jobs are probed inline (with
+    ``inline_probe`` if given), since spinning up a pool costs more than it
+    saves.
+    """
+
+    def __init__(
+        self,
+        probe: Callable[[str], Any],
+        max_workers: Optional[int] = None,
+        batch_size: int = 16,
+        inline_threshold: int = 64,
+        use_processes: bool = True,
+        inline_probe: Optional[Callable[[str], Any]] = None
+    ):
+        self.probe = probe
+        self.inline_probe = inline_probe or probe
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.batch_size = max(1, batch_size)
+        self.inline_threshold = inline_threshold
+        self.use_processes = use_processes
+
+    def _create_executor(self) -> Executor:
+        if self.use_processes:
+            try:
+                return ProcessPoolExecutor(max_workers=self.max_workers)
+            except (OSError, NotImplementedError) as e:
+                logger.warning(f"Process pool unavailable ({e}), scanning with threads")
+        return ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def scan(
+        self,
+        root: str,
+        known: Optional[Dict[str, Tuple[int, float]]] = None,
+        seen: Optional[set] = None
+    ) -> Iterator[ScanResult]:
+        """
+        Probe every new or changed audio file under ``root``.
+
+        Args:
+            root: Directory to scan
+            known: Previously scanned (size, mtime) by path; unchanged files are skipped
+            seen: If given, filled with every audio path found, changed or not
+
+        Yields:
+            ScanResult for each probed file, in completion order
+        """
+        known = known or {}
+
+        def changed() -> Iterator[Tuple[str, int, float]]:
+            for path, size, mtime in walk_audio_files(root):
+                if seen is not None:
+                    seen.add(path)
+                if known.get(path) != (size, mtime):
+                    yield path, size, mtime
+
+        yield from self.probe_files(changed())
+
+    def probe_files(self, pending: Iterable[Tuple[str, int, float]]) -> Iterator[ScanResult]:
+        """
+        Probe files as they are listed.
+
+        ``pending`` is consumed lazily: once it holds more than
+        ``inline_threshold`` files, batches go to the pool while the rest
+        are still being listed.
+
+        Args:
+            pending: (path, size, mtime) for each file to probe
+
+        Yields:
+            ScanResult for each probed file, in completion order
+        """
+        pending = iter(pending)
+        stats: Dict[str, Tuple[int, float]] = {}
+
+        def batches(files: Iterable[Tuple[str, int, float]]) -> Iterator[List[str]]:
+            batch = []
+            for path, size, mtime in files:
+                stats[path] = (size, mtime)
+                batch.append(path)
+                if len(batch) >= self.batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        head = list(islice(pending, self.inline_threshold + 1))
+        if len(head) <= self.inline_threshold:
+            outputs = (
+                (batch, _probe_batch(self.inline_probe, batch)) for batch in batches(head)
+            )
+        else:
+            outputs = self._run_pool(batches(chain(head, pending)))
+        yield from self._collect(outputs, stats)
+
+    def _run_pool(self, batches: Iterable[List[str]]) -> Iterator[Tuple[List[str], List[Tuple[Any, Optional[str]]]]]:
+        """Run batches on the pool as they are produced, keeping a bounded number in flight."""
+        max_in_flight = self.max_workers * 4
+        queue = iter(batches)
+
+        with self._create_executor() as executor:
+            in_flight: Dict[Future, List[str]] = {}
+
+            def submit_next() -> bool:
+                batch = next(queue, None)
+                if batch is None:
+                    return False
+                in_flight[executor.submit(_probe_batch, self.probe, batch)] = batch
+                return True
+
+            while len(in_flight) < max_in_flight and submit_next():
+                pass
+
+            try:
+                while in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        batch = in_flight.pop(future)
+                        try:
+                            yield batch, future.result()
+                        except Exception as e:
+                            yield batch, [(None, str(e))] * len(batch)
+                        submit_next()
+            finally:
+                for future in in_flight:
+                    future.cancel()
+
+    def _collect(self, outputs, stats: Dict[str, Tuple[int, float]]) -> Iterator[ScanResult]:
+        processed = 0
+        for batch, results in outputs:
+            for path, (track, error) in zip(batch, results):
+                processed += 1
+                size, mtime = stats[path]
+                yield ScanResult(
+                    file_path=path,
+                    size=size,
+                    mtime=mtime,
+                    track=track,
+                    error=error,
+                    processed=processed,
+                    total=len(stats)
+                )
+
+
+
+def iter_library_scan(
+    library: Any,
+    path: str = None,
+    known: Optional[Dict[str, Tuple[int, float]]] = None,
+    seen: Optional[set] = None,
+    max_workers: Optional[int] = None
+) -> Iterator[ScanResult]:
+    """Stream probe results for a library's new or changed files without committing them."""
+    from core.brain.music_library import create_track_from_file  # music_library imports this module
+
+    scanner = LibraryScanner(create_track_from_file, max_workers=max_workers,
+                             inline_probe=library._create_track_from_file)
+    yield from scanner.scan(str(Path(path or library.music_dir).absolute()), known=known, seen=seen)
+
+
+def scan_library(
+    library: Any,
+    path: str = None,
+    max_workers: Optional[int] = None,
+    batch_size: int = 500,
+    progress: Optional[Callable[[int, int], None]] = None,
+    analyze: bool = False
+) -> int:
+    """
+    Scan a directory for music files.
+
+    Only files that are new or whose size/mtime changed since the last
+    scan are re-read; catalog entries for files that disappeared from
+    the directory are dropped. Probing runs on a worker pool and results
+    are committed to the library and catalog in batches.
+
+    Audio analysis decodes every file, so by default it is left to a
+    separate ``analyze_tracks`` step once the catalog is committed (only
+    files never analysed before are decoded). ``analyze`` runs it on the
+    new and changed files before returning.
+
+    Args:
+        library: MusicLibrary to update
+        path: Directory to scan (defaults to the library's music directory)
+        max_workers: Worker pool size (defaults to CPU count)
+        batch_size: Tracks committed to the catalog per transaction
+        progress: Optional callback receiving (processed, total)
+        analyze: Analyse the new and changed files
+
+    Returns:
+        Number of music files found
+    """
+    scan_path = Path(path or library.music_dir).absolute()
+    if not scan_path.exists():
+        logger.warning(f"Music directory not found: {scan_path}")
+        return 0
+
+    library._ensure_indexed()
+    known = library.store.get_file_stats(str(scan_path))
+    seen: set = set()
+    batch = []
+    held = []  # New paths whose contents are catalogued under another path
+    scanned = []
+    changed = 0
+
+    for result in iter_library_scan(library, str(scan_path), known=known, seen=seen, max_workers=max_workers):
+        if progress:
+            progress(result.processed, result.total)
+        if result.track is None:
+            logger.error(f"Failed to process {result.file_path}: {result.error}")
+            continue
+
+        file_hash = result.track.file_hash
+        if file_hash in library.tracks and library._path_keys.get(result.file_path) != file_hash:
+            # Possibly a move: decided once the walk shows whether the old path is gone
+            held.append(result)
+            continue
+        batch.append(result)
+        if len(batch) >= batch_size:
+            changed += commit_scan_batch(library, batch)
+            scanned.extend(r.track for r in batch)
+            batch = []
+    changed += commit_scan_batch(library, batch)
+    scanned.extend(r.track for r in batch)
+
+    removed = [p for p in known if p not in seen]
+    moved = _remove_paths(library, removed)
+    changed += commit_scan_batch(library, held, moved)
+    scanned.extend(r.track for r in held)
+
+    logger.info(
+        f"Scanned {len(seen)} tracks from {scan_path} "
+        f"({changed} new/changed, {len(removed)} removed, {len(library.tracks)} in library)"
+    )
+    if analyze and scanned:
+        library.analyze_tracks(scanned, max_workers=max_workers)
+    return len(seen)
+
+
+def _remove_paths(library: Any, paths: List[str]) -> Dict[str, Any]:
+    """
+    Drop paths from a library and its catalog.
+
+    Returns:
+        The removed tracks by file hash, so that files with the same
+        contents under a new path can take over their play history
+    """
+    moved = {}
+    for path in paths:
+        if path in library._path_keys:
+            old = library.remove_track(library._path_keys[path])
+            if old is not None and old.file_hash:
+                moved[old.file_hash] = old
+    library.store.remove_paths(paths)
+    return moved
+
+
+def commit_scan_batch(library: Any, results: List[ScanResult], moved: Optional[Dict[str, Any]] = None) -> int:
+    """
+    Add a batch of scanned tracks to a library and its catalog.
+
+    Args:
+        library: MusicLibrary to update
+        results: Probed files
+        moved: Tracks just removed, by file hash; a new file with the
+            same contents is the same track under a new path
+
+    Returns:
+        Number of catalog rows written
+    """
+    for result in results:
+        old = None
+        if result.file_path in library._path_keys:
+            old = library.remove_track(library._path_keys[result.file_path])
+        if old is None and moved and result.track.file_hash:
+            old = moved.pop(result.track.file_hash, None)
+        if old is not None:
+            # A re-read, renamed or moved file keeps its play history
+            result.track.play_count = old.play_count
+            result.track.last_played = old.last_played
+            result.track.rotation_category = old.rotation_category
+    library.add_tracks([r.track for r in results])
+    return library.store.upsert_tracks(
+        (r.track.to_dict(), r.size, r.mtime) for r in results
+    )
+
+
+def apply_file_changes(
+    library: Any,
+    changed: Iterable[str] = (),
+    deleted: Iterable[str] = (),
+    analyze: bool = True
+) -> Tuple[int, int]:
+    """
+    Incrementally apply filesystem changes without a rescan.
+
+    Changed paths are re-probed if their size/mtime differ from the
+    catalog (paths that no longer exist count as deleted), and analysed
+    unless ``analyze`` is off. Deleted paths may be files or whole
+    directories.
+
+    Args:
+        library: MusicLibrary to update
+        changed: Files created, modified or moved into the library
+        deleted: Files or directories removed or moved away
+        analyze: Analyse the re-probed files
+
+    Returns:
+        (tracks added or updated, tracks removed)
+    """
+    from core.brain.music_library import create_track_from_file
+
+    library._ensure_indexed()
+    store = library.store
+    deleted = [os.path.abspath(p) for p in deleted]
+    pending = []
+    for path in changed:
+        path = os.path.abspath(path)
+        if os.path.splitext(path)[1].lower() not in AUDIO_EXTENSIONS:
+            continue
+        try:
+            stat = os.stat(path)
+        except OSError:
+            deleted.append(path)
+            continue
+        if store.get_file_stats(path, exact=True).get(path) != (stat.st_size, stat.st_mtime):
+            pending.append((path, stat.st_size, stat.st_mtime))
+
+    removed = []
+    for path in deleted:
+        # A directory takes everything catalogued below it
+        removed.extend(store.get_file_stats(path, exact=True))
+        removed.extend(store.get_file_stats(path))
+    moved = _remove_paths(library, removed)
+
+    results = []
+    scanner = LibraryScanner(create_track_from_file, inline_probe=library._create_track_from_file)
+    for result in scanner.probe_files(pending):
+        if result.track is None:
+            logger.error(f"Failed to process {result.file_path}: {result.error}")
+        else:
+            results.append(result)
+    changed_count = commit_scan_batch(library, results, moved)
+    if analyze and results:
+        library.analyze_tracks([r.track for r in results])
+
+    if changed_count or removed:
+        logger.info(f"Applied file changes: {changed_count} added/updated, {len(removed)} removed")
+    return changed_count, len(removed)
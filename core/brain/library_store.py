@@ -0,0 +1,411 @@
+"""
+Library Store for Neon Frequency
+================================
+Persistent SQLite catalog for the music library.
+
+Tracks are keyed by file path and remember the size and mtime they were
+scanned at, so a rescan only has to re-read files that are new or changed.
+
+Every write bumps a catalog generation and stamps the rows it touched
+(removals leave a tombstone), so a snapshot of the catalog can catch up
+with ``changes_since`` instead of reloading everything. ``load_library``,
+``save_snapshot`` and ``load_snapshot`` fill a MusicLibrary from either.
+"""
+
+import os
+import json
+import sqlite3
+import logging
+import threading
+from typing import Optional, List, Dict, Any, Iterator, Iterable, Tuple
+
+from core.brain.library_scanner import hash_file
+
+logger = logging.getLogger("AEN.LibraryStore")
+
+
+# v2: file hashes also cover the size and last 1MB of each file
+# v3: per-row write generations and removal tombstones
+SCHEMA_VERSION = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    file_hash TEXT,
+    data TEXT NOT NULL,
+    generation INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_tracks_hash ON tracks(file_hash);
+CREATE TABLE IF NOT EXISTS removed (
+    path TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS analysis (
+    file_hash TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class LibraryStore:
+    """
+    SQLite-backed track catalog.
+
+    Rows hold the serialized track metadata (see ``TrackMetadata.to_dict``)
+    alongside the file stat it was built from. The connection is shared
+    between threads and guarded by a lock; WAL mode lets the cortex, API and
+    scheduler processes read the same catalog concurrently.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+        logger.info(f"Library store opened: {db_path}")
+
+    def _migrate(self) -> None:
+        """Upgrade an older catalog in place (resetting one it cannot upgrade)."""
+        row = self._conn.execute(
+            "SELECT value FROM meta WHERE key = 'schema_version'"
+        ).fetchone()
+        version = int(row[0]) if row else None
+
+        if version == 1:
+            logger.info("Upgrading library store schema v1 -> v2 (re-hashing files)")
+            self._rehash_tracks()
+            version = 2
+        if version == 2:
+            logger.info("Upgrading library store schema v2 -> v3")
+            self._conn.execute(
+                "ALTER TABLE tracks ADD COLUMN generation INTEGER NOT NULL DEFAULT 0"
+            )
+        elif version is not None and version != SCHEMA_VERSION:
+            # The catalog is only a cache of what is on disk, so an
+            # incompatible schema is simply rebuilt by the next scan.
+            # Analysis is keyed by file hash, which may have changed too.
+            logger.warning(f"Library store schema v{version} is stale, resetting catalog")
+            self._conn.execute("DELETE FROM tracks")
+            self._conn.execute("DELETE FROM analysis")
+
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_tracks_generation ON tracks(generation)"
+        )
+
+        self._conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?)",
+            (str(SCHEMA_VERSION),)
+        )
+        self._conn.commit()
+
+    def _rehash_tracks(self) -> None:
+        """Recompute every row's file hash, keeping the rest of the track."""
+        rows = self._conn.execute("SELECT path, file_hash, data FROM tracks").fetchall()
+        rekeyed = {}
+        for path, old_hash, data in rows:
+            try:
+                new_hash = hash_file(path)
+            except OSError:
+                # Unreadable for now: the next scan re-reads it by path,
+                # which keeps the play history too
+                self._conn.execute("UPDATE tracks SET mtime = -1 WHERE path = ?", (path,))
+                continue
+            track = json.loads(data)
+            track["file_hash"] = new_hash
+            self._conn.execute(
+                "UPDATE tracks SET file_hash = ?, data = ? WHERE path = ?",
+                (new_hash, json.dumps(track), path)
+            )
+            if old_hash and old_hash != new_hash:
+                rekeyed[old_hash] = new_hash
+        for old_hash, new_hash in rekeyed.items():
+            self._conn.execute(
+                "UPDATE OR REPLACE analysis SET file_hash = ? WHERE file_hash = ?", (new_hash, old_hash)
+            )
+        logger.info(f"Re-hashed {len(rows)} catalogued files")
+
+    def close(self) -> None:
+        """Close the underlying connection."""
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+
+    @property
+    def generation(self) -> int:
+        """Number of write transactions applied to the catalog so far."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM meta WHERE key = 'generation'"
+            ).fetchone()
+        return int(row[0]) if row else 0
+
+    def _next_generation(self) -> int:
+        """Bump the generation inside the caller's transaction."""
+        self._conn.execute(
+            "INSERT INTO meta (key, value) VALUES ('generation', '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+        return int(self._conn.execute(
+            "SELECT value FROM meta WHERE key = 'generation'"
+        ).fetchone()[0])
+
+    def changes_since(self, generation: int) -> Tuple[List[Dict[str, Any]], List[str], int]:
+        """
+        Get what was written after a given generation.
+
+        Returns:
+            (changed track dicts, removed paths, current generation)
+        """
+        with self._lock:
+            current = self.generation
+            rows = self._conn.execute(
+                "SELECT data FROM tracks WHERE generation > ?", (generation,)
+            ).fetchall()
+            removed = self._conn.execute(
+                "SELECT path FROM removed WHERE generation > ?", (generation,)
+            ).fetchall()
+        return [json.loads(data) for (data,) in rows], [path for (path,) in removed], current
+
+    def get_file_stats(self, prefix: Optional[str] = None, exact: bool = False) -> Dict[str, Tuple[int, float]]:
+        """
+        Get the recorded (size, mtime) for every stored path.
+
+        Args:
+            prefix: Only return paths under this directory
+            exact: Treat ``prefix`` as a single file path instead
+
+        Returns:
+            Mapping of path -> (size, mtime)
+        """
+        query = "SELECT path, size, mtime FROM tracks"
+        params: Tuple[Any, ...] = ()
+        if prefix and exact:
+            query += " WHERE path = ?"
+            params = (prefix,)
+        elif prefix:
+            query += " WHERE path LIKE ? ESCAPE '\\'"
+            escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            params = (escaped.rstrip(os.sep) + os.sep + "%",)
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return {path: (size, mtime) for path, size, mtime in rows}
+
+    def iter_tracks(self) -> Iterator[Dict[str, Any]]:
+        """Iterate over every stored track as a metadata dict."""
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM tracks").fetchall()
+        for (data,) in rows:
+            yield json.loads(data)
+
+    def get_track(self, path: str) -> Optional[Dict[str, Any]]:
+        """Get a single stored track by path."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM tracks WHERE path = ?", (path,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def upsert_tracks(self, entries: Iterable[Tuple[Dict[str, Any], int, float]]) -> int:
+        """
+        Insert or replace tracks in a single transaction.
+
+        Args:
+            entries: (metadata dict, size, mtime) tuples
+
+        Returns:
+            Number of rows written
+        """
+        rows = [
+            (data["file_path"], size, mtime, data.get("file_hash"), json.dumps(data))
+            for data, size, mtime in entries
+        ]
+        if not rows:
+            return 0
+
+        with self._lock:
+            with self._conn:
+                generation = self._next_generation()
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO tracks (path, size, mtime, file_hash, data, generation) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [row + (generation,) for row in rows]
+                )
+                self._conn.executemany(
+                    "DELETE FROM removed WHERE path = ?", [(row[0],) for row in rows]
+                )
+        return len(rows)
+
+    def update_track(self, data: Dict[str, Any]) -> None:
+        """Rewrite the metadata of an already stored track, keeping its stat."""
+        self.update_tracks([data])
+
+    def update_tracks(self, entries: Iterable[Dict[str, Any]]) -> None:
+        """Rewrite the metadata of several stored tracks in one transaction."""
+        rows = [(json.dumps(data), data.get("file_hash"), data["file_path"]) for data in entries]
+        if not rows:
+            return
+        with self._lock:
+            with self._conn:
+                generation = self._next_generation()
+                self._conn.executemany(
+                    "UPDATE tracks SET data = ?, file_hash = ?, generation = ? WHERE path = ?",
+                    [(data, file_hash, generation, path) for data, file_hash, path in rows]
+                )
+
+    def get_analysis(self, file_hashes: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Get cached audio analysis results by file hash."""
+        hashes = list(file_hashes)
+        results: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            # Stay under SQLite's bound-parameter limit
+            for i in range(0, len(hashes), 500):
+                batch = hashes[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT file_hash, data FROM analysis WHERE file_hash IN ({placeholders})",
+                    batch
+                ).fetchall()
+                results.update((h, json.loads(data)) for h, data in rows)
+        return results
+
+    def put_analysis(self, results: Dict[str, Dict[str, Any]]) -> None:
+        """Cache audio analysis results by file hash."""
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO analysis (file_hash, data) VALUES (?, ?)",
+                    [(h, json.dumps(data)) for h, data in results.items()]
+                )
+
+    def remove_paths(self, paths: Iterable[str]) -> int:
+        """Remove tracks by path."""
+        rows = [(p,) for p in paths]
+        if not rows:
+            return 0
+
+        with self._lock:
+            with self._conn:
+                generation = self._next_generation()
+                self._conn.executemany("DELETE FROM tracks WHERE path = ?", rows)
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO removed (path, generation) VALUES (?, ?)",
+                    [(path, generation) for (path,) in rows]
+                )
+        return len(rows)
+
+
+def load_library(library: Any) -> int:
+    """
+    Fill a library's in-memory catalog from its store.
+
+    Returns:
+        Number of tracks loaded
+    """
+    from core.brain.music_library import TrackMetadata  # music_library imports this module
+
+    count = 0
+    for data in library.store.iter_tracks():
+        try:
+            library.add_track(TrackMetadata.from_dict(data))
+            count += 1
+        except (KeyError, ValueError) as e:
+            logger.error(f"Skipping corrupt catalog entry {data.get('file_path')}: {e}")
+    logger.info(f"Loaded {count} tracks from catalog {library.db_path}")
+    return count
+
+
+def save_snapshot(library: Any, path: str) -> str:
+    """
+    Write the catalog as a binary snapshot for fast starts.
+
+    Other processes opening the same library map the snapshot instead
+    of rebuilding every track from the store, then replay only the
+    store writes made since it was saved.
+
+    Returns:
+        The snapshot path
+    """
+    from core.brain.compact_catalog import CompactCatalog
+
+    generation = library.store.generation  # Read first: replaying extra writes is harmless
+    library._ensure_indexed()
+    tracks = library.tracks
+    catalog = tracks if isinstance(tracks, CompactCatalog) else CompactCatalog.from_tracks(tracks)
+    catalog.save(path, {"store_generation": generation, "db_path": os.path.abspath(library.db_path)})
+    return path
+
+
+def load_snapshot(library: Any, path: str) -> bool:
+    """
+    Replace the in-memory catalog with a memory-mapped snapshot.
+
+    Tracks are materialised on access and indexes are built on first
+    query. Store writes newer than the snapshot are applied on top.
+
+    Returns:
+        False if the snapshot is missing, unreadable or from another catalog
+    """
+    from core.brain.compact_catalog import CompactCatalog
+    from core.brain.music_library import TrackMetadata
+
+    try:
+        catalog, meta = CompactCatalog.load(path)
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Cannot load library snapshot {path}: {e}")
+        return False
+
+    generation = meta.get("store_generation", 0)
+    if meta.get("db_path") != os.path.abspath(library.db_path) or generation > library.store.generation:
+        logger.warning(f"Library snapshot {path} does not match {library.db_path}, ignoring it")
+        return False
+
+    library._tracks = catalog
+    library.compact = True
+    library._loaded = True
+    library._reset_indexes(indexed=False)
+
+    changed, removed, _ = library.store.changes_since(generation)
+    rows = []
+    for data in changed:
+        key = data.get("file_hash") or data["file_path"]
+        in_place = key in catalog and catalog[key].file_path == data["file_path"]
+        rows.append((key, data, in_place))
+
+    if removed or not all(in_place for _, _, in_place in rows):
+        # Files were added, replaced or removed: go through the indexes
+        library._ensure_indexed()
+        path_keys = library._path_keys
+        for path_str in removed:
+            if path_str in path_keys:
+                library.remove_track(path_keys[path_str])
+        for key, data, _ in rows:
+            if data["file_path"] in path_keys:
+                library.remove_track(path_keys[data["file_path"]])
+            library.add_track(TrackMetadata.from_dict(data))
+    else:
+        # Metadata edits only (play counts...): overwrite rows directly
+        for key, data, _ in rows:
+            catalog[key] = TrackMetadata.from_dict(data)
+
+    logger.info(
+        f"Loaded {len(catalog)} tracks from snapshot {path} "
+        f"({len(changed)} changed, {len(removed)} removed since)"
+    )
+    return True
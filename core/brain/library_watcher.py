@@ -0,0 +1,303 @@
+"""
+Library Watcher for Neon Frequency
+==================================
+Live incremental library updates from filesystem events.
+
+Uses inotify (via ctypes, no extra dependency) where the platform has it,
+and falls back to polling a stat-only snapshot of the tree. Events are
+debounced per path so files still being uploaded are only read once they
+settle, then applied to the library through ``apply_file_changes``.
+"""
+
+import os
+import time
+import errno
+import select
+import struct
+import logging
+import threading
+import ctypes
+import ctypes.util
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Tuple
+
+from core.brain.library_scanner import AUDIO_EXTENSIONS, walk_audio_files
+
+logger = logging.getLogger("AEN.LibraryWatcher")
+
+
+# Event kinds produced by the backends
+CHANGED = "changed"
+DELETED = "deleted"
+RESCAN = "rescan"
+
+# inotify constants (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF
+)
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def _is_audio(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in AUDIO_EXTENSIONS
+
+
+def _load_libc() -> Optional[Any]:
+    """Load libc if it exposes the inotify API."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, "inotify_init1"):
+        return None
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+
+class InotifyBackend:
+    """Recursive inotify watch on a directory tree."""
+
+    def __init__(self, root: str, libc: Any = None):
+        self.root = root
+        self._libc = libc or _load_libc()
+        if self._libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._dirs: Dict[int, str] = {}  # watch descriptor -> directory
+        self._add_tree(root)
+
+    def _add_watch(self, directory: str) -> Optional[int]:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                logger.error("inotify watch limit reached (raise fs.inotify.max_user_watches)")
+            else:
+                logger.warning(f"Cannot watch {directory}: {os.strerror(err)}")
+            return None
+        self._dirs[wd] = directory
+        return wd
+
+    def _add_tree(self, root: str):
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            if self._add_watch(directory) is None:
+                continue
+            try:
+                with os.scandir(directory) as entries:
+                    stack.extend(e.path for e in entries if e.is_dir(follow_symlinks=False))
+            except OSError:
+                pass
+
+    def _drop_tree(self, root: str):
+        prefix = root + os.sep
+        for wd, directory in list(self._dirs.items()):
+            if directory == root or directory.startswith(prefix):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._dirs[wd]
+
+    def read_events(self, timeout: float) -> List[Tuple[str, str]]:
+        """Wait up to ``timeout`` seconds and return (kind, path) events."""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            buf = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(buf, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(buf[offset:offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                events.append((RESCAN, self.root))
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, name) if name else directory
+
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files may land before the new watch exists, so list them
+                    self._add_tree(path)
+                    events.extend((CHANGED, p) for p, _, _ in walk_audio_files(path))
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._drop_tree(path)
+                    events.append((DELETED, path))
+            elif mask & IN_DELETE_SELF:
+                if directory == self.root:
+                    events.append((DELETED, path))
+            elif _is_audio(path):
+                events.append((DELETED if mask & (IN_DELETE | IN_MOVED_FROM) else CHANGED, path))
+        return events
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingBackend:
+    """
+    Stat-only snapshot diffing.
+
+    The snapshot starts from what the catalog last recorded, so the first
+    poll also picks up anything that changed while nobody was watching.
+    """
+
+    def __init__(self, root: str, interval: float = 5.0, initial: Optional[Dict[str, Tuple[int, float]]] = None):
+        self.root = root
+        self.interval = interval
+        self._snapshot = dict(initial) if initial is not None else {
+            path: (size, mtime) for path, size, mtime in walk_audio_files(root)
+        }
+        self._last_poll: Optional[float] = None
+
+    def read_events(self, timeout: float) -> List[Tuple[str, str]]:
+        """Poll once per interval, sleeping up to ``timeout`` in between."""
+        now = time.monotonic()
+        if self._last_poll is not None and now - self._last_poll < self.interval:
+            time.sleep(min(timeout, self.interval - (now - self._last_poll)))
+            return []
+        self._last_poll = now
+
+        current = {path: (size, mtime) for path, size, mtime in walk_audio_files(self.root)}
+        events = [(CHANGED, p) for p, stat in current.items() if self._snapshot.get(p) != stat]
+        events.extend((DELETED, p) for p in self._snapshot if p not in current)
+        self._snapshot = current
+        return events
+
+    def close(self):
+        pass
+
+
+class LibraryWatcher:
+    """
+    Applies debounced filesystem events to a MusicLibrary.
+
+    Either ``start()`` a background thread, or call ``poll()`` from an
+    existing loop. The library is not internally locked, so pick the
+    latter if other threads mutate it too.
+    """
+
+    def __init__(
+        self,
+        library: Any,
+        path: str = None,
+        debounce: float = 2.0,
+        poll_interval: float = 5.0,
+        use_inotify: bool = None
+    ):
+        self.library = library
+        self.root = str(Path(path or library.music_dir).absolute())
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+
+        self._pending: Dict[str, Tuple[str, float]] = {}  # path -> (kind, last event)
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.backend = self._create_backend(use_inotify)
+
+    def _create_backend(self, use_inotify: Optional[bool]):
+        if use_inotify is not False:
+            try:
+                backend = InotifyBackend(self.root)
+                logger.info(f"Watching {self.root} with inotify")
+                return backend
+            except OSError as e:
+                if use_inotify:
+                    raise
+                logger.warning(f"inotify unavailable ({e}), polling {self.root} instead")
+
+        initial = self.library.store.get_file_stats(self.root)
+        return PollingBackend(self.root, self.poll_interval, initial=initial)
+
+    @property
+    def pending(self) -> int:
+        """Number of paths waiting for their debounce window to pass."""
+        return len(self._pending)
+
+    def poll(self, timeout: float = 0.0, now: float = None) -> Tuple[int, int]:
+        """
+        Collect events and apply the ones that have settled.
+
+        Returns:
+            (tracks added or updated, tracks removed)
+        """
+        events = self.backend.read_events(timeout)
+        now = time.monotonic() if now is None else now
+
+        for kind, path in events:
+            if kind == RESCAN:
+                logger.warning("Filesystem event queue overflowed, rescanning library")
+                self._pending.clear()
+                self.library.scan_directory(self.root)
+                return 0, 0
+            self._pending[path] = (kind, now)
+
+        ready = [
+            (path, kind) for path, (kind, stamp) in self._pending.items()
+            if now - stamp >= self.debounce
+        ]
+        if not ready:
+            return 0, 0
+        for path, _ in ready:
+            del self._pending[path]
+
+        changed = [path for path, kind in ready if kind == CHANGED]
+        deleted = [path for path, kind in ready if kind == DELETED]
+        return self.library.apply_file_changes(changed, deleted)
+
+    def _run(self):
+        timeout = max(0.05, min(self.debounce / 2, self.poll_interval))
+        while not self._stop.is_set():
+            try:
+                self.poll(timeout)
+            except Exception as e:
+                logger.error(f"Library watch update failed: {e}")
+                self._stop.wait(timeout)
+
+    def start(self):
+        """Start applying events on a background thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="LibraryWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching and release the backend."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.backend.close()
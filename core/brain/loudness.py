@@ -0,0 +1,209 @@
+"""
+Loudness for Neon Frequency
+===========================
+ITU-R BS.1770 / EBU R128 integrated loudness over streamed PCM.
+
+Samples are K-weighted (a high shelf modelling the head, then a high-pass
+for low-frequency insensitivity) and reduced to mean square power per
+100 ms step. Integrated loudness gates the 400 ms blocks (75% overlap) at
+-70 LUFS and then 10 LU below their mean.
+
+The K-weighting filter is an IIR, which NumPy cannot run directly. It is
+evaluated a block at a time instead: the recursive part's zero-state
+response comes from an FFT convolution of every block at once, and only
+the filter state is carried from block to block. Chunks of any size give
+the same result as one long pass.
+"""
+
+import logging
+from functools import lru_cache
+from typing import Optional, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("AEN.Loudness")
+
+
+TARGET_LUFS = -14.0  # Station loudness (streaming platforms' norm)
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+STEP_SECONDS = 0.1
+BLOCK_STEPS = 4  # 400 ms gating blocks
+FILTER_BLOCK = 2048
+MAX_GAIN_DB = 20.0  # Quiet inputs are not boosted further than this
+
+
+@lru_cache(maxsize=16)
+def k_weighting(rate: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    K-weighting filter (b, a) at a sample rate.
+
+    The shelf and high-pass stages of BS.1770 are derived for ``rate`` by
+    the bilinear transform and combined into one fourth-order filter.
+    """
+    # Stage 1: high shelf
+    f0, gain_db, q = 1681.974450955533, 3.999843853973347, 0.7071752369554196
+    k = np.tan(np.pi * f0 / rate)
+    vh = 10 ** (gain_db / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf_b = np.array([vh + vb * k / q + k * k, 2 * (k * k - vh), vh - vb * k / q + k * k]) / a0
+    shelf_a = np.array([a0, 2 * (k * k - 1), 1 - k / q + k * k]) / a0
+
+    # Stage 2: high-pass
+    f0, q = 38.13547087602444, 0.5003270373238773
+    k = np.tan(np.pi * f0 / rate)
+    a0 = 1 + k / q + k * k
+    highpass_b = np.array([1.0, -2.0, 1.0])
+    highpass_a = np.array([a0, 2 * (k * k - 1), 1 - k / q + k * k]) / a0
+
+    return np.convolve(shelf_b, highpass_b), np.convolve(shelf_a, highpass_a)
+
+
+class BlockIIR:
+    """
+    Streaming IIR filter over (frames, channels) float data.
+
+    The numerator is applied as a short FIR; the all-pole part runs per
+    block of FILTER_BLOCK samples as an FFT convolution with its truncated
+    impulse response, plus the decay of the state left by earlier blocks.
+    """
+
+    def __init__(self, b: np.ndarray, a: np.ndarray, channels: int, block: int = FILTER_BLOCK):
+        b = np.asarray(b, dtype=np.float64) / a[0]
+        a = np.asarray(a, dtype=np.float64) / a[0]
+        order = len(a) - 1
+        self.block = block
+        self._b = b
+        self._x_history = np.zeros((len(b) - 1, channels))
+        self._y_state = np.zeros((channels, order))  # y[-1], y[-2], ...
+
+        # Companion matrix of the recursion: v[n] = A v[n-1] + e1 x[n]
+        companion = np.zeros((order, order))
+        companion[0] = -a[1:]
+        companion[1:, :-1] = np.eye(order - 1)
+
+        # Impulse response of 1/A(z) (first row of A^n) and each sample's
+        # response to the state (first row of A^(n+1)). Within a block the
+        # truncated impulse response is exact; the state carries the rest.
+        impulse = np.zeros(block)
+        decay = np.zeros((block, order))
+        power = np.eye(order)
+        for n in range(block):
+            impulse[n] = power[0, 0]
+            power = companion @ power
+            decay[n] = power[0]
+        self._fft_size = 2 * block
+        self._impulse_spectrum = np.fft.rfft(impulse, self._fft_size)
+        self._decay = decay  # (block, order)
+        self._carry = power  # A^block: state after a block with zero input
+
+    def process(self, x: np.ndarray) -> np.ndarray:
+        """Filter (frames, channels) samples, continuing from the last call."""
+        frames, channels = x.shape
+        if frames == 0:
+            return np.zeros((0, channels))
+
+        # Numerator taps, with the previous call's input as history
+        padded = np.concatenate([self._x_history, x.astype(np.float64, copy=False)])
+        taps = len(self._b)
+        fir = sum(self._b[i] * padded[taps - 1 - i:taps - 1 - i + frames] for i in range(taps))
+        self._x_history = padded[frames:]
+
+        # Zero-state response of every block at once: (channels, blocks, block)
+        count = -(-frames // self.block)
+        blocks = np.zeros((channels, count * self.block))
+        blocks[:, :frames] = fir.T
+        blocks = blocks.reshape(channels, count, self.block)
+        zero_state = np.fft.irfft(np.fft.rfft(blocks, self._fft_size) * self._impulse_spectrum,
+                                  self._fft_size)[..., :self.block]
+
+        # Carry the state across blocks (the only sequential step)
+        order = self._y_state.shape[1]
+        states = np.empty((count, channels, order))
+        state = self._y_state
+        for index in range(count):
+            states[index] = state
+            state = zero_state[:, index, -1:-order - 1:-1] + state @ self._carry.T
+        output = zero_state + np.einsum("kco,no->ckn", states, self._decay)
+
+        y = output.reshape(channels, -1)[:, :frames]
+        # State for the next call: the last outputs, newest first
+        history = np.concatenate([self._y_state[:, ::-1], y], axis=1)
+        self._y_state = history[:, -1:-order - 1:-1]
+        return y.T
+
+
+class LoudnessMeter:
+    """
+    Integrated loudness of a stream of PCM chunks.
+
+    Feed (frames, channels) or mono (frames,) float samples; all channels
+    are weighted 1.0 (no surround channels).
+    """
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self._step = max(1, int(round(rate * STEP_SECONDS)))
+        self._filter: Optional[BlockIIR] = None
+        self._partial: Optional[np.ndarray] = None  # Weighted samples of an unfinished step
+        self._steps: List[np.ndarray] = []  # Channel-summed mean square per step
+
+    def feed(self, samples: np.ndarray):
+        if samples.ndim == 1:
+            samples = samples[:, None]
+        if self._filter is None:
+            b, a = k_weighting(self.rate)
+            self._filter = BlockIIR(b, a, samples.shape[1])
+            self._partial = np.zeros(0)
+        weighted = np.square(self._filter.process(samples)).sum(axis=1)
+
+        weighted = np.concatenate([self._partial, weighted])
+        usable = len(weighted) - len(weighted) % self._step
+        if usable:
+            self._steps.append(weighted[:usable].reshape(-1, self._step).mean(axis=1))
+        self._partial = weighted[usable:]
+
+    def integrated(self) -> Optional[float]:
+        """Gated integrated loudness in LUFS (None if too short or silent)."""
+        return gated_loudness(np.concatenate(self._steps) if self._steps else np.zeros(0))
+
+
+def step_power(loudness: float) -> float:
+    """K-weighted mean square of a steady signal at ``loudness`` (LUFS)."""
+    return 10 ** ((loudness + 0.691) / 10)
+
+
+def gated_loudness(steps: np.ndarray) -> Optional[float]:
+    """
+    Gated integrated loudness (LUFS) from K-weighted mean square power per
+    100 ms step (None if too short or silent).
+    """
+    if len(steps) < BLOCK_STEPS:
+        return None
+    cumulative = np.concatenate([[0.0], np.cumsum(steps)])
+    blocks = (cumulative[BLOCK_STEPS:] - cumulative[:-BLOCK_STEPS]) / BLOCK_STEPS
+    with np.errstate(divide="ignore"):
+        loudness = -0.691 + 10 * np.log10(blocks)
+
+    gated = blocks[loudness > ABSOLUTE_GATE]
+    if not len(gated):
+        return None
+    relative = -0.691 + 10 * np.log10(gated.mean()) + RELATIVE_GATE
+    gated = blocks[(loudness > ABSOLUTE_GATE) & (loudness > relative)]
+    return round(float(-0.691 + 10 * np.log10(gated.mean())), 2)
+
+
+def integrated_loudness(samples: np.ndarray, rate: int) -> Optional[float]:
+    """Integrated loudness (LUFS) of samples held in memory."""
+    meter = LoudnessMeter(rate)
+    for start in range(0, len(samples), rate * 10):
+        meter.feed(np.asarray(samples[start:start + rate * 10]))
+    return meter.integrated()
+
+
+def gain_to_target(loudness: Optional[float], target: float = TARGET_LUFS) -> float:
+    """dB of gain that brings ``loudness`` to ``target`` (0 if unmeasured)."""
+    if loudness is None:
+        return 0.0
+    return min(target - loudness, MAX_GAIN_DB)
@@ -0,0 +1,627 @@
+"""
+Mix Engine for Neon Frequency
+=============================
+Streaming voice-over-bed mixing on fixed-size PCM blocks.
+
+Inputs are decoded block by block (natively for WAV, through ffmpeg for
+everything else; a looping bed uses ``-stream_loop -1`` so it is never
+materialised), gain, ducking and fades are applied to each block in
+place with NumPy, and every finished block goes straight to the encoder.
+Memory stays at a few blocks however long the bed or voice is. A bed
+that is already decoded (see ``core.brain.bed_cache``) is read from its
+array instead.
+
+Plans can ask for the voice and bed to be normalized to a loudness. The
+inputs' loudness is measured before mixing (or passed in when it is
+already known) and the gain is folded into the same pass. A plan can also
+set a loudness for the finished mix: it is predicted from the gained
+input levels (see ``mix_loudness``) and the difference is folded into the
+voice and bed gains as well, so the mix is still written in one pass.
+"""
+
+import os
+import wave
+import shutil
+import logging
+import threading
+import subprocess
+from dataclasses import dataclass
+from typing import Optional, List, Union, Dict, Any, Tuple
+
+import numpy as np
+
+from core.brain.audio_analysis import wav_samples
+from core.brain.loudness import (
+    LoudnessMeter, integrated_loudness, gain_to_target, gated_loudness, step_power, STEP_SECONDS
+)
+
+logger = logging.getLogger("AEN.MixEngine")
+
+
+MIX_RATE = 44100
+MIX_CHANNELS = 2
+BLOCK_FRAMES = 16384  # ~0.37 s at 44.1 kHz
+MP3_BITRATE = "192k"
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+
+def db_to_gain(db: float) -> float:
+    return float(10 ** (db / 20))
+
+
+class PCMReader:
+    """
+    Pull-style decoder producing float32 (frames, channels) blocks.
+
+    ``read(n)`` returns exactly n frames until the input runs out, then
+    fewer (and finally an empty block). With ``loop`` the input repeats
+    forever.
+    """
+
+    def __init__(self, path: str, rate: int = MIX_RATE, channels: int = MIX_CHANNELS, loop: bool = False):
+        self.path = path
+        self.rate = rate
+        self.channels = channels
+        self.loop = loop
+        self._wav: Optional[wave.Wave_read] = None
+        self._process: Optional[subprocess.Popen] = None
+        self._pending = np.zeros((0, channels), dtype=np.float32)
+        self._eof = False
+
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        if path.lower().endswith(".wav"):
+            try:
+                wav = wave.open(path, "rb")
+                if wav.getframerate() == rate:
+                    self._wav = wav
+                else:
+                    wav.close()
+            except wave.Error:
+                pass  # Compressed WAV; let ffmpeg handle it
+        if self._wav is None:
+            self._start_ffmpeg()
+
+    def _start_ffmpeg(self):
+        if not ffmpeg_available():
+            raise RuntimeError(f"ffmpeg is required to decode {self.path}")
+        cmd = ["ffmpeg", "-v", "error", "-nostdin"]
+        if self.loop:
+            cmd += ["-stream_loop", "-1"]
+        cmd += ["-i", self.path, "-f", "f32le", "-ac", str(self.channels), "-ar", str(self.rate), "-"]
+        self._process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def _decode(self, frames: int) -> np.ndarray:
+        """Decode up to ``frames`` more frames (empty at end of input)."""
+        if self._wav is not None:
+            raw = self._wav.readframes(frames)
+            if not raw and self.loop and self._wav.getnframes():
+                self._wav.rewind()
+                raw = self._wav.readframes(frames)
+            samples = wav_samples(raw, self._wav.getsampwidth()).reshape(-1, self._wav.getnchannels())
+            if samples.shape[1] == self.channels:
+                return samples
+            if self.channels == 1:
+                return samples.mean(axis=1, keepdims=True)
+            return np.repeat(samples[:, :1], self.channels, axis=1) if samples.shape[1] == 1 \
+                else samples[:, :self.channels]
+
+        frame_bytes = 4 * self.channels
+        raw = self._process.stdout.read(frames * frame_bytes)
+        usable = len(raw) - len(raw) % frame_bytes
+        return np.frombuffer(raw[:usable], dtype="<f4").reshape(-1, self.channels)
+
+    def read(self, frames: int) -> np.ndarray:
+        parts: List[np.ndarray] = [self._pending] if len(self._pending) else []
+        have = len(self._pending)
+        while have < frames and not self._eof:
+            block = self._decode(frames - have)
+            if not len(block):
+                self._eof = True
+                break
+            parts.append(block)
+            have += len(block)
+
+        if not parts:
+            return np.zeros((0, self.channels), dtype=np.float32)
+        # A fresh writable array the caller may modify in place
+        joined = np.concatenate(parts) if len(parts) > 1 else parts[0].copy()
+        self._pending = joined[frames:]
+        return joined[:frames]
+
+    def close(self):
+        if self._wav is not None:
+            self._wav.close()
+            self._wav = None
+        if self._process is not None:
+            process, self._process = self._process, None
+            stopped = process.poll() is None
+            if stopped:
+                process.kill()  # Stopped early (looping beds never end on their own)
+            process.stdout.close()
+            stderr = process.stderr.read()
+            process.stderr.close()
+            if process.wait() != 0 and not stopped:
+                message = stderr.decode(errors="replace").strip()
+                logger.warning(f"ffmpeg reported an error decoding {self.path}: {message}")
+
+    def __enter__(self) -> "PCMReader":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ArrayReader:
+    """``PCMReader`` over samples already decoded to a (frames, channels) array."""
+
+    def __init__(self, samples: np.ndarray, loop: bool = False):
+        self.samples = samples
+        self.channels = samples.shape[1]
+        self.loop = loop
+        self._position = 0
+
+    def read(self, frames: int) -> np.ndarray:
+        total = len(self.samples)
+        if self.loop and total:
+            indices = np.arange(self._position, self._position + frames)
+            self._position = (self._position + frames) % total
+            return np.take(self.samples, indices, axis=0, mode="wrap")
+        block = np.array(self.samples[self._position:self._position + frames], dtype=np.float32)
+        self._position += len(block)
+        return block
+
+    def close(self):
+        pass
+
+    def __enter__(self) -> "ArrayReader":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PCMWriter:
+    """
+    Incremental encoder for float32 blocks.
+
+    WAV is written natively; other formats are piped through ffmpeg. The
+    file is written under a temporary name and only appears at ``path``
+    once complete, so a failed mix never leaves a partial file behind.
+
+    ``shift`` delays the output by that many frames of silence (or, if
+    negative, drops that many leading frames); ``info_tag`` controls the
+    Xing/LAME header frame of MP3 output.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        rate: int = MIX_RATE,
+        channels: int = MIX_CHANNELS,
+        bitrate: str = MP3_BITRATE,
+        shift: int = 0,
+        info_tag: bool = True
+    ):
+        self.path = path
+        self.rate = rate
+        self.channels = channels
+        self.frames = 0
+        self._skip = max(0, -shift)
+        root, ext = os.path.splitext(path)
+        # Unique per writer: identical renders may race to the same path
+        self._tmp_path = f"{root}.{os.getpid()}.{threading.get_ident()}.part{ext}"
+        self._wav: Optional[wave.Wave_write] = None
+        self._process: Optional[subprocess.Popen] = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if ext.lower() == ".wav":
+            self._wav = wave.open(self._tmp_path, "wb")
+            self._wav.setnchannels(channels)
+            self._wav.setsampwidth(2)
+            self._wav.setframerate(rate)
+        else:
+            if not ffmpeg_available():
+                raise RuntimeError(f"ffmpeg is required to encode {path}")
+            cmd = [
+                "ffmpeg", "-v", "error", "-nostdin", "-y",
+                "-f", "f32le", "-ar", str(rate), "-ac", str(channels), "-i", "-",
+                "-b:a", bitrate
+            ]
+            if not info_tag:
+                cmd += ["-write_xing", "0"]
+            self._process = subprocess.Popen(cmd + [self._tmp_path], stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        if shift > 0:
+            self.write(np.zeros((shift, channels), dtype=np.float32))
+
+    def write(self, block: np.ndarray):
+        """Write a (frames, channels) float32 block; it is clipped in place."""
+        if self._skip:
+            skipped = min(self._skip, len(block))
+            self._skip -= skipped
+            block = block[skipped:]
+        np.clip(block, -1.0, 1.0, out=block)
+        self.frames += len(block)
+        if self._wav is not None:
+            self._wav.writeframes((block * 32767).astype("<i2").tobytes())
+        else:
+            self._process.stdin.write(block.astype("<f4", copy=False).tobytes())
+
+    def close(self):
+        """Finish the file and move it into place."""
+        if self._wav is not None:
+            self._wav.close()
+            self._wav = None
+        if self._process is not None:
+            process, self._process = self._process, None
+            process.stdin.close()
+            stderr = process.stderr.read()
+            process.stderr.close()
+            if process.wait() != 0:
+                self._discard()
+                raise RuntimeError(f"ffmpeg failed to encode {self.path}: {stderr.decode(errors='replace').strip()}")
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        """Stop encoding and remove the partial file."""
+        if self._wav is not None:
+            self._wav.close()
+            self._wav = None
+        if self._process is not None:
+            process, self._process = self._process, None
+            process.kill()
+            process.stdin.close()
+            process.stderr.close()
+            process.wait()
+        self._discard()
+
+    def _discard(self):
+        if os.path.exists(self._tmp_path):
+            os.unlink(self._tmp_path)
+
+
+# Sidechain ducking
+DETECT_WINDOW = 0.01  # RMS window of the voice level detector (s)
+DUCK_THRESHOLD_DB = -45.0  # Voice level (dBFS) that triggers ducking
+DUCK_HOLD = 0.25  # Stay ducked through gaps between words shorter than this (s)
+
+
+@dataclass
+class MixPlan:
+    """Timeline of a voice-over-bed mix, in seconds and dB."""
+    voice_offset: float = 0.0  # Bed plays alone for this long before the voice
+    voice_gain_db: float = 0.0
+    bed_gain_db: float = 0.0
+    duck_db: float = 0.0  # Bed attenuation while the voice is audible
+    duck_attack: float = 0.0  # Seconds to reach full duck (starts this early)
+    duck_release: float = 0.0  # Seconds to recover once the voice stops
+    tail: Optional[float] = None  # Bed after the voice ends; None plays the bed out
+    length: Optional[float] = None  # Stop the mix here if it would run longer
+    fade_in: float = 0.0
+    fade_out: float = 0.0  # Fade over the end of the tail
+    loop_bed: bool = False
+    # Normalize to these loudnesses (LUFS) first; the gains above are trims on top
+    voice_lufs: Optional[float] = None
+    bed_lufs: Optional[float] = None
+    output_lufs: Optional[float] = None  # Then gain the finished mix to this loudness
+
+
+class SidechainDucker:
+    """
+    Bed gain driven by the voice level.
+
+    A short RMS detector gates on the voice; the gate opens ``attack``
+    seconds early (lookahead) and holds through short pauses. The gain then
+    moves towards the target at a constant dB rate, so it reaches full
+    depth in exactly ``attack`` seconds and recovers in ``release``. Gains
+    are computed per sample in vectorized runs, carrying state across
+    blocks.
+    """
+
+    def __init__(
+        self,
+        rate: int,
+        depth_db: float,
+        attack: float,
+        release: float,
+        threshold_db: float = DUCK_THRESHOLD_DB,
+        hold: float = DUCK_HOLD,
+        window: float = DETECT_WINDOW
+    ):
+        self.depth_db = depth_db
+        self.lookahead = int(round(attack * rate))
+        self._window = max(1, int(round(window * rate)))
+        self._hold = int(round(hold * rate))
+        self._threshold = 10 ** (threshold_db / 10)  # Mean square
+        self._down = depth_db / (attack * rate) if attack > 0 else np.inf  # dB per sample
+        self._up = depth_db / (release * rate) if release > 0 else np.inf
+        self._history = np.zeros(self._window - 1)
+        self._since_active = self._hold + 1
+        self._gain_db = 0.0
+
+    def process(self, sidechain: np.ndarray, frames: int) -> np.ndarray:
+        """
+        Bed gains for the next ``frames`` samples.
+
+        Args:
+            sidechain: Voice samples (frames + lookahead, channels) aligned
+                with the bed, starting at the first of those frames
+            frames: Number of gains to produce
+
+        Returns:
+            Linear gains, float32 (frames,)
+        """
+        if frames == 0:
+            return np.ones(0, dtype=np.float32)
+        power = np.square(sidechain).max(axis=1) if sidechain.ndim == 2 else np.square(sidechain)
+        level = np.concatenate([self._history, power])
+        self._history = level[frames:frames + self._window - 1]
+
+        # Causal moving RMS, then lookahead: gate at t if active anywhere in [t, t + lookahead]
+        cumulative = np.concatenate([[0.0], np.cumsum(level)])
+        mean_square = (cumulative[self._window:] - cumulative[:-self._window]) / self._window
+        active = np.concatenate([[0], np.cumsum(mean_square > self._threshold)])
+        ahead = len(sidechain) - frames + 1
+        gate = active[ahead:ahead + frames] - active[:frames] > 0
+
+        # Hold: samples since the gate was last open, continuing from the last block
+        last_open = np.maximum.accumulate(np.where(gate, np.arange(frames), -1))
+        since = np.where(last_open >= 0, np.arange(frames) - last_open, self._since_active + np.arange(1, frames + 1))
+        ducked = since <= self._hold
+        self._since_active = int(since[-1])
+
+        # Constant-rate moves towards the target, one vectorized run per gate state
+        gains_db = np.empty(frames)
+        edges = np.concatenate([[0], np.flatnonzero(np.diff(ducked)) + 1, [frames]])
+        for begin, finish in zip(edges[:-1], edges[1:]):
+            steps = np.arange(1, finish - begin + 1)
+            if ducked[begin]:
+                run = np.maximum(-self.depth_db, self._gain_db - self._down * steps)
+            else:
+                run = np.minimum(0.0, self._gain_db + self._up * steps)
+            gains_db[begin:finish] = run
+            self._gain_db = float(run[-1])
+        return np.power(10.0, gains_db / 20).astype(np.float32)
+
+
+def _ramp(start: int, count: int, begin: int, length: int, rising: bool) -> Optional[np.ndarray]:
+    """Gain ramp for frames [start, start + count) of a fade over [begin, begin + length)."""
+    if length <= 0 or start >= begin + length or start + count <= begin:
+        return None
+    position = (np.arange(start, start + count, dtype=np.float32) - begin) / length
+    np.clip(position, 0.0, 1.0, out=position)
+    return position if rising else np.subtract(1.0, position, out=position)
+
+
+def measure_loudness(
+    path: str,
+    rate: int = MIX_RATE,
+    channels: int = MIX_CHANNELS,
+    block_frames: int = BLOCK_FRAMES
+) -> Optional[float]:
+    """Integrated loudness (LUFS) of a file, decoded block by block."""
+    return measure_audio(path, rate, channels, block_frames)[0]
+
+
+def measure_audio(
+    path: str,
+    rate: int = MIX_RATE,
+    channels: int = MIX_CHANNELS,
+    block_frames: int = BLOCK_FRAMES
+) -> Tuple[Optional[float], float]:
+    """(integrated loudness in LUFS, seconds) of a file, in one decode."""
+    meter = LoudnessMeter(rate)
+    frames = 0
+    with PCMReader(path, rate, channels) as reader:
+        while True:
+            block = reader.read(block_frames * 16)
+            if not len(block):
+                break
+            meter.feed(block)
+            frames += len(block)
+    return meter.integrated(), frames / rate
+
+
+def mix_loudness(
+    plan: MixPlan,
+    voice_level: Optional[float],
+    voice_seconds: float,
+    bed_level: Optional[float] = None
+) -> Optional[float]:
+    """
+    Predicted integrated loudness (LUFS) of a mix, from its inputs' levels.
+
+    The plan's timeline is laid out in 100 ms loudness steps: the voice at
+    its level, the bed at its level under the ducking, and both under the
+    fades. Each input is taken to be steady at its integrated loudness, so
+    the prediction is close for speech over a music bed rather than exact.
+    Without a tail the bed's length is unknown and the mix is taken to end
+    with the voice.
+
+    Args:
+        plan: The mix plan
+        voice_level: Loudness of the voice after its gain (None if silent)
+        voice_seconds: Length of the voice
+        bed_level: Loudness of the bed after its gain (None if silent or no bed)
+    """
+    start = plan.voice_offset if bed_level is not None else 0.0
+    voice_end = start + voice_seconds
+    end = voice_end + (plan.tail or 0.0) if bed_level is not None else voice_end
+    if plan.length is not None:
+        end = min(end, plan.length)
+    t = (np.arange(int(round(end / STEP_SECONDS))) + 0.5) * STEP_SECONDS
+    power = np.zeros(len(t))
+    if voice_level is not None:
+        power[(t >= start) & (t < voice_end)] = step_power(voice_level)
+    if bed_level is not None:
+        ducked = (t >= start - plan.duck_attack) & (t < voice_end + plan.duck_release)
+        power += step_power(bed_level) * np.where(ducked, 10 ** (-plan.duck_db / 10), 1.0)
+    if plan.fade_in > 0:
+        power *= np.square(np.clip(t / plan.fade_in, 0.0, 1.0))
+    if plan.fade_out > 0:
+        power *= np.square(np.clip((end - t) / plan.fade_out, 0.0, 1.0))
+    return gated_loudness(power)
+
+
+def render_mix(
+    voice_path: str,
+    bed: Optional[Union[str, np.ndarray]],
+    plan: MixPlan,
+    output_path: str,
+    rate: int = MIX_RATE,
+    channels: int = MIX_CHANNELS,
+    block_frames: int = BLOCK_FRAMES,
+    writer_options: Optional[Dict[str, Any]] = None,
+    voice_loudness: Optional[Tuple[Optional[float], float]] = None,
+    bed_loudness: Optional[float] = None
+) -> float:
+    """
+    Stream a mix of a voice over a bed into ``output_path``.
+
+    The mix runs until ``plan.tail`` seconds after the voice ends, or
+    until the bed ends when ``tail`` is None (the voice is cut off there,
+    as with an overlay). Without a bed the voice is simply re-encoded.
+    ``bed`` is a path, or decoded (frames, channels) samples at the mix
+    format. ``writer_options`` are passed on to ``PCMWriter``.
+    ``voice_loudness`` ((LUFS, seconds) as from ``measure_audio``) and
+    ``bed_loudness`` save measuring the inputs when the plan normalizes
+    them. ``plan.output_lufs`` is met by predicting the mix's loudness from
+    its inputs (see ``mix_loudness``); the mix itself is never measured.
+
+    Returns:
+        Duration of the mix in seconds
+    """
+    has_bed = bed is not None and (not isinstance(bed, str) or bool(bed))
+    if has_bed and plan.loop_bed and plan.tail is None:
+        raise ValueError("A looping bed needs a tail length to end the mix")
+
+    voice = bed_reader = writer = None
+    try:
+        voice = PCMReader(voice_path, rate, channels)
+        if isinstance(bed, np.ndarray):
+            bed_reader = ArrayReader(bed, loop=plan.loop_bed)
+        elif has_bed:
+            bed_reader = PCMReader(bed, rate, channels, loop=plan.loop_bed)
+        bed = bed_reader
+        writer = PCMWriter(output_path, rate, channels, **(writer_options or {}))
+        voice_gain_db, bed_gain_db = plan.voice_gain_db, plan.bed_gain_db
+        voice_level = None
+        if plan.voice_lufs is not None or plan.output_lufs is not None:
+            voice_lufs, voice_seconds = voice_loudness or measure_audio(voice_path, rate, channels)
+            if plan.voice_lufs is not None:
+                voice_gain_db += gain_to_target(voice_lufs, plan.voice_lufs)
+            voice_level = None if voice_lufs is None else voice_lufs + voice_gain_db
+        if bed is not None and (plan.bed_lufs is not None or plan.output_lufs is not None):
+            if bed_loudness is None:
+                bed_loudness = (integrated_loudness(bed.samples, rate) if isinstance(bed, ArrayReader)
+                                else measure_loudness(bed.path, rate, channels))
+            if plan.bed_lufs is not None:
+                bed_gain_db += gain_to_target(bed_loudness, plan.bed_lufs)
+        loudness = None
+        if plan.output_lufs is not None:
+            bed_level = None if bed is None or bed_loudness is None else bed_loudness + bed_gain_db
+            loudness = mix_loudness(plan, voice_level, voice_seconds, bed_level)
+            output_gain_db = gain_to_target(loudness, plan.output_lufs)
+            voice_gain_db += output_gain_db
+            bed_gain_db += output_gain_db
+            if loudness is not None:
+                loudness += output_gain_db
+        voice_gain = db_to_gain(voice_gain_db)
+        bed_gain = db_to_gain(bed_gain_db)
+        ducker = None
+        if bed is not None and plan.duck_db > 0:
+            ducker = SidechainDucker(rate, plan.duck_db, plan.duck_attack, plan.duck_release)
+        lookahead = ducker.lookahead if ducker else 0
+        voice_start = int(round(plan.voice_offset * rate)) if bed else 0
+        tail = plan.tail if bed else 0.0
+        fade_in = int(round(plan.fade_in * rate))
+        fade_out = int(round(plan.fade_out * rate))
+
+        # Voice placed on the mix timeline, from the current position onwards
+        timeline = np.zeros((0, channels), dtype=np.float32)
+        voice_done = False
+        position = 0
+        limit = int(round(plan.length * rate)) if plan.length is not None else None
+        end: Optional[int] = limit
+
+        def fill_timeline(upto: int):
+            nonlocal timeline, voice_done, end
+            parts = [timeline]
+            covered = position + len(timeline)
+            if covered < voice_start:
+                gap = min(voice_start, upto) - covered
+                parts.append(np.zeros((gap, channels), dtype=np.float32))
+                covered += gap
+            if covered < upto and not voice_done:
+                speech = voice.read(upto - covered)
+                parts.append(speech)
+                covered += len(speech)
+                if covered < upto:
+                    voice_done = True
+                    if tail is not None:
+                        end = covered + int(round(tail * rate))
+                        if limit is not None:
+                            end = min(end, limit)
+            if covered < upto:
+                parts.append(np.zeros((upto - covered, channels), dtype=np.float32))
+            timeline = np.concatenate(parts) if len(parts) > 1 else timeline
+
+        while end is None or position < end:
+            frames = block_frames if end is None else min(block_frames, end - position)
+            fill_timeline(position + frames + lookahead)
+            if end is not None:
+                frames = max(0, min(frames, end - position))
+
+            if bed is not None:
+                block = bed.read(frames)
+                if len(block) < frames:
+                    if tail is None:
+                        end = position + len(block) if end is None else min(end, position + len(block))
+                    block = np.concatenate([block, np.zeros((frames - len(block), channels), np.float32)])
+                if ducker is not None:
+                    gains = ducker.process(timeline[:frames + lookahead], frames)
+                    gains *= bed_gain
+                    block *= gains[:, None]
+                else:
+                    block *= bed_gain
+            else:
+                block = np.zeros((frames, channels), dtype=np.float32)
+
+            speech = timeline[:frames]
+            speech *= voice_gain
+            block += speech
+            timeline = timeline[frames:]
+
+            if end is not None and position + len(block) > end:
+                block = block[:max(0, end - position)]
+
+            ramp = _ramp(position, len(block), 0, fade_in, rising=True)
+            if ramp is not None:
+                block *= ramp[:, None]
+            if end is not None and fade_out:
+                ramp = _ramp(position, len(block), end - fade_out, fade_out, rising=False)
+                if ramp is not None:
+                    block *= ramp[:, None]
+
+            writer.write(block)
+            position += len(block)
+            if not len(block):
+                break
+
+        writer.close()
+        if any(lufs is not None for lufs in (plan.voice_lufs, plan.bed_lufs, plan.output_lufs)):
+            predicted = f" at ~{loudness:.1f} LUFS" if loudness is not None else ""
+            logger.info(f"Mixed {os.path.basename(output_path)}{predicted} "
+                        f"(voice {voice_gain_db:+.1f} dB, bed {bed_gain_db:+.1f} dB)")
+        return position / rate
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+    finally:
+        for reader in (voice, bed_reader):
+            if reader is not None:
+                reader.close()
@@ -0,0 +1,214 @@
+"""
+Mix Pool for Neon Frequency
+===========================
+Runs CPU-bound audio jobs off the event loop.
+
+Decoding, mixing and encoding hold the CPU for seconds at a time. Jobs go
+to a small process pool so async callers (cortex, the API) keep their
+loop responsive and independent mixes really run in parallel. The number
+of jobs waiting or running is capped: past that, new jobs are refused at
+once rather than queued behind work that will finish too late to air.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Callable, Dict, Any, Tuple, Sequence, Iterator
+
+logger = logging.getLogger("AEN.MixPool")
+
+
+class MixQueueFull(RuntimeError):
+    """Raised when the pool already has its maximum number of jobs."""
+
+
+class MixJobCancelled(RuntimeError):
+    """Raised for a job cancelled before it ran (e.g. by shutdown)."""
+
+
+def _timed(fn: Callable, args: Tuple) -> Tuple[float, float, Any]:
+    """Run a job in a worker, returning (start time, run seconds, result)."""
+    started = time.time()
+    begin = time.perf_counter()
+    result = fn(*args)
+    return started, time.perf_counter() - begin, result
+
+
+class MixPool:
+    """
+    Bounded pool for mix jobs.
+
+    ``fn`` and its arguments must be picklable when processes are used.
+    Cancelling an awaiting caller cancels a job that has not started; a
+    job already running finishes in its worker and its result is dropped.
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        use_processes: bool = True
+    ):
+        self.max_workers = max_workers or int(os.getenv("MIX_WORKERS", min(2, os.cpu_count() or 1)))
+        self.max_pending = max_pending or int(os.getenv("MIX_QUEUE_DEPTH", 16))
+        self.use_processes = use_processes
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._pending = 0
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "cancelled": 0,
+            "rejected": 0,
+            "wait_seconds": 0.0,
+            "run_seconds": 0.0,
+        }
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.use_processes:
+                try:
+                    self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                except (OSError, NotImplementedError) as e:
+                    logger.warning(f"Process pool unavailable ({e}); mixing in threads")
+                    self.use_processes = False
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="mix")
+        return self._executor
+
+    def _submit(self, fn: Callable, args: Tuple) -> Tuple[Future, float]:
+        submitted = self._try_submit(fn, args)
+        if submitted is None:
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise MixQueueFull(f"Mix queue full ({self._pending} jobs)")
+        return submitted
+
+    def _try_submit(self, fn: Callable, args: Tuple) -> Optional[Tuple[Future, float]]:
+        with self._lock:
+            if self._pending >= self.max_pending:
+                return None
+            self._pending += 1
+            self._stats["submitted"] += 1
+            try:
+                future = self._get_executor().submit(_timed, fn, args)
+            except BaseException:
+                self._pending -= 1
+                raise
+        # A job counts against the limit until its worker is free again
+        future.add_done_callback(self._release)
+        return future, time.time()
+
+    def _release(self, future: Future):
+        with self._lock:
+            self._pending -= 1
+            self._slot_freed.notify_all()
+
+    def _finish(self, future: Future, submitted: float, label: str) -> Any:
+        """Account for a finished job and return its result."""
+        with self._lock:
+            if future.cancelled():
+                self._stats["cancelled"] += 1
+                raise MixJobCancelled(f"Mix job {label} was cancelled")
+            error = future.exception()
+            if error is not None:
+                self._stats["failed"] += 1
+                if isinstance(error, BrokenProcessPool):
+                    self._executor = None  # A worker died; start a fresh pool next time
+                raise error
+            started, elapsed, result = future.result()
+            queued = max(0.0, started - submitted)
+            self._stats["completed"] += 1
+            self._stats["wait_seconds"] += queued
+            self._stats["run_seconds"] += elapsed
+        logger.info(f"Mix job {label} ran {elapsed:.2f}s after {queued:.2f}s queued")
+        return result
+
+    async def run(self, fn: Callable, *args, label: str = "") -> Any:
+        """Run ``fn(*args)`` in the pool and await its result."""
+        future, submitted = self._submit(fn, args)
+        try:
+            await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            if future.cancel():  # A job already running cannot be stopped
+                with self._lock:
+                    self._stats["cancelled"] += 1
+            raise
+        except Exception:
+            pass  # Raised again by _finish
+        return self._finish(future, submitted, label or fn.__name__)
+
+    def run_sync(self, fn: Callable, *args, label: str = "") -> Any:
+        """Run ``fn(*args)`` in the pool, blocking until it finishes."""
+        future, submitted = self._submit(fn, args)
+        wait([future])
+        return self._finish(future, submitted, label or fn.__name__)
+
+    def run_many(
+        self,
+        fn: Callable,
+        jobs: Sequence[Tuple],
+        labels: Optional[Sequence[str]] = None
+    ) -> Iterator[Tuple[int, Any, Optional[Exception]]]:
+        """
+        Run ``fn(*args)`` for every args tuple in ``jobs``.
+
+        Jobs are fed to the pool as slots free up, so a batch larger than
+        the queue limit waits its turn instead of being refused.
+
+        Yields:
+            (index into jobs, result, error) in order of completion
+        """
+        waiting = deque(enumerate(jobs))
+        running: Dict[Future, Tuple[int, float]] = {}
+        try:
+            while waiting or running:
+                while waiting and len(running) < 2 * self.max_workers:
+                    index, args = waiting[0]
+                    submitted = self._try_submit(fn, args)
+                    if submitted is None:
+                        break
+                    waiting.popleft()
+                    running[submitted[0]] = (index, submitted[1])
+                if not running:
+                    # Queue full with other callers' jobs: wait for one to finish
+                    with self._slot_freed:
+                        self._slot_freed.wait_for(lambda: self._pending < self.max_pending)
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, submitted = running.pop(future)
+                    label = labels[index] if labels else f"{fn.__name__}[{index}]"
+                    try:
+                        yield index, self._finish(future, submitted, label), None
+                    except Exception as e:
+                        yield index, None, e
+        finally:
+            for future in running:  # Batch abandoned by the caller
+                future.cancel()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats, pending=self._pending, workers=self.max_workers,
+                         processes=self.use_processes)
+        done = stats["completed"]
+        stats["avg_wait_seconds"] = stats["wait_seconds"] / done if done else 0.0
+        stats["avg_run_seconds"] = stats["run_seconds"] / done if done else 0.0
+        return stats
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
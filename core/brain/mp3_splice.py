@@ -0,0 +1,536 @@
+"""
+MP3 Intro Splicing for Neon Frequency
+=====================================
+Talk over a song's intro without re-encoding the song.
+
+A voice-over ramp only changes the first seconds of a song. Instead of
+decoding and re-encoding the whole track, the intro is mixed and encoded
+on its own, and its MP3 frames replace the song's leading frames; the
+rest of the file is copied byte for byte.
+
+Layer III frames borrow bytes from the frames before them (the bit
+reservoir), so the song's first kept frames need the song's bytes in
+front of them. The last re-encoded frame is rebuilt as a bridge that
+carries its own data followed by exactly those bytes, moving to a higher
+bitrate if it needs the room. The new intro is shifted by the difference
+between the song's and our encoder's delay, so both sides of the join
+share one timeline. The song's Xing/Info header is rewritten to describe
+the new file.
+
+Only the head of the song is read and scanned. Everything after it is
+streamed from the song unchanged, and the header's lengths, seek table and
+music CRC are adjusted for the new head instead of recomputed over the
+whole file.
+"""
+
+import os
+import wave
+import struct
+import shutil
+import logging
+import threading
+from bisect import bisect_right
+from dataclasses import dataclass, replace
+from typing import Optional, List, NamedTuple
+
+from core.brain.mix_engine import MixPlan, render_mix, ffmpeg_available
+from core.brain.render_cache import stored_measurement
+
+logger = logging.getLogger("AEN.Mp3Splice")
+
+
+SPLICE_MARGIN = 0.5  # Song-only audio kept in the new intro after the voice (s)
+SPLICE_LOOKAHEAD = 1.0  # Song scanned past the splice point, for the encoder delay and bit reservoir (s)
+LAME_ENCODER_DELAY = 576  # Samples; what ffmpeg's libmp3lame adds in front
+DECODER_DELAY = 529  # Samples decoders drop on top of a tagged encoder delay
+
+_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 25: (11025, 12000, 8000)}
+_VERSIONS = {0b11: 1, 0b10: 2, 0b00: 25}
+_LAME_TAGS = (b"LAME", b"Lavf", b"Lavc")  # ffmpeg writes the LAME layout under its own name
+_HEAD_CHUNK = 1 << 16
+
+
+def _crc16_table() -> List[int]:
+    table = []
+    for value in range(256):
+        for _ in range(8):
+            value = (value >> 1) ^ 0xA001 if value & 1 else value >> 1
+        table.append(value)
+    return table
+
+
+_CRC16 = _crc16_table()
+
+
+def crc16(data: bytes) -> int:
+    """CRC-16/ARC, as used by the LAME tag."""
+    crc = 0
+    table = _CRC16
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def _gf2_times(matrix: List[int], vector: int) -> int:
+    result = 0
+    for column in matrix:
+        if not vector:
+            break
+        if vector & 1:
+            result ^= column
+        vector >>= 1
+    return result
+
+
+def crc16_shift(crc: int, length: int) -> int:
+    """
+    CRC-16/ARC of data followed by ``length`` zero bytes, given the data's CRC.
+
+    With a zero initial value the CRC is linear, so
+    ``crc16(a + b) == crc16_shift(crc16(a), len(b)) ^ crc16(b)``; the shift
+    is a 16x16 bit matrix raised to ``length`` by squaring (as in zlib's
+    crc32_combine).
+    """
+    operator = [(1 << bit >> 8) ^ _CRC16[(1 << bit) & 0xFF] for bit in range(16)]  # One zero byte
+    while length:
+        if length & 1:
+            crc = _gf2_times(operator, crc)
+        length >>= 1
+        if length:
+            operator = [_gf2_times(operator, column) for column in operator]
+    return crc
+
+
+class Mp3Frame(NamedTuple):
+    offset: int
+    size: int
+    main_data_begin: int  # Bytes of bit reservoir borrowed from earlier frames
+    payload: int = 0  # Offset of the main data area (after header and side info)
+
+    @property
+    def payload_size(self) -> int:
+        return self.offset + self.size - self.payload
+
+
+@dataclass
+class Mp3Stream:
+    """Layer III frame layout of an MP3 file."""
+    sample_rate: int
+    channels: int
+    samples_per_frame: int
+    version: int
+    frames: List[Mp3Frame]  # Audio frames, in order
+    tag_frame: Optional[Mp3Frame] = None  # Xing/Info/VBRI header frame
+    xing_offset: Optional[int] = None  # Position of "Xing"/"Info" in the file
+    encoder_delay: Optional[int] = None  # From a LAME tag
+
+    @property
+    def start(self) -> int:
+        """Offset of the first frame (after any ID3v2 tag)."""
+        first = self.tag_frame or (self.frames[0] if self.frames else None)
+        return first.offset if first else 0
+
+    @property
+    def end(self) -> int:
+        """Offset just past the last scanned frame."""
+        return self.frames[-1].offset + self.frames[-1].size if self.frames else self.start
+
+    @property
+    def duration(self) -> float:
+        return len(self.frames) * self.samples_per_frame / self.sample_rate
+
+    @property
+    def max_reservoir(self) -> int:
+        return 511 if self.version == 1 else 255
+
+
+def _frame_size(version: int, bitrate_index: int, sample_rate: int, padding: int) -> int:
+    bitrate = _BITRATES[1 if version == 1 else 2][bitrate_index] * 1000
+    return (144 if version == 1 else 72) * bitrate // sample_rate + padding
+
+
+def _parse_header(data: bytes, offset: int):
+    """(version, sample rate, channels, frame size, side info offset) or None."""
+    if offset + 4 > len(data):
+        return None
+    b1, b2, b3 = data[offset + 1], data[offset + 2], data[offset + 3]
+    if data[offset] != 0xFF or b1 & 0xE0 != 0xE0 or (b1 >> 1) & 0b11 != 0b01:
+        return None  # Not a Layer III frame
+    version = _VERSIONS.get((b1 >> 3) & 0b11)
+    bitrate_index, rate_index = b2 >> 4, (b2 >> 2) & 0b11
+    if version is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    size = _frame_size(version, bitrate_index, sample_rate, (b2 >> 1) & 1)
+    channels = 1 if b3 >> 6 == 0b11 else 2
+    side_info = offset + (4 if b1 & 1 else 6)  # Protection bit clear: 16-bit CRC follows
+    return version, sample_rate, channels, size, side_info
+
+
+def _side_info_size(version: int, channels: int) -> int:
+    if version == 1:
+        return 32 if channels == 2 else 17
+    return 17 if channels == 2 else 9
+
+
+def _id3v2_size(data: bytes) -> int:
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    return 10 + size + (10 if data[5] & 0x10 else 0)
+
+
+def _tag_info(data: bytes, offset: int, side_info: int, version: int, channels: int):
+    """(is a VBR header frame, offset of "Xing"/"Info" or None, LAME encoder delay or None)."""
+    if data[offset + 36:offset + 40] == b"VBRI":
+        return True, None, None
+    xing = side_info + _side_info_size(version, channels)
+    if data[xing:xing + 4] not in (b"Xing", b"Info") or xing + 8 > len(data):
+        return False, None, None
+    lame = _lame_offset(data, xing)
+    if data[lame:lame + 4] not in _LAME_TAGS or lame + 24 > len(data):
+        return True, xing, None
+    delay = (data[lame + 21] << 4) | (data[lame + 22] >> 4)
+    return True, xing, delay
+
+
+def _lame_offset(data: bytes, xing: int) -> int:
+    """Position of the LAME extension after a Xing/Info header's optional fields."""
+    flags = struct.unpack_from(">I", data, xing + 4)[0]
+    return xing + 8 + 4 * bool(flags & 1) + 4 * bool(flags & 2) + 100 * bool(flags & 4) + 4 * bool(flags & 8)
+
+
+def _main_data_bits(data: bytes, frame: Mp3Frame, version: int, channels: int) -> int:
+    """Length of a frame's own main data (sum of its part2_3_length fields), in bits."""
+    bits = int.from_bytes(data[frame.payload - _side_info_size(version, channels):frame.payload], "big")
+    total_bits = 8 * _side_info_size(version, channels)
+    if version == 1:
+        position = 9 + (3 if channels == 2 else 5) + 4 * channels
+        granules, per_channel = 2, 59
+    else:
+        position = 8 + (2 if channels == 2 else 1)
+        granules, per_channel = 1, 63
+    length = 0
+    for _ in range(granules * channels):
+        length += (bits >> (total_bits - position - 12)) & 0xFFF
+        position += per_channel
+    return length
+
+
+def scan_mp3(data: bytes, max_seconds: Optional[float] = None) -> Optional[Mp3Stream]:
+    """
+    Walk the Layer III frames of MP3 data.
+
+    Args:
+        data: File contents
+        max_seconds: Stop scanning once this much audio is covered
+
+    Returns:
+        Mp3Stream, or None if the data does not start with Layer III frames
+    """
+    offset = _id3v2_size(data)
+    first = _parse_header(data, offset)
+    if first is None:
+        return None
+    version, sample_rate, channels, _, _ = first
+    samples_per_frame = 1152 if version == 1 else 576
+    stream = Mp3Stream(sample_rate=sample_rate, channels=channels, samples_per_frame=samples_per_frame,
+                       version=version, frames=[])
+    limit = None if max_seconds is None else int(max_seconds * sample_rate / samples_per_frame) + 1
+
+    while True:
+        header = _parse_header(data, offset)
+        if header is None or header[0] != version or header[1] != sample_rate:
+            break  # End of audio (ID3v1/APE tag, junk or truncation)
+        _, _, frame_channels, size, side_info = header
+        if offset + size > len(data):
+            break
+        payload = side_info + _side_info_size(version, frame_channels)
+        if not stream.frames and stream.tag_frame is None:
+            is_tag, xing, delay = _tag_info(data, offset, side_info, version, frame_channels)
+            if is_tag:
+                stream.tag_frame = Mp3Frame(offset, size, 0, payload)
+                stream.xing_offset = xing
+                stream.encoder_delay = delay
+                offset += size
+                continue
+        bits = 9 if version == 1 else 8
+        main_data_begin = int.from_bytes(data[side_info:side_info + 2], "big") >> (16 - bits)
+        stream.frames.append(Mp3Frame(offset, size, main_data_begin, payload))
+        offset += size
+        if limit is not None and len(stream.frames) >= limit:
+            break
+
+    return stream if stream.frames else None
+
+
+def _scan_head(f, seconds: float):
+    """(bytes read, Mp3Stream) for just enough of an open MP3 file to cover ``seconds``."""
+    data = f.read(_HEAD_CHUNK)
+    while True:
+        stream = scan_mp3(data, max_seconds=seconds)
+        if stream is not None and stream.duration >= seconds:
+            return data, stream
+        more = f.read(len(data))
+        if not more:
+            return data, stream
+        data += more
+
+
+def audio_seconds(path: str) -> Optional[float]:
+    """Duration of a WAV or MP3 file without decoding it (None if unknown)."""
+    lower = path.lower()
+    try:
+        if lower.endswith(".wav"):
+            with wave.open(path, "rb") as f:
+                return f.getnframes() / f.getframerate()
+        if lower.endswith(".mp3"):
+            with open(path, "rb") as f:
+                stream = scan_mp3(f.read())
+            return stream.duration if stream else None
+    except (OSError, EOFError, wave.Error):
+        return None
+    return None
+
+
+def find_splice_frame(stream: Mp3Stream, after_seconds: float) -> Optional[int]:
+    """
+    Index of the first audio frame that starts at or after a time.
+
+    Times are on the song's decoded timeline, so the song's own encoder and
+    decoder delay is added before converting to frames. Returns None if
+    the song ends first.
+    """
+    delay = stream.encoder_delay + DECODER_DELAY if stream.encoder_delay is not None else 0
+    index = max(1, -(-(int(after_seconds * stream.sample_rate) + delay) // stream.samples_per_frame))
+    return index if index < len(stream.frames) else None
+
+
+def reservoir_needed(stream: Mp3Stream, split: int) -> int:
+    """Bytes of the song's main data, before frame ``split``, that kept frames borrow."""
+    needed = 0
+    position = 0  # Main data bytes from the start of frame split's payload
+    for frame in stream.frames[split:]:
+        if position >= stream.max_reservoir:
+            break
+        needed = max(needed, frame.main_data_begin - position)
+        position += frame.payload_size
+    return needed
+
+
+def _reservoir_bytes(data: bytes, stream: Mp3Stream, split: int, count: int) -> Optional[bytes]:
+    """The last ``count`` main data bytes of the song before frame ``split``."""
+    chunks = []
+    for frame in reversed(stream.frames[:split]):
+        if count <= 0:
+            break
+        payload = data[frame.payload:frame.offset + frame.size]
+        take = payload[-count:] if count < len(payload) else payload
+        chunks.append(take)
+        count -= len(take)
+    return b"".join(reversed(chunks)) if count <= 0 else None
+
+
+def _bridge_frame(encoded: bytes, intro: Mp3Stream, frame: Mp3Frame, reservoir: bytes) -> Optional[bytes]:
+    """
+    Rebuild an intro frame so that its payload ends with ``reservoir``.
+
+    The frame's own main data (after the part held in earlier frames)
+    comes first; the bitrate is raised until everything fits.
+    """
+    header = encoded[frame.offset:frame.offset + 4]
+    if not header[1] & 1:
+        return None  # CRC-protected; the header cannot be changed freely
+    own = -(-_main_data_bits(encoded, frame, intro.version, intro.channels) // 8)
+    own_rest = max(0, own - frame.main_data_begin)
+    head = frame.payload - frame.offset
+    needed = head + own_rest + len(reservoir)
+
+    b2 = header[2]
+    for index in range(b2 >> 4, 15):
+        size = _frame_size(intro.version, index, intro.sample_rate, 0)
+        if size >= needed:
+            break
+    else:
+        return None
+    new_header = header[:2] + bytes([(index << 4) | (b2 & 0x0D)]) + header[3:]
+    side_info = encoded[frame.offset + 4:frame.payload]
+    own_data = encoded[frame.payload:frame.payload + own_rest]
+    return new_header + side_info + own_data + bytes(size - needed) + reservoir
+
+
+def _rewrite_tag_frame(
+    tag: bytes,
+    xing: int,
+    old_offsets: List[int],
+    new_offsets: List[int],
+    old_head: bytes,
+    new_head: bytes
+) -> Optional[bytes]:
+    """
+    Xing/Info header frame updated for a new head of audio frames.
+
+    The audio after the head is unchanged, so the frame count stays, the
+    lengths and the seek table entries past the head move by the change in
+    head size, and the music CRC is corrected for the changed bytes only.
+
+    Args:
+        tag: Original header frame
+        xing: Position of "Xing"/"Info" within it
+        old_offsets: Offsets of the song's head frames, then of its first
+            kept frame, from the start of the header frame
+        new_offsets: The same for the new head
+        old_head: Audio bytes the new head replaces
+        new_head: The new head
+
+    Returns:
+        The new header frame, or None if it does not record the audio's length
+    """
+    tag = bytearray(tag)
+    flags = struct.unpack_from(">I", tag, xing + 4)[0]
+    position = xing + 8 + 4 * bool(flags & 1)
+    bytes_field = position if flags & 2 else None
+    position += 4 * bool(flags & 2)
+    toc = position if flags & 4 else None
+    lame = _lame_offset(bytes(tag), xing)
+    has_lame = bytes(tag[lame:lame + 4]) in _LAME_TAGS and lame + 36 <= len(tag)
+    if has_lame:
+        old_total = struct.unpack_from(">I", tag, lame + 28)[0]  # What the music CRC covers
+    elif bytes_field is not None:
+        old_total = struct.unpack_from(">I", tag, bytes_field)[0]
+    else:
+        return None
+    head_end = old_offsets[-1]
+    if old_total <= head_end:
+        return None
+    delta = new_offsets[-1] - head_end
+    total = old_total + delta
+
+    if bytes_field is not None:
+        struct.pack_into(">I", tag, bytes_field, total)
+    if toc is not None:
+        count = struct.unpack_from(">I", tag, xing + 8)[0] if flags & 1 else 0
+        for i in range(100):
+            scaled = tag[toc + i] * old_total  # Old offset, times 256
+            frame = i * count // 100 if count else bisect_right(old_offsets, scaled // 256) - 1
+            if frame < len(old_offsets) - 1:
+                scaled = 256 * new_offsets[max(0, frame)]
+            else:
+                scaled += 256 * delta
+            tag[toc + i] = min(255, scaled // total)
+    if has_lame:
+        struct.pack_into(">I", tag, lame + 28, total)
+        music_crc = struct.unpack_from(">H", tag, lame + 32)[0]
+        music_crc ^= crc16_shift(crc16(old_head) ^ crc16(new_head), old_total - head_end)
+        struct.pack_into(">H", tag, lame + 32, music_crc)
+        struct.pack_into(">H", tag, lame + 34, crc16(bytes(tag[:lame + 34])))
+    return bytes(tag)
+
+
+def splice_intro(
+    voice_path: str,
+    song_path: str,
+    plan: MixPlan,
+    output_path: str,
+    loudness_dir: Optional[str] = None
+) -> bool:
+    """
+    Mix ``plan``'s voice over an MP3 song, re-encoding only the intro.
+
+    Only songs with a LAME tag are spliced: its encoder delay is what
+    places the song's frames on the decoded timeline. With
+    ``loudness_dir`` the voice's loudness is taken from the render cache's
+    records (see ``stored_measurement``).
+
+    Returns:
+        True if ``output_path`` was written; False if the song cannot be
+        spliced (not MP3, no LAME tag, too short, or no encoder), in which
+        case the caller should render the mix in full.
+    """
+    if not (song_path.lower().endswith(".mp3") and output_path.lower().endswith(".mp3")):
+        return False
+    if not ffmpeg_available():
+        return False
+    voice_seconds = audio_seconds(voice_path)
+    if voice_seconds is None:
+        return False
+
+    voice_end = plan.voice_offset + voice_seconds + SPLICE_MARGIN
+    with open(song_path, "rb") as f:
+        data, song = _scan_head(f, voice_end + SPLICE_LOOKAHEAD)
+    if song is None or song.encoder_delay is None:
+        return False
+    split = find_splice_frame(song, voice_end)
+    if split is None:
+        return False
+    reservoir = _reservoir_bytes(data, song, split, reservoir_needed(song, split))
+    if reservoir is None:
+        return False
+
+    # Our intro decodes with LAME's delay in front; shift it onto the song's timeline
+    spf, rate = song.samples_per_frame, song.sample_rate
+    song_delay = song.encoder_delay + DECODER_DELAY
+    shift = song_delay - (LAME_ENCODER_DELAY + DECODER_DELAY)
+    bitrate = round(sum(frame.size for frame in song.frames[:split]) * 8 * rate / (split * spf * 1000))
+    intro_plan = replace(plan, length=((split + 2) * spf - song_delay) / rate)
+
+    root, _ = os.path.splitext(output_path)
+    unique = f"{os.getpid()}.{threading.get_ident()}"
+    intro_path = f"{root}.{unique}.intro.mp3"
+    tmp_path = f"{root}.{unique}.part.mp3"
+    try:
+        voice_loudness = None
+        if loudness_dir and plan.voice_lufs is not None:
+            voice_loudness = stored_measurement(voice_path, loudness_dir, rate, song.channels)
+        render_mix(voice_path, song_path, intro_plan, intro_path, rate=rate, channels=song.channels,
+                   writer_options={"bitrate": f"{bitrate}k", "shift": shift, "info_tag": False},
+                   voice_loudness=voice_loudness)
+        with open(intro_path, "rb") as f:
+            encoded = f.read()
+        intro = scan_mp3(encoded)
+        if (intro is None or len(intro.frames) < split or intro.sample_rate != rate
+                or intro.channels != song.channels):
+            logger.warning(f"Re-encoded intro of {song_path} does not line up; rendering in full")
+            return False
+        bridge = _bridge_frame(encoded, intro, intro.frames[split - 1], reservoir)
+        if bridge is None:
+            logger.warning(f"No room to bridge the bit reservoir of {song_path}; rendering in full")
+            return False
+
+        head = encoded[intro.frames[0].offset:intro.frames[split - 1].offset] + bridge
+        tag_frame = song.tag_frame
+        tag_end = tag_frame.offset + tag_frame.size
+        old_offsets = [frame.offset - tag_frame.offset for frame in song.frames[:split + 1]]
+        new_offsets = [
+            frame.offset - intro.frames[0].offset + tag_frame.size for frame in intro.frames[:split - 1]
+        ]
+        new_offsets += [tag_frame.size + len(head) - len(bridge), tag_frame.size + len(head)]
+        tag = _rewrite_tag_frame(data[tag_frame.offset:tag_end], song.xing_offset - tag_frame.offset,
+                                 old_offsets, new_offsets, data[tag_end:song.frames[split].offset], head)
+        if tag is None:
+            logger.warning(f"Info tag of {song_path} does not give its length; rendering in full")
+            return False
+
+        with open(tmp_path, "wb") as out, open(song_path, "rb") as source:
+            out.write(data[:song.start])  # ID3v2
+            out.write(tag)
+            out.write(head)
+            source.seek(song.frames[split].offset)
+            shutil.copyfileobj(source, out)  # The rest of the song and any ID3v1/APE tag
+        os.replace(tmp_path, output_path)
+    except (OSError, RuntimeError) as e:
+        logger.warning(f"Intro splice failed for {song_path} ({e}); rendering in full")
+        return False
+    finally:
+        for path in (intro_path, tmp_path):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    logger.info(f"Spliced {split * spf / rate:.1f}s intro into {os.path.basename(song_path)}")
+    return True
@@ -6,13 +6,25 @@ Handles music catalog, metadata, BPM analysis, and smart playlist generation.
 
 import os
 import logging
-import hashlib
+from itertools import islice
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterator, Iterable, Callable, Tuple
 from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum
 
+from core.brain.library_store import LibraryStore, load_library, load_snapshot, save_snapshot
+from core.brain.library_scanner import (
+    ScanResult, hash_file, iter_library_scan, scan_library, apply_file_changes
+)
+from core.brain.library_watcher import LibraryWatcher
+from core.brain.library_index import SearchIndex, AttributeIndex, RangeIndex, intersect_keys
+from core.brain.similarity import SimilarityEngine
+from core.brain.audio_analysis import analyze_library
+from core.brain.fingerprint import FingerprintIndex, from_hex
+from core.brain.playlist_solver import solve_duration
+from core.brain.rotation import RotationEngine
+
 logger = logging.getLogger("AEN.MusicLibrary")
 
 
@@ -82,7 +94,74 @@ class TrackMetadata:
     
     # File hash for deduplication
     file_hash: Optional[str] = None
+    fingerprint: Optional[str] = None  # Acoustic fingerprint (hex), from analysis
+    envelope: Optional[str] = None  # Encoded loudness/energy edge envelopes, from analysis
     
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for catalog storage."""
+        return {
+            "file_path": self.file_path,
+            "title": self.title,
+            "artist": self.artist,
+            "album": self.album,
+            "genre": self.genre.value,
+            "bpm": self.bpm,
+            "key": self.key,
+            "duration_seconds": self.duration_seconds,
+            "energy": self.energy.value,
+            "year": self.year,
+            "sample_rate": self.sample_rate,
+            "bitrate": self.bitrate,
+            "loudness_lufs": self.loudness_lufs,
+            "last_played": self.last_played.isoformat() if self.last_played else None,
+            "play_count": self.play_count,
+            "rotation_category": self.rotation_category,
+            "intro_seconds": self.intro_seconds,
+            "outro_seconds": self.outro_seconds,
+            "hook_start": self.hook_start,
+            "tags": list(self.tags),
+            "mood": list(self.mood),
+            "is_generated": self.is_generated,
+            "generation_source": self.generation_source,
+            "generation_prompt": self.generation_prompt,
+            "file_hash": self.file_hash,
+            "fingerprint": self.fingerprint,
+            "envelope": self.envelope
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "TrackMetadata":
+        last_played = data.get("last_played")
+        return cls(
+            file_path=data["file_path"],
+            title=data["title"],
+            artist=data["artist"],
+            album=data.get("album"),
+            genre=Genre(data.get("genre", "other")),
+            bpm=data.get("bpm"),
+            key=data.get("key"),
+            duration_seconds=data.get("duration_seconds", 0),
+            energy=Energy(data.get("energy", 3)),
+            year=data.get("year"),
+            sample_rate=data.get("sample_rate", 44100),
+            bitrate=data.get("bitrate", 320),
+            loudness_lufs=data.get("loudness_lufs"),
+            last_played=datetime.fromisoformat(last_played) if last_played else None,
+            play_count=data.get("play_count", 0),
+            rotation_category=data.get("rotation_category", "normal"),
+            intro_seconds=data.get("intro_seconds", 0.0),
+            outro_seconds=data.get("outro_seconds", 0.0),
+            hook_start=data.get("hook_start"),
+            tags=list(data.get("tags", [])),
+            mood=list(data.get("mood", [])),
+            is_generated=data.get("is_generated", False),
+            generation_source=data.get("generation_source"),
+            generation_prompt=data.get("generation_prompt"),
+            file_hash=data.get("file_hash"),
+            fingerprint=data.get("fingerprint"),
+            envelope=data.get("envelope")
+        )
+
     def matches_search(self, query: str) -> bool:
         """Check if track matches a search query."""
         query = query.lower()
@@ -116,6 +195,63 @@ class Playlist:
         return len(self.tracks)
 
 
+GENRE_KEYWORDS = {
+    'synthwave': Genre.SYNTHWAVE,
+    'trance': Genre.TRANCE,
+    'house': Genre.HOUSE,
+    'techno': Genre.TECHNO,
+    'dnb': Genre.DRUM_AND_BASS,
+    'drum': Genre.DRUM_AND_BASS,
+    'hardcore': Genre.HAPPY_HARDCORE,
+    'ambient': Genre.AMBIENT,
+    'lofi': Genre.LOFI,
+    'lo-fi': Genre.LOFI,
+    'hip-hop': Genre.HIP_HOP,
+    'hiphop': Genre.HIP_HOP,
+    'electronic': Genre.ELECTRONIC
+}
+
+
+def guess_genre_from_path(path: str) -> Genre:
+    """Guess genre from folder structure."""
+    path_lower = path.lower()
+    
+    for keyword, genre in GENRE_KEYWORDS.items():
+        if keyword in path_lower:
+            return genre
+    
+    return Genre.OTHER
+
+
+def create_track_from_file(file_path: str, hasher: Callable[[str], str] = hash_file) -> TrackMetadata:
+    """
+    Create track metadata from a file.
+
+    Module-level so the library scanner can run it in worker processes.
+    """
+    path = Path(file_path)
+    
+    # Calculate file hash for deduplication
+    file_hash = hasher(file_path)
+    
+    # Basic metadata from filename (artist - title.ext pattern)
+    filename = path.stem
+    if " - " in filename:
+        artist, title = filename.split(" - ", 1)
+    else:
+        artist = "Unknown Artist"
+        title = filename
+    
+    # TODO: Use mutagen or similar for real metadata extraction
+    return TrackMetadata(
+        file_path=file_path,
+        title=title.strip(),
+        artist=artist.strip(),
+        file_hash=file_hash,
+        genre=guess_genre_from_path(file_path)
+    )
+
+
 class MusicLibrary:
     """
     Central music library manager.
@@ -128,91 +264,162 @@ class MusicLibrary:
     - Duplicate detection
     """
     
-    def __init__(self, music_dir: str = None):
+    def __init__(
+        self,
+        music_dir: str = None,
+        db_path: str = None,
+        compact: bool = None,
+        snapshot_path: str = None
+    ):
         self.music_dir = music_dir or os.getenv("MUSIC_DIR", "/music")
-        self.tracks: Dict[str, TrackMetadata] = {}  # hash -> metadata
+        # Runtime state, kept out of the source tree
+        self.db_path = db_path or os.getenv(
+            "MUSIC_LIBRARY_DB",
+            os.path.join(os.getenv("DATA_DIR", "./data"), "music_library.db")
+        )
+        # Fast-start snapshot, used instead of the store when present
+        self.snapshot_path = snapshot_path or os.getenv(
+            "MUSIC_LIBRARY_SNAPSHOT",
+            os.path.splitext(self.db_path)[0] + ".snapshot"
+        )
+        if compact is None:
+            compact = os.getenv("MUSIC_LIBRARY_COMPACT", "").lower() in ("1", "true", "yes")
+        self.compact = compact
+        self._tracks: Dict[str, TrackMetadata] = {}  # hash -> metadata
+        if compact:
+            # Columnar storage for very large catalogs; tracks become views
+            from core.brain.compact_catalog import CompactCatalog
+            self._tracks = CompactCatalog()
+        self._store: Optional[LibraryStore] = None
+        self._loaded = False
+        self._reset_indexes()
         self.playlists: Dict[str, Playlist] = {}
         logger.info(f"Music library initialized: {self.music_dir}")
-    
-    def scan_directory(self, path: str = None) -> int:
-        """Scan a directory for music files."""
-        scan_path = Path(path or self.music_dir)
-        extensions = {'.mp3', '.wav', '.flac', '.ogg', '.m4a', '.aac'}
-        found = 0
-        
-        if not scan_path.exists():
-            logger.warning(f"Music directory not found: {scan_path}")
-            return 0
-        
-        for file_path in scan_path.rglob('*'):
-            if file_path.suffix.lower() in extensions:
-                try:
-                    track = self._create_track_from_file(str(file_path))
-                    self.add_track(track)
-                    found += 1
-                except Exception as e:
-                    logger.error(f"Failed to process {file_path}: {e}")
-        
-        logger.info(f"Scanned {found} tracks from {scan_path}")
-        return found
-    
+
+    def _reset_indexes(self, indexed: bool = True):
+        """Start from empty indexes (``indexed=False`` defers building them)."""
+        self._indexed = indexed
+        self._path_keys: Dict[str, str] = {}  # file path -> hash
+        self._search_index = SearchIndex()
+        self._genre_index = AttributeIndex("genre")
+        self._energy_index = AttributeIndex("energy")
+        self._rotation_index = AttributeIndex("rotation_category")
+        self._bpm_index = RangeIndex("bpm")
+        self._similarity = SimilarityEngine()
+        self._fingerprints = FingerprintIndex()
+        self.rotation = RotationEngine()
+
+    @property
+    def store(self) -> LibraryStore:
+        """The persistent catalog, opened on first use."""
+        if self._store is None:
+            self._store = LibraryStore(self.db_path)
+        return self._store
+
+    @property
+    def tracks(self) -> Dict[str, TrackMetadata]:
+        """Track catalog, loaded lazily from the persistent store."""
+        self._ensure_loaded()
+        return self._tracks
+
+    def _ensure_loaded(self):
+        """Populate the in-memory catalog once, from the snapshot or the store."""
+        if self._loaded:
+            return
+        self._loaded = True
+        if os.path.exists(self.snapshot_path) and self.load_snapshot():
+            return
+
+        load_library(self)
+
+    def _ensure_indexed(self):
+        """Build the indexes once, if loading deferred them."""
+        self._ensure_loaded()
+        if self._indexed:
+            return
+        self._indexed = True
+        tracks = self._tracks
+        # Columnar catalogs decode in bulk; indexes only keep keys and values
+        items = tracks.iter_tracks() if hasattr(tracks, "iter_tracks") else tracks.items()
+        for key, track in items:
+            self._path_keys[track.file_path] = key
+            self._index_track(key, track)
+        logger.info(f"Indexed {len(tracks)} tracks")
+
+    def save_snapshot(self, path: str = None) -> str:
+        """Write the catalog as a binary snapshot (see ``library_store.save_snapshot``)."""
+        return save_snapshot(self, path or self.snapshot_path)
+
+    def load_snapshot(self, path: str = None) -> bool:
+        """Replace the catalog with a memory-mapped snapshot (see ``library_store.load_snapshot``)."""
+        return load_snapshot(self, path or self.snapshot_path)
+
+    def scan_directory(
+        self,
+        path: str = None,
+        max_workers: int = None,
+        batch_size: int = 500,
+        progress: Callable[[int, int], None] = None,
+        analyze: bool = False
+    ) -> int:
+        """Scan a directory for music files (see ``library_scanner.scan_library``)."""
+        return scan_library(self, path, max_workers=max_workers, batch_size=batch_size,
+                            progress=progress, analyze=analyze)
+
+    def iter_scan(
+        self,
+        path: str = None,
+        known: Dict[str, tuple] = None,
+        seen: set = None,
+        max_workers: int = None
+    ) -> Iterator[ScanResult]:
+        """
+        Stream probe results for new or changed files without committing them.
+
+        Yields:
+            ScanResult with the probed TrackMetadata and progress counts
+        """
+        return iter_library_scan(self, path, known=known, seen=seen, max_workers=max_workers)
+
+    def apply_file_changes(
+        self,
+        changed: Iterable[str] = (),
+        deleted: Iterable[str] = (),
+        analyze: bool = True
+    ) -> Tuple[int, int]:
+        """Incrementally apply filesystem changes (see ``library_scanner.apply_file_changes``)."""
+        return apply_file_changes(self, changed, deleted, analyze=analyze)
+
+    def watch(
+        self,
+        path: str = None,
+        debounce: float = 2.0,
+        poll_interval: float = 5.0,
+        use_inotify: bool = None
+    ) -> LibraryWatcher:
+        """
+        Start watching the music directory for live incremental updates.
+
+        Returns:
+            The running LibraryWatcher (call ``stop()`` to end watch mode)
+        """
+        watcher = LibraryWatcher(
+            self, path, debounce=debounce, poll_interval=poll_interval, use_inotify=use_inotify
+        )
+        watcher.start()
+        return watcher
+
     def _create_track_from_file(self, file_path: str) -> TrackMetadata:
         """Create track metadata from a file."""
-        path = Path(file_path)
-        
-        # Calculate file hash for deduplication
-        file_hash = self._hash_file(file_path)
-        
-        # Basic metadata from filename (artist - title.ext pattern)
-        filename = path.stem
-        if " - " in filename:
-            artist, title = filename.split(" - ", 1)
-        else:
-            artist = "Unknown Artist"
-            title = filename
-        
-        # TODO: Use mutagen or similar for real metadata extraction
-        return TrackMetadata(
-            file_path=file_path,
-            title=title.strip(),
-            artist=artist.strip(),
-            file_hash=file_hash,
-            genre=self._guess_genre_from_path(file_path)
-        )
+        return create_track_from_file(file_path, hasher=self._hash_file)
     
     def _hash_file(self, file_path: str) -> str:
         """Generate a hash for file deduplication."""
-        hasher = hashlib.md5()
-        with open(file_path, 'rb') as f:
-            # Only hash first 1MB for speed
-            hasher.update(f.read(1024 * 1024))
-        return hasher.hexdigest()
+        return hash_file(file_path)
     
     def _guess_genre_from_path(self, path: str) -> Genre:
         """Guess genre from folder structure."""
-        path_lower = path.lower()
-        
-        genre_map = {
-            'synthwave': Genre.SYNTHWAVE,
-            'trance': Genre.TRANCE,
-            'house': Genre.HOUSE,
-            'techno': Genre.TECHNO,
-            'dnb': Genre.DRUM_AND_BASS,
-            'drum': Genre.DRUM_AND_BASS,
-            'hardcore': Genre.HAPPY_HARDCORE,
-            'ambient': Genre.AMBIENT,
-            'lofi': Genre.LOFI,
-            'lo-fi': Genre.LOFI,
-            'hip-hop': Genre.HIP_HOP,
-            'hiphop': Genre.HIP_HOP,
-            'electronic': Genre.ELECTRONIC
-        }
-        
-        for keyword, genre in genre_map.items():
-            if keyword in path_lower:
-                return genre
-        
-        return Genre.OTHER
+        return guess_genre_from_path(path)
     
     def add_track(self, track: TrackMetadata):
         """Add a track to the library."""
@@ -222,59 +429,209 @@ class MusicLibrary:
         
         key = track.file_hash or track.file_path
         self.tracks[key] = track
+        self._path_keys[track.file_path] = key
+        self._index_track(key, track)
+
+    def add_tracks(self, tracks: List[TrackMetadata]):
+        """Add a batch of tracks to the library."""
+        for track in tracks:
+            self.add_track(track)
+
+    def remove_track(self, track_hash: str) -> Optional[TrackMetadata]:
+        """Remove a track from the in-memory library."""
+        track = self.tracks.pop(track_hash, None)
+        if track is None:
+            return None
+
+        if self._path_keys.get(track.file_path) == track_hash:
+            del self._path_keys[track.file_path]
+        self._unindex_track(track_hash, track)
+        return track
+
+    def _index_track(self, key: str, track: TrackMetadata):
+        """Add a track to every maintained index."""
+        if not self._indexed:
+            return  # Picked up when the indexes are built
+        self._search_index.add(key, track)
+        self._genre_index.add(key, track)
+        self._energy_index.add(key, track)
+        self._rotation_index.add(key, track)
+        self._bpm_index.add(key, track)
+        self._similarity.add(key, track)
+        self.rotation.add(key, track)
+        if track.fingerprint:
+            duplicates = self._fingerprints.add(key, from_hex(track.fingerprint))
+            if duplicates:
+                logger.info(f"Near-duplicate of {len(duplicates)} track(s): {track.file_path}")
+        else:
+            self._fingerprints.remove(key)
+
+    def _unindex_track(self, key: str, track: TrackMetadata):
+        """Remove a track from every maintained index."""
+        if not self._indexed:
+            return
+        self._search_index.remove(key)
+        self._genre_index.remove(key)
+        self._energy_index.remove(key)
+        self._rotation_index.remove(key)
+        self._bpm_index.remove(key)
+        self._similarity.remove(key)
+        self._fingerprints.remove(key)
+        self.rotation.remove(key)
+
+    def update_track(self, track_hash: str):
+        """
+        Re-index a track after its metadata was changed in place, and
+        persist the change to the catalog.
+        """
+        self.update_tracks([track_hash])
+
+    def update_tracks(self, track_hashes: List[str]):
+        """Re-index and persist several edited tracks in one transaction."""
+        self._ensure_indexed()
+        tracks = self.tracks
+        changed = []
+        for key in track_hashes:
+            track = tracks.get(key)
+            if track is not None:
+                self._index_track(key, track)
+                changed.append(track.to_dict())
+        self.store.update_tracks(changed)
+
+    def analyze_tracks(
+        self,
+        tracks: List[TrackMetadata] = None,
+        max_workers: int = None,
+        force: bool = False
+    ) -> int:
+        """Fill BPM, key, loudness and ramp fields from the audio (see ``audio_analysis.analyze_library``)."""
+        if tracks is None:
+            tracks = list(self.tracks.values())
+
+        return analyze_library(self, tracks, max_workers=max_workers, force=force)
     
     def search(self, query: str, limit: int = 50) -> List[TrackMetadata]:
-        """Search tracks by query."""
-        results = [t for t in self.tracks.values() if t.matches_search(query)]
-        return results[:limit]
-    
+        """
+        Search tracks by query.
+
+        Every word of the query must match the start of a word in the
+        title, artist, album, tags or generation prompt. Results are
+        ranked by where they matched and how often the track has played.
+        """
+        self._ensure_indexed()
+        tracks = self.tracks
+        if not query.strip():
+            return list(tracks.values())[:limit]
+        return [tracks[key] for key, _ in self._search_index.search(query, limit)]
+
+    def get_by_path(self, file_path: str) -> Optional[TrackMetadata]:
+        """Get the track stored for a file path, if any."""
+        self._ensure_indexed()
+        key = self._path_keys.get(str(file_path))
+        return self.tracks[key] if key is not None else None
+
     def get_by_genre(self, genre: Genre, limit: int = 50) -> List[TrackMetadata]:
         """Get tracks by genre."""
-        results = [t for t in self.tracks.values() if t.genre == genre]
-        return results[:limit]
+        self._ensure_indexed()
+        tracks = self.tracks
+        return [tracks[key] for key in islice(self._genre_index.get(genre), limit)]
     
     def get_by_bpm_range(self, min_bpm: int, max_bpm: int) -> List[TrackMetadata]:
-        """Get tracks within a BPM range."""
-        return [
-            t for t in self.tracks.values()
-            if t.bpm and min_bpm <= t.bpm <= max_bpm
-        ]
+        """Get tracks within a BPM range, slowest first."""
+        self._ensure_indexed()
+        tracks = self.tracks
+        return [tracks[key] for key in self._bpm_index.range(min_bpm, max_bpm)]
     
     def get_by_energy(self, energy: Energy) -> List[TrackMetadata]:
         """Get tracks by energy level."""
-        return [t for t in self.tracks.values() if t.energy == energy]
+        self._ensure_indexed()
+        tracks = self.tracks
+        return [tracks[key] for key in self._energy_index.get(energy)]
+
+    def filter_tracks(
+        self,
+        genre: Genre = None,
+        energy: Energy = None,
+        bpm_range: tuple = None,
+        rotation_category: str = None
+    ) -> List[TrackMetadata]:
+        """
+        Get tracks matching every given criterion.
+
+        Each criterion is answered by its index and the key sets are
+        intersected smallest first, so the cost follows the result size.
+        """
+        self._ensure_indexed()
+        tracks = self.tracks
+        key_sets: List[Any] = []
+        if genre:
+            key_sets.append(self._genre_index.get(genre))
+        if energy:
+            key_sets.append(self._energy_index.get(energy))
+        if bpm_range:
+            key_sets.append(self._bpm_index.range(bpm_range[0], bpm_range[1]))
+        if rotation_category:
+            key_sets.append(self._rotation_index.get(rotation_category))
+
+        if not key_sets:
+            return list(tracks.values())
+        return [tracks[key] for key in intersect_keys(key_sets)]
     
+    def find_near_duplicates(self, track: TrackMetadata) -> List[TrackMetadata]:
+        """
+        Find other copies of the same recording (re-encodes, re-tags).
+
+        Needs an analysed track (see ``analyze_tracks``); closest first.
+        """
+        self._ensure_indexed()
+        tracks = self.tracks
+        if not track.fingerprint:
+            return []
+        key = track.file_hash or track.file_path
+        matches = self._fingerprints.query(from_hex(track.fingerprint), exclude=key)
+        return [tracks[k] for k, _ in matches]
+
+    def find_duplicates(self) -> List[List[TrackMetadata]]:
+        """
+        Report near-duplicate clusters across the analysed library.
+
+        Returns:
+            Groups of tracks that are copies of the same recording, largest first
+        """
+        self._ensure_indexed()
+        tracks = self.tracks
+        return [[tracks[key] for key in cluster] for cluster in self._fingerprints.clusters()]
+
     def find_similar_tracks(self, track: TrackMetadata, limit: int = 10) -> List[TrackMetadata]:
         """Find tracks similar to the given track."""
-        candidates = []
-        
-        for t in self.tracks.values():
-            if t.file_hash == track.file_hash:
-                continue
-            
-            score = 0
-            
-            # Same genre = +3
-            if t.genre == track.genre:
-                score += 3
-            
-            # Similar BPM (±10) = +2
-            if t.bpm and track.bpm and abs(t.bpm - track.bpm) <= 10:
-                score += 2
-            
-            # Same energy = +2
-            if t.energy == track.energy:
-                score += 2
-            
-            # Same key = +1 (harmonic mixing)
-            if t.key and track.key and t.key == track.key:
-                score += 1
-            
-            if score > 0:
-                candidates.append((score, t))
-        
-        candidates.sort(key=lambda x: x[0], reverse=True)
-        return [t for _, t in candidates[:limit]]
+        return self.find_similar_batch([track], limit=limit)[0]
+
+    def find_similar_batch(
+        self,
+        seeds: List[TrackMetadata],
+        limit: int = 10,
+        exclude_seeds: bool = True
+    ) -> List[List[TrackMetadata]]:
+        """
+        Find similar tracks for many seeds in one vectorized pass.
+
+        Scoring: same genre +3, BPM within 10 +2, same energy +2,
+        harmonically compatible key up to +1 (Camelot wheel: same key +1,
+        adjacent or relative +0.8), loudness within 2 LU +0.5.
+
+        Args:
+            seeds: Tracks to find neighbours for
+            limit: Maximum neighbours per seed
+            exclude_seeds: Never return any of the seeds as a neighbour
+
+        Returns:
+            One list of similar tracks per seed, best first
+        """
+        self._ensure_indexed()
+        tracks = self.tracks
+        exclude = [t.file_hash or t.file_path for t in seeds] if exclude_seeds else []
+        neighbours = self._similarity.query(seeds, limit=limit, exclude=exclude)
+        return [[tracks[key] for key in keys] for keys in neighbours]
     
     def create_smart_playlist(
         self,
@@ -282,34 +639,50 @@ class MusicLibrary:
         duration_minutes: int = 60,
         genre: Genre = None,
         energy: Energy = None,
-        bpm_range: tuple = None
+        bpm_range: tuple = None,
+        exact: bool = False,
+        tolerance_seconds: int = 5
     ) -> Playlist:
-        """Create a smart playlist based on criteria."""
+        """
+        Create a smart playlist based on criteria.
+
+        By default tracks are shuffled and appended until the target is
+        passed. With ``exact=True`` a subset-sum solver picks tracks whose
+        total lands within ``tolerance_seconds`` of the target, falling
+        back to the greedy fill if no such subset exists.
+        """
         playlist = Playlist(
             name=name,
             is_smart=True,
             smart_rules={
                 "genre": genre.value if genre else None,
                 "energy": energy.value if energy else None,
-                "bpm_range": bpm_range
+                "bpm_range": bpm_range,
+                "exact": exact
             }
         )
         
-        candidates = list(self.tracks.values())
-        
-        # Apply filters
-        if genre:
-            candidates = [t for t in candidates if t.genre == genre]
-        if energy:
-            candidates = [t for t in candidates if t.energy == energy]
-        if bpm_range:
-            candidates = [t for t in candidates if t.bpm and bpm_range[0] <= t.bpm <= bpm_range[1]]
+        candidates = self.filter_tracks(genre=genre, energy=energy, bpm_range=bpm_range)
+        target_seconds = duration_minutes * 60
+
+        if exact:
+            chosen = solve_duration(
+                [t.duration_seconds for t in candidates], target_seconds, tolerance_seconds
+            )
+            if chosen is not None:
+                for i in chosen:
+                    playlist.add_track(candidates[i])
+                logger.info(
+                    f"Created smart playlist '{name}' with {playlist.track_count} tracks "
+                    f"({playlist.total_duration}s for a {target_seconds}s target)"
+                )
+                return playlist
+            logger.warning(f"No exact fill for '{name}' within {tolerance_seconds}s, using greedy fill")
         
         # Fill playlist to target duration
         import random
         random.shuffle(candidates)
         
-        target_seconds = duration_minutes * 60
         current_duration = 0
         
         for track in candidates:
@@ -321,33 +694,57 @@ class MusicLibrary:
         logger.info(f"Created smart playlist '{name}' with {playlist.track_count} tracks")
         return playlist
     
-    def get_rotation_picks(self, category: str = "hot", count: int = 10) -> List[TrackMetadata]:
-        """Get tracks from a rotation category."""
-        candidates = [t for t in self.tracks.values() if t.rotation_category == category]
-        import random
-        return random.sample(candidates, min(count, len(candidates)))
+    def get_rotation_picks(
+        self,
+        category: str = "hot",
+        count: int = 10,
+        schedule: bool = True,
+        air_time: Optional[datetime] = None
+    ) -> List[TrackMetadata]:
+        """
+        Get the next tracks to air from a rotation category.
+
+        Picks the longest-rested tracks that satisfy the artist, title and
+        album separation rules (see ``self.rotation.rules``) at
+        ``air_time`` (default: now). With ``schedule`` they count as played
+        then in this process's rotation state, so the next call moves on;
+        nothing is persisted, and play counts only change when a track is
+        reported through ``update_play_count``. ``schedule=False`` just
+        previews the picks.
+        """
+        self._ensure_indexed()
+        tracks = self.tracks
+        now = air_time.timestamp() if air_time else None
+        return [tracks[key] for key in self.rotation.pick(category, count, now=now, record=schedule)]
     
     def update_play_count(self, track_hash: str):
         """Update play count and last played time."""
+        self._ensure_indexed()
         if track_hash in self.tracks:
-            self.tracks[track_hash].play_count += 1
-            self.tracks[track_hash].last_played = datetime.now()
+            track = self.tracks[track_hash]
+            track.play_count += 1
+            track.last_played = datetime.now()
+            self._search_index.update_popularity(track_hash, track.play_count)
+            self.rotation.record_play(track_hash, track.last_played.timestamp())
+            self.store.update_track(track.to_dict())
     
     def get_stats(self) -> Dict[str, Any]:
         """Get library statistics."""
-        genres = {}
-        for t in self.tracks.values():
-            genres[t.genre.value] = genres.get(t.genre.value, 0) + 1
+        self._ensure_indexed()
+        tracks = self.tracks
+        genres = {
+            genre.value: count for genre, count in self._genre_index.counts().items()
+        }
         
         return {
-            "total_tracks": len(self.tracks),
+            "total_tracks": len(tracks),
             "total_playlists": len(self.playlists),
             "genres": genres,
-            "total_duration_hours": sum(t.duration_seconds for t in self.tracks.values()) / 3600
+            "total_duration_hours": sum(t.duration_seconds for t in tracks.values()) / 3600
         }
 
 
 # Convenience function
-def get_library(music_dir: str = None) -> MusicLibrary:
+def get_library(music_dir: str = None, db_path: str = None, compact: bool = None) -> MusicLibrary:
     """Get a configured music library instance."""
-    return MusicLibrary(music_dir)
+    return MusicLibrary(music_dir, db_path, compact=compact)
@@ -0,0 +1,87 @@
+"""
+Playlist Solver for Neon Frequency
+==================================
+Duration-exact track selection.
+
+Picking tracks that fill an hour to the second is subset-sum over track
+durations. Durations are whole seconds, so the set of reachable totals
+fits in one bitset (a Python int): adding a track is a single
+shift-and-or, and the saved bitsets let the chosen subset be walked back
+afterwards. The candidate pool is shuffled and capped, which keeps the
+work bounded and the playlists varied on very large libraries.
+"""
+
+import random
+import logging
+from typing import Optional, List, Sequence
+
+logger = logging.getLogger("AEN.PlaylistSolver")
+
+
+# Candidates considered per solve; plenty for any realistic daypart
+MAX_CANDIDATES = 2000
+
+
+def solve_duration(
+    durations: Sequence[int],
+    target: int,
+    tolerance: int = 0,
+    max_candidates: int = MAX_CANDIDATES,
+    rng: Optional[random.Random] = None
+) -> Optional[List[int]]:
+    """
+    Choose items whose durations sum as close to ``target`` as possible.
+
+    Args:
+        durations: Item durations in whole seconds (items <= 0 are ignored)
+        target: Desired total in seconds
+        tolerance: Accept totals within this many seconds of the target
+        max_candidates: Cap on items considered (a random sample beyond it)
+        rng: Random source for candidate order
+
+    Returns:
+        Indices into ``durations`` (in shuffled order), or None if no
+        subset lands within the tolerance
+    """
+    if target <= 0:
+        return []
+
+    rng = rng or random.Random()
+    order = [i for i, d in enumerate(durations) if d > 0]
+    rng.shuffle(order)
+    order = order[:max_candidates]
+
+    limit = target + tolerance
+    mask = (1 << (limit + 1)) - 1
+    reachable = 1  # Bit s set: some subset of the items so far sums to s
+    history: List[int] = []  # Reachable totals *before* each item
+    for i in order:
+        history.append(reachable)
+        reachable = (reachable | (reachable << durations[i])) & mask
+        if reachable >> target & 1:
+            break
+
+    best = _closest_reachable(reachable, target, tolerance)
+    if best is None:
+        return None
+
+    # Walk back: an item was needed iff the total was not reachable without it
+    chosen = []
+    total = best
+    for i, before in zip(reversed(order[:len(history)]), reversed(history)):
+        if total == 0:
+            break
+        if not before >> total & 1:
+            chosen.append(i)
+            total -= durations[i]
+    chosen.reverse()
+    return chosen
+
+
+def _closest_reachable(reachable: int, target: int, tolerance: int) -> Optional[int]:
+    for offset in range(tolerance + 1):
+        if reachable >> (target + offset) & 1:
+            return target + offset
+        if offset and target - offset >= 0 and reachable >> (target - offset) & 1:
+            return target - offset
+    return None
@@ -12,6 +12,13 @@ from dataclasses import dataclass
 from datetime import datetime
 from functools import lru_cache
 
+import numpy as np
+
+from core.brain.envelope import Segue, decode_envelope, plan_segues
+from core.brain.harmony import COMPATIBILITY, UNKNOWN_KEY, camelot_code, key_compatibility
+from core.brain.sequencing import optimize_path, path_score
+from core.brain.tts_cache import TTSCache, get_tts_cache, tts_key
+
 logger = logging.getLogger("AEN.Radio")
 
 
@@ -26,6 +33,8 @@ class Track:
     genre: Optional[str] = None
     bpm: Optional[int] = None
     energy: Optional[float] = None  # 0.0-1.0
+    key: Optional[str] = None  # e.g., "Am", "C#", "8A"
+    envelope: Optional[str] = None  # Encoded edge envelopes from library analysis
 
 
 @dataclass
@@ -217,10 +226,14 @@ class VoiceGenerator:
     AI Voice Generation using ElevenLabs.
     
     Generates DJ voiceovers, station IDs, weather reports, etc.
+    Speech is served from the shared TTS cache when it was made before.
     """
     
-    def __init__(self, api_key: str = None):
+    model_id = "eleven_monolingual_v1"
+    
+    def __init__(self, api_key: str = None, cache: TTSCache = None):
         self.api_key = api_key or os.getenv("ELEVENLABS_API_KEY", "")
+        self.cache = cache
         self.base_url = "https://api.elevenlabs.io/v1"
         self.default_voice = os.getenv("ELEVENLABS_VOICE_ID", "21m00Tcm4TlvDq8ikWAM")  # Rachel
         
@@ -268,26 +281,25 @@ class VoiceGenerator:
             Audio bytes in MP3 format, or None on failure
         """
         voice = voice_id or self.default_voice
+        settings = {"stability": stability, "similarity_boost": similarity_boost}
         
-        try:
+        def request() -> bytes:
             response = self.client.post(
                 f"/text-to-speech/{voice}",
                 json={
                     "text": text,
-                    "model_id": "eleven_monolingual_v1",
-                    "voice_settings": {
-                        "stability": stability,
-                        "similarity_boost": similarity_boost
-                    }
+                    "model_id": self.model_id,
+                    "voice_settings": settings
                 },
                 headers={"Accept": "audio/mpeg"}
             )
             response.raise_for_status()
-            audio_data = response.content
-            
-            if output_path:
-                with open(output_path, "wb") as f:
-                    f.write(audio_data)
+            return response.content
+        
+        try:
+            key = tts_key(text, voice, self.model_id, settings)
+            audio_data = (self.cache or get_tts_cache()).get_or_generate(key, request, output_path)
+            if audio_data and output_path:
                 logger.info(f"Audio saved to {output_path}")
             
             return audio_data
@@ -317,6 +329,11 @@ class VoiceGenerator:
         return self.generate_audio(script)
 
 
+# Harmonic mixing: Camelot compatibility (0-1) scaled into -0.1 (clash) .. +0.1 (same key)
+HARMONIC_WEIGHT = 0.2
+HARMONIC_OFFSET = 0.1
+
+
 class PlaylistOptimizer:
     """
     AI-powered playlist optimization.
@@ -362,10 +379,24 @@ class PlaylistOptimizer:
             if current.genre == next_track.genre:
                 score += 0.1
         
+        # Harmonic mixing (Camelot wheel)
+        compatibility = key_compatibility(current.key, next_track.key)
+        if compatibility is not None:
+            score += HARMONIC_WEIGHT * compatibility - HARMONIC_OFFSET
+        
         return max(0.0, min(1.0, score))
     
     def suggest_crossfade_duration(self, current: Track, next_track: Track) -> int:
-        """Suggest optimal crossfade duration in milliseconds."""
+        """
+        Suggest optimal crossfade duration in milliseconds.
+        
+        Planned from the tracks' analysed envelopes when both have them,
+        otherwise estimated from BPM.
+        """
+        segue = self.plan_segues([current, next_track])[0]
+        if segue is not None:
+            return segue.crossfade_ms
+        
         base_duration = 3000  # 3 seconds default
         
         # Adjust based on BPM
@@ -378,32 +409,78 @@ class PlaylistOptimizer:
         
         return base_duration
     
-    def optimize_queue(self, tracks: List[Track]) -> List[Track]:
+    def plan_segues(self, tracks: List[Track]) -> List[Optional[Segue]]:
+        """
+        Plan the fade points of every consecutive pair in a queue.
+        
+        Uses only the cached envelopes, so no audio is decoded. Pairs where
+        either track has no envelope get None.
+        """
+        envelopes = [decode_envelope(t.envelope) if t.envelope else None for t in tracks]
+        pairs = [
+            i for i in range(len(tracks) - 1)
+            if envelopes[i] is not None and envelopes[i + 1] is not None
+        ]
+        planned = plan_segues(
+            [envelopes[i] for i in pairs],
+            [envelopes[i + 1] for i in pairs],
+            [tracks[i].bpm for i in pairs],
+            [tracks[i + 1].bpm for i in pairs]
+        )
+        segues: List[Optional[Segue]] = [None] * max(0, len(tracks) - 1)
+        for i, segue in zip(pairs, planned):
+            segues[i] = segue
+        return segues
+    
+    def transition_matrix(self, tracks: List[Track]) -> np.ndarray:
+        """
+        Score every ordered pair of tracks at once.
+        
+        Returns an (n, n) array where [i, j] equals
+        calculate_transition_score(tracks[i], tracks[j]).
+        """
+        # Missing (or zero) values skip a rule, as in the pairwise score
+        bpm = np.array([t.bpm or np.nan for t in tracks], dtype=np.float64)
+        energy = np.array([t.energy or np.nan for t in tracks], dtype=np.float64)
+        genres: Dict[str, int] = {}
+        genre = np.array([genres.setdefault(t.genre, len(genres)) if t.genre else -1 for t in tracks])
+        keys = np.array([camelot_code(t.key) for t in tracks], dtype=np.int8)
+        
+        scores = np.full((len(tracks), len(tracks)), 0.5)
+        with np.errstate(invalid="ignore"):
+            bpm_diff = np.abs(bpm[:, None] - bpm[None, :])
+            scores += np.select(
+                [bpm_diff <= 5, bpm_diff <= 10, bpm_diff > 30], [0.25, 0.15, -0.2], 0.0
+            )
+            energy_diff = np.abs(energy[:, None] - energy[None, :])
+            scores += np.select(
+                [energy_diff <= 0.1, energy_diff <= 0.2, energy_diff > 0.5], [0.2, 0.1, -0.15], 0.0
+            )
+        scores += np.where((genre[:, None] == genre[None, :]) & (genre[:, None] >= 0), 0.1, 0.0)
+        # Unknown keys (-1) index the table's zero padding; the mask drops their offset
+        known = keys != UNKNOWN_KEY
+        scores += np.where(
+            known[:, None] & known[None, :],
+            HARMONIC_WEIGHT * COMPATIBILITY[keys[:, None], keys[None, :]] - HARMONIC_OFFSET,
+            0.0
+        )
+        return np.clip(scores, 0.0, 1.0)
+    
+    def optimize_queue(self, tracks: List[Track], time_budget: float = 0.05) -> List[Track]:
         """
         Reorder tracks for optimal flow.
         
-        Uses a greedy algorithm to maximize transition scores.
+        The first track stays in place. Builds the transition matrix once,
+        takes the greedy best-next-track order, then improves it with
+        2-opt / Or-opt local search for up to ``time_budget`` seconds.
         """
         if len(tracks) <= 2:
             return tracks
         
-        optimized = [tracks[0]]
-        remaining = tracks[1:]
-        
-        while remaining:
-            current = optimized[-1]
-            # Find best next track
-            scores = [
-                (t, self.calculate_transition_score(current, t))
-                for t in remaining
-            ]
-            scores.sort(key=lambda x: x[1], reverse=True)
-            best_track = scores[0][0]
-            
-            optimized.append(best_track)
-            remaining.remove(best_track)
-        
-        return optimized
+        matrix = self.transition_matrix(tracks)
+        order = optimize_path(matrix, start=0, time_budget=time_budget)
+        logger.debug(f"Queue flow score: {path_score(matrix, order):.2f} over {len(tracks)} tracks")
+        return [tracks[i] for i in order]
 
 
 class ShowRunner:
@@ -0,0 +1,249 @@
+"""
+Render Cache for Neon Frequency
+===============================
+Finished mixes, addressed by what went into them.
+
+A mix is fully determined by the bytes of its inputs and its mix plan, so
+the cache key is a hash of exactly those. Rendering the same voice over
+the same bed with the same settings again returns the stored file without
+decoding or encoding anything. The cache directory is capped in size;
+least recently used renders are evicted first.
+
+Voices are measured for loudness normalization once per content: the
+loudness and length are kept under the file's digest in ``loudness/``,
+so later mixes of the same voice (over any bed, in any process) start
+mixing without decoding it first.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import asdict
+from functools import lru_cache
+from typing import Optional, Dict, Any, Tuple
+
+from core.brain.mix_engine import MixPlan, measure_audio, MIX_RATE, MIX_CHANNELS
+
+logger = logging.getLogger("AEN.RenderCache")
+
+
+# Bump when the mix engine's output changes for the same inputs (2: predicted output loudness)
+RENDER_VERSION = 2
+DEFAULT_MAX_MB = 1024
+MAX_LOUDNESS_RECORDS = 20000
+_HASH_CHUNK = 1 << 20
+
+
+@lru_cache(maxsize=4096)
+def _digest(path: str, mtime_ns: int, size: int) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file's contents (remembered until the file changes)."""
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    return _digest(path, stat.st_mtime_ns, stat.st_size)
+
+
+def stored_measurement(
+    path: str,
+    store_dir: str,
+    rate: int = MIX_RATE,
+    channels: int = MIX_CHANNELS
+) -> Tuple[Optional[float], float]:
+    """
+    (loudness in LUFS, seconds) of a file, measured once per content.
+
+    Kept in ``store_dir`` under the file's digest and the format it was
+    measured at; a missing or unreadable record is measured again.
+    """
+    record = os.path.join(store_dir, f"{file_digest(path)}-{rate}-{channels}.json")
+    try:
+        with open(record, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+        return stored["lufs"], stored["seconds"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    lufs, seconds = measure_audio(path, rate, channels)
+    os.makedirs(store_dir, exist_ok=True)
+    tmp_path = f"{record}.{os.getpid()}.{threading.get_ident()}.part"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"lufs": lufs, "seconds": seconds}, f)
+        os.replace(tmp_path, record)
+    except OSError as e:
+        logger.warning(f"Could not store the loudness of {path}: {e}")
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    return lufs, seconds
+
+
+class RenderCache:
+    """
+    Size-capped directory of renders named by their content key.
+
+    Like TTSCache, the LRU index is read from the directory once, when the
+    cache is created, and kept in memory with a running size total from
+    then on; renders added by other processes count once this one sees
+    them. Voice loudness records (see ``stored_measurement``) live in
+    ``loudness_dir`` and are trimmed to MAX_LOUDNESS_RECORDS at startup.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: Optional[int] = None):
+        if max_bytes is None:
+            max_bytes = int(os.getenv("RENDER_CACHE_MB", DEFAULT_MAX_MB)) * 1024 * 1024
+        self.cache_dir = cache_dir
+        self.loudness_dir = os.path.join(cache_dir, "loudness")
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # file name -> size
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        found = []
+        with os.scandir(self.cache_dir) as scan:
+            for entry in scan:
+                if entry.is_file() and ".part" not in entry.name:
+                    stat = entry.stat()
+                    found.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._bytes += size
+
+        if not os.path.isdir(self.loudness_dir):
+            return
+        with os.scandir(self.loudness_dir) as scan:
+            records = sorted((entry.stat().st_mtime, entry.path) for entry in scan if entry.is_file())
+        for _, path in records[:max(0, len(records) - MAX_LOUDNESS_RECORDS)]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def key(
+        voice_path: str,
+        bed_path: Optional[str],
+        plan: MixPlan,
+        extension: str,
+        **extra: Any
+    ) -> str:
+        """Content key of a render (raises OSError if an input is missing)."""
+        parts = {
+            "version": RENDER_VERSION,
+            "rate": MIX_RATE,
+            "channels": MIX_CHANNELS,
+            "voice": file_digest(voice_path),
+            "bed": file_digest(bed_path) if bed_path else None,
+            "plan": asdict(plan),
+            "format": extension.lower(),
+            **extra,
+        }
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def path_for(self, key: str, extension: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}{extension.lower()}")
+
+    def get(self, key: str, extension: str) -> Optional[str]:
+        """Path of a stored render, or None."""
+        path = self.path_for(key, extension)
+        name = os.path.basename(path)
+        if not os.path.exists(path):
+            with self._lock:
+                self.misses += 1
+                if name in self._entries:  # Removed behind our back
+                    self._bytes -= self._entries.pop(name)
+            return None
+        try:
+            os.utime(path)  # Mark as recently used
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            if name in self._entries:
+                self._entries.move_to_end(name)
+            else:
+                size = os.path.getsize(path)
+                self._entries[name] = size
+                self._bytes += size
+        return path
+
+    def add(self, path: str):
+        """Register a render just written to ``path_for(...)`` and evict to fit."""
+        name = os.path.basename(path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._bytes -= self._entries.pop(name, 0)
+            self._entries[name] = size
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                victim, victim_size = self._entries.popitem(last=False)
+                self._bytes -= victim_size
+                self.evictions += 1
+                try:
+                    os.unlink(os.path.join(self.cache_dir, victim))
+                except OSError:
+                    pass
+
+    @staticmethod
+    def deliver(cached_path: str, output_path: str) -> str:
+        """
+        Make a stored render available at ``output_path``.
+
+        Entries are evicted whenever the cache is full, so renders leave the
+        cache only as links or copies owned by the caller.
+
+        Raises:
+            FileNotFoundError: ``cached_path`` is gone
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        tmp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            os.link(cached_path, tmp_path)
+        except OSError:
+            shutil.copyfile(cached_path, tmp_path)
+        os.replace(tmp_path, output_path)
+        return output_path
+
+    def deliver_cached(self, cached_path: str, output_path: str) -> Optional[str]:
+        """
+        ``deliver`` a path returned by ``get``, or None if another process
+        evicted it in between (the caller renders it again).
+        """
+        try:
+            return self.deliver(cached_path, output_path)
+        except FileNotFoundError:
+            logger.info(f"Render {os.path.basename(cached_path)} was evicted before delivery")
+            name = os.path.basename(cached_path)
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+                if name in self._entries:
+                    self._bytes -= self._entries.pop(name)
+            return None
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
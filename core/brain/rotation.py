@@ -0,0 +1,234 @@
+"""
+Rotation Engine for Neon Frequency
+==================================
+Category rotation with rest times and artist/title/album separation.
+
+Every rotation category keeps a min-heap of (eligible_at, tiebreak, key).
+A track becomes eligible once its category's rest time has passed since
+it last played; a pick pops the heap instead of scanning the category.
+Stale heap entries (tracks rescheduled or removed) are skipped lazily.
+"""
+
+import time
+import heapq
+import random
+import logging
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict, Any, Tuple
+
+logger = logging.getLogger("AEN.Rotation")
+
+
+DEFAULT_CATEGORY_REST = {
+    "hot": 2 * 3600,
+    "normal": 6 * 3600,
+    "recurrent": 12 * 3600,
+    "gold": 24 * 3600,
+}
+
+# Placeholder artists that should not block each other
+UNSEPARATED_ARTISTS = {"", "unknown artist", "various artists"}
+
+
+@dataclass
+class RotationRules:
+    """Separation windows and rest times, in seconds."""
+    artist_separation: float = 3600.0
+    title_separation: float = 3 * 3600.0
+    album_separation: float = 1800.0
+    category_rest: Dict[str, float] = field(default_factory=lambda: dict(DEFAULT_CATEGORY_REST))
+    default_rest: float = 6 * 3600.0
+
+    def rest_for(self, category: str) -> float:
+        return self.category_rest.get(category, self.default_rest)
+
+
+def _norm(value: Optional[str]) -> str:
+    return (value or "").strip().lower()
+
+
+class RotationEngine:
+    """
+    Per-category eligibility heaps with separation rules.
+
+    Tracks are passed in as TrackMetadata-like objects; only their artist,
+    title, album, rotation_category and last_played are read.
+    """
+
+    def __init__(self, rules: RotationRules = None, rng: random.Random = None):
+        self.rules = rules or RotationRules()
+        self._rng = rng or random.Random()
+        self._heaps: Dict[str, List[Tuple[float, float, str]]] = {}
+        self._entries: Dict[str, Tuple[float, float, str]] = {}  # key -> live heap entry
+        self._categories: Dict[str, str] = {}
+        self._info: Dict[str, Tuple[str, str, str]] = {}  # key -> (artist, title, album)
+        self._last_artist: Dict[str, float] = {}
+        self._last_title: Dict[str, float] = {}
+        self._last_album: Dict[str, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    # ---- catalog maintenance ----
+
+    def add(self, key: str, track: Any):
+        """Add (or refresh) a track, scheduling it from its last play."""
+        category = track.rotation_category
+        info = (_norm(track.artist), _norm(track.title), _norm(track.album))
+        eligible_at = 0.0
+        if track.last_played is not None:
+            played = track.last_played.timestamp()
+            eligible_at = played + self.rules.rest_for(category)
+            self._note_play(info, played)
+
+        previous = self._entries.get(key)
+        if previous is not None and self._categories.get(key) == category:
+            # Keep any later eligibility from a pick not yet played
+            eligible_at = max(eligible_at, previous[0])
+
+        self._info[key] = info
+        self._schedule(key, category, eligible_at)
+
+    def remove(self, key: str):
+        self._entries.pop(key, None)
+        self._categories.pop(key, None)
+        self._info.pop(key, None)
+
+    def _schedule(self, key: str, category: str, eligible_at: float):
+        entry = (eligible_at, self._rng.random(), key)
+        self._entries[key] = entry
+        self._categories[key] = category
+        heapq.heappush(self._heaps.setdefault(category, []), entry)
+
+    def _note_play(self, info: Tuple[str, str, str], when: float):
+        artist, title, album = info
+        if artist not in UNSEPARATED_ARTISTS:
+            self._last_artist[artist] = max(when, self._last_artist.get(artist, when))
+        if title:
+            self._last_title[title] = max(when, self._last_title.get(title, when))
+        if album:
+            self._last_album[album] = max(when, self._last_album.get(album, when))
+
+    def record_play(self, key: str, when: float = None):
+        """Register a play: start separation windows and the category rest."""
+        if key not in self._entries:
+            return
+        when = time.time() if when is None else when
+        self._note_play(self._info[key], when)
+        category = self._categories[key]
+        self._schedule(key, category, when + self.rules.rest_for(category))
+
+    def eligible_at(self, key: str) -> Optional[float]:
+        entry = self._entries.get(key)
+        return entry[0] if entry else None
+
+    # ---- picking ----
+
+    def _separated_until(self, info: Tuple[str, str, str]) -> float:
+        """Earliest time the artist, title and album separations all allow a play."""
+        artist, title, album = info
+        rules = self.rules
+        until = 0.0
+        if artist in self._last_artist:
+            until = max(until, self._last_artist[artist] + rules.artist_separation)
+        if title in self._last_title:
+            until = max(until, self._last_title[title] + rules.title_separation)
+        if album in self._last_album:
+            until = max(until, self._last_album[album] + rules.album_separation)
+        return until
+
+    def pick(
+        self,
+        category: str,
+        count: int,
+        now: float = None,
+        relax: bool = True,
+        record: bool = True
+    ) -> List[str]:
+        """
+        Pick up to ``count`` tracks from a category, soonest-eligible first.
+
+        With ``record`` picked tracks count as played at ``now`` (they are
+        about to air), so later picks respect their separation and rest,
+        and tracks blocked by separation are requeued for when it ends;
+        without it the rotation is left as it was. With ``relax``, a
+        shortfall of rested tracks is filled with the ones closest to
+        eligibility (popped from the heap in order), still never repeating
+        an artist, title or album within the batch.
+        """
+        now = time.time() if now is None else now
+        heap = self._heaps.get(category, [])
+        picked: List[Tuple[float, float, str]] = []
+        deferred: List[Tuple[float, float, str]] = []
+        used: set = set()
+
+        def clashes(info: Tuple[str, str, str]) -> bool:
+            artist, title, album = info
+            return (
+                (artist not in UNSEPARATED_ARTISTS and ("artist", artist) in used)
+                or (title and ("title", title) in used)
+                or (album and ("album", album) in used)
+            )
+
+        def take(entry: Tuple[float, float, str]):
+            artist, title, album = self._info[entry[2]]
+            used.update({("artist", artist), ("title", title), ("album", album)})
+            picked.append(entry)
+
+        while heap and len(picked) < count:
+            entry = heapq.heappop(heap)
+            eligible_at, _, key = entry
+            if self._entries.get(key) is not entry:
+                continue  # Stale: rescheduled or removed
+            if eligible_at > now:
+                heapq.heappush(heap, entry)
+                break
+
+            separated = self._separated_until(self._info[key])
+            if separated > now:
+                if record:
+                    # Blocked by a recent play: move it to when it is allowed
+                    self._schedule(key, category, separated)
+                else:
+                    deferred.append(entry)  # A preview leaves it queued as it was
+            elif clashes(self._info[key]):
+                deferred.append(entry)
+            else:
+                take(entry)
+
+        for entry in deferred:
+            heapq.heappush(heap, entry)
+        if relax and len(picked) < count:
+            # Not enough rested tracks: relax rest and separation windows
+            skipped = []
+            while heap and len(picked) < count:
+                entry = heapq.heappop(heap)
+                if self._entries.get(entry[2]) is not entry:
+                    continue
+                if clashes(self._info[entry[2]]):
+                    skipped.append(entry)
+                else:
+                    take(entry)
+            for entry in skipped:
+                heapq.heappush(heap, entry)
+
+        keys = [entry[2] for entry in picked]
+        if record:
+            for key in keys:
+                self.record_play(key, now)
+        else:
+            for entry in picked:
+                heapq.heappush(heap, entry)
+        if len(heap) > 2 * len(self._entries) + 64:
+            self._compact()
+        return keys
+
+    def _compact(self):
+        """Drop stale entries once they outnumber live ones."""
+        for category, heap in self._heaps.items():
+            live = [e for e in heap if self._entries.get(e[2]) is e]
+            heapq.heapify(live)
+            self._heaps[category] = live
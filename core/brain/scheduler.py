@@ -8,8 +8,9 @@ weather, news, and music.
 import os
 import logging
 import random
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import List, Optional
+from typing import List, Optional, Union
 from pathlib import Path
 
 # Imports
@@ -19,10 +20,21 @@ from core.brain.weather_client import WeatherClient
 from core.brain.agents.news_agent import NewsAgent
 from core.brain.music_library import MusicLibrary, TrackMetadata, Genre
 from core.brain.playlist_manager import PlaylistManager
-from core.brain.voice_mixer import get_voice_mixer
+from core.brain.voice_mixer import get_voice_mixer, MixJob
 
 logger = logging.getLogger("AEN.Scheduler")
 
+
+@dataclass
+class _PendingRamp:
+    """A voice-over-intro slot whose mix is rendered with the rest of the batch."""
+    song: TrackMetadata
+    voice_track: TrackMetadata
+    ramp_seconds: float
+    context: ContentContext  # For the stop-set intro if the mix fails
+    mixed_path: Optional[str] = None
+
+
 class RadioScheduler:
     """
     The Master Scheduler.
@@ -51,21 +63,14 @@ class RadioScheduler:
         if not text:
             return None
 
-        # Create a filename based on hash of text to avoid re-generating same lines
-        import hashlib
-        text_hash = hashlib.md5(text.encode('utf-8')).hexdigest()
-        filename = f"{prefix}_{text_hash}.mp3"
+        # Name the file by its TTS cache key (text, voice, model and settings).
+        # Every line goes through the TTS cache, which links the file from its
+        # entry; lines already spoken come from there without an API call
+        filename = f"{prefix}_{self.voice.cache_key(text)}.mp3"
         filepath = self.audio_dir / filename
-        
-        # If exists, return cached
-        if filepath.exists():
-            return str(filepath.absolute())
 
-        # Generate
-        audio_data = self.voice.generate(text)
-        if audio_data:
-            with open(filepath, "wb") as f:
-                f.write(audio_data)
+        audio_data = self.voice.generate(text, output_path=str(filepath))
+        if audio_data and filepath.exists():
             return str(filepath.absolute())
 
         return None
@@ -92,11 +97,26 @@ class RadioScheduler:
             generation_prompt=text
         )
 
-    def generate_hour_block(self, hour: int, output_dir: str) -> str:
+    def generate_hour_block(self, hour: int, output_dir: str, air_time: Optional[datetime] = None) -> str:
         """
         Generate a 1-hour playlist M3U file.
+        Songs are picked for ``air_time`` (default: now).
         Returns the path to the generated playlist.
         """
+        block = self._plan_hour_block(hour, air_time)
+        self._render_ramps([block])
+        return self._export_hour_block(hour, block, output_dir)
+
+    def _plan_hour_block(
+        self,
+        hour: int,
+        air_time: Optional[datetime] = None
+    ) -> List[Union[TrackMetadata, _PendingRamp]]:
+        """
+        Script and voice an hour; ramp mixes are left as _PendingRamp slots
+        so they can be rendered together. Songs are picked for ``air_time``,
+        so rest and separation windows count from when the hour airs.
+        """
         logger.info(f"Generating schedule for Hour {hour:02d}...")
         
         # 1. Context
@@ -120,7 +140,7 @@ class RadioScheduler:
         package = self.producer.generate_hourly_package(context)
         
         # 3. Assemble Playlist Tracks
-        playlist_tracks: List[TrackMetadata] = []
+        playlist_tracks: List[Union[TrackMetadata, _PendingRamp]] = []
         
         # -- Top of Hour ID --
         track = self._create_voice_track(package["top_of_hour_id"], "Station ID")
@@ -132,7 +152,9 @@ class RadioScheduler:
         
         # -- Music Block 1 --
         # Try to get real music, otherwise mock
-        music_tracks = self.library.get_rotation_picks(count=15) # Grab enough for the hour
+        music_tracks = self.library.get_rotation_picks(count=15, air_time=air_time) # Grab enough for the hour
+        # Intro lengths for ramp-aware mixing were measured when the songs
+        # were scanned; planning never decodes audio
         if not music_tracks:
             # Create dummy music tracks for demo
             music_tracks = [
@@ -186,40 +208,22 @@ class RadioScheduler:
                             voice_track = self._create_voice_track(intro_text, f"Intro: {song.title}")
 
                             if voice_track:
-                                # 3. Mix
-                                mixer = get_voice_mixer()
-                                # Synchronous call
-                                mixed_path = mixer.mix_over_intro(
-                                    voice_track.file_path,
-                                    song.file_path,
-                                    ramp_seconds
-                                )
-
-                                if mixed_path:
-                                    # Create metadata for the mixed track
-                                    mixed_song = TrackMetadata(
-                                        file_path=mixed_path,
-                                        title=song.title,
-                                        artist=song.artist,
-                                        duration_seconds=song.duration_seconds,
-                                        intro_seconds=0, # Ramp used
-                                        is_generated=True,
-                                        generation_prompt="Voice Over Ramp Mix"
-                                    )
-                                    playlist_tracks.append(mixed_song)
-                                    mixed_success = True
+                                # 3. Mix (rendered later with every other ramp in the batch)
+                                playlist_tracks.append(_PendingRamp(
+                                    song=song,
+                                    voice_track=voice_track,
+                                    ramp_seconds=ramp_seconds,
+                                    context=ContentContext(weather=weather_data, next_track=song.title,
+                                                           time_of_day=time_of_day)
+                                ))
+                                mixed_success = True
                         except Exception as e:
                             logger.error(f"Ramp mixing failed: {e}")
 
                     if not mixed_success:
-                        # Fallback: Stop Set (Voice then Song)
-                        # We need to regenerate intro specifically for THIS song to be accurate
-                        intro_text = self.engine_morning.generate_song_intro(
-                            ContentContext(weather=weather_data, next_track=song.title, time_of_day=time_of_day)
-                        )
-                        intro = self._create_voice_track(intro_text, f"Intro: {song.title}")
-                        if intro: playlist_tracks.append(intro)
-                        playlist_tracks.append(song)
+                        self._append_stop_set(playlist_tracks, song, ContentContext(
+                            weather=weather_data, next_track=song.title, time_of_day=time_of_day
+                        ))
 
                 else:
                     playlist_tracks.append(song)
@@ -241,6 +245,56 @@ class RadioScheduler:
             playlist_tracks.append(music_tracks[music_idx])
             music_idx += 1
 
+        return playlist_tracks
+
+    def _append_stop_set(self, playlist_tracks: list, song: TrackMetadata, context: ContentContext):
+        """Fallback: Stop Set (Voice then Song)."""
+        # We need to regenerate intro specifically for THIS song to be accurate
+        intro_text = self.engine_morning.generate_song_intro(context)
+        intro = self._create_voice_track(intro_text, f"Intro: {song.title}")
+        if intro: playlist_tracks.append(intro)
+        playlist_tracks.append(song)
+
+    def _render_ramps(self, blocks: List[List[Union[TrackMetadata, _PendingRamp]]]):
+        """Render every pending ramp mix in the blocks as one parallel batch."""
+        pending = [item for block in blocks for item in block if isinstance(item, _PendingRamp)]
+        if not pending:
+            return
+        jobs = [
+            MixJob(ramp.voice_track.file_path, ramp.song.file_path, intro_duration=ramp.ramp_seconds)
+            for ramp in pending
+        ]
+        try:
+            for index, mixed_path in get_voice_mixer().mix_batch(jobs):
+                pending[index].mixed_path = mixed_path
+        except Exception as e:
+            logger.error(f"Ramp mixing failed: {e}")
+
+    def _export_hour_block(
+        self,
+        hour: int,
+        block: List[Union[TrackMetadata, _PendingRamp]],
+        output_dir: str
+    ) -> str:
+        """Resolve ramp slots and write the hour's M3U."""
+        playlist_tracks: List[TrackMetadata] = []
+        for item in block:
+            if not isinstance(item, _PendingRamp):
+                playlist_tracks.append(item)
+            elif item.mixed_path:
+                # Create metadata for the mixed track
+                playlist_tracks.append(TrackMetadata(
+                    file_path=item.mixed_path,
+                    title=item.song.title,
+                    artist=item.song.artist,
+                    duration_seconds=item.song.duration_seconds,
+                    intro_seconds=0, # Ramp used
+                    is_generated=True,
+                    generation_prompt="Voice Over Ramp Mix"
+                ))
+            else:
+                self._append_stop_set(playlist_tracks, item.song, item.context)
+
         # 4. Export
         filename = f"hour_{hour:02d}.m3u"
         output_path = os.path.join(output_dir, filename)
@@ -248,14 +302,24 @@ class RadioScheduler:
 
         return output_path
 
-    def generate_daily_schedule(self, output_dir: str):
-        """Generate 24 playlists for the day."""
+    def generate_daily_schedule(self, output_dir: str, day: Optional[datetime] = None):
+        """
+        Generate 24 playlists for a day (default: the one starting at the next midnight).
+        Each hour's songs are picked for the time that hour airs.
+        """
         Path(output_dir).mkdir(parents=True, exist_ok=True)
-
-        generated_files = []
-        for hour in range(24):
-            path = self.generate_hour_block(hour, output_dir)
-            generated_files.append(path)
+        if day is None:
+            day = datetime.now() + timedelta(days=1)
+        start = day.replace(hour=0, minute=0, second=0, microsecond=0)
+
+        # Script and voice every hour first, so the whole day's ramp mixes
+        # render in parallel as one batch
+        blocks = [self._plan_hour_block(hour, start + timedelta(hours=hour)) for hour in range(24)]
+        self._render_ramps(blocks)
+        generated_files = [
+            self._export_hour_block(hour, block, output_dir)
+            for hour, block in enumerate(blocks)
+        ]
 
         logger.info(f"Daily schedule generated in {output_dir}")
         return generated_files
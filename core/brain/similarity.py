@@ -0,0 +1,243 @@
+"""
+Similarity Engine for Neon Frequency
+====================================
+Vectorized track similarity over a NumPy feature matrix.
+
+Each catalog track owns one row of encoded features (genre, BPM, energy,
+Camelot key, loudness). Scoring a seed against the whole library is a
+handful of array comparisons and one key-compatibility table lookup, and
+many seeds are scored in one call.
+"""
+
+import logging
+from typing import Optional, List, Dict, Any, Iterable
+
+import numpy as np
+
+from core.brain.harmony import COMPATIBILITY, camelot_code
+
+logger = logging.getLogger("AEN.Similarity")
+
+
+# Score contributions, matching the rules the library always used
+GENRE_WEIGHT = 3.0
+BPM_WEIGHT = 2.0
+BPM_TOLERANCE = 10.0
+ENERGY_WEIGHT = 2.0
+KEY_WEIGHT = 1.0  # Scaled by Camelot compatibility (full weight for the same key)
+LOUDNESS_WEIGHT = 0.5
+LOUDNESS_TOLERANCE = 2.0  # LU
+
+# Upper bound on seeds x tracks cells scored at once, to cap temporary memory
+MAX_BLOCK_CELLS = 4_000_000
+
+KEY_SCORES = (COMPATIBILITY * KEY_WEIGHT).astype(np.float32)
+
+
+class FeatureMatrix:
+    """
+    Row-per-track feature arrays with O(1) add and remove.
+
+    Removed rows go on a free list and are reused; storage doubles when
+    full. Missing values are NaN (floats) or -1 (codes).
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._capacity = 0
+        self.genre = np.empty(0, dtype=np.int16)
+        self.bpm = np.empty(0, dtype=np.float32)
+        self.energy = np.empty(0, dtype=np.int8)
+        self.key = np.empty(0, dtype=np.int8)  # Camelot code
+        self.loudness = np.empty(0, dtype=np.float32)
+        self.valid = np.empty(0, dtype=bool)
+        self._grow(capacity)
+
+        self._rows: Dict[str, int] = {}
+        self._keys: List[Optional[str]] = []
+        self._free: List[int] = []
+        self._codes: Dict[str, Dict[Any, int]] = {"genre": {}}
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+
+    def _grow(self, capacity: int):
+        old = self._capacity
+        if capacity <= old:
+            return
+
+        def resize(array: np.ndarray, fill: Any) -> np.ndarray:
+            grown = np.full(capacity, fill, dtype=array.dtype)
+            grown[:old] = array[:old]
+            return grown
+
+        self.genre = resize(self.genre, -1)
+        self.bpm = resize(self.bpm, np.nan)
+        self.energy = resize(self.energy, -1)
+        self.key = resize(self.key, -1)
+        self.loudness = resize(self.loudness, np.nan)
+        self.valid = resize(self.valid, False)
+        self._capacity = capacity
+
+    def _code(self, table: str, value: Any) -> int:
+        """Map a categorical value to a small integer code (-1 for missing)."""
+        if value is None:
+            return -1
+        codes = self._codes[table]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+        return code
+
+    def encode(self, track: Any) -> Dict[str, float]:
+        """Encode a track's features without storing them."""
+        return {
+            "genre": self._code("genre", track.genre),
+            "bpm": float(track.bpm) if track.bpm else np.nan,
+            "energy": track.energy.value if track.energy else -1,
+            "key": camelot_code(track.key),
+            "loudness": track.loudness_lufs if track.loudness_lufs is not None else np.nan,
+        }
+
+    def add(self, key: str, track: Any):
+        """Store (or refresh) the features of a track."""
+        row = self._rows.get(key)
+        if row is None:
+            if self._free:
+                row = self._free.pop()
+                self._keys[row] = key
+            else:
+                row = len(self._keys)
+                if row >= self._capacity:
+                    self._grow(max(1024, self._capacity * 2))
+                self._keys.append(key)
+            self._rows[key] = row
+
+        features = self.encode(track)
+        self.genre[row] = features["genre"]
+        self.bpm[row] = features["bpm"]
+        self.energy[row] = features["energy"]
+        self.key[row] = features["key"]
+        self.loudness[row] = features["loudness"]
+        self.valid[row] = True
+
+    def remove(self, key: str):
+        row = self._rows.pop(key, None)
+        if row is None:
+            return
+        self.valid[row] = False
+        self._keys[row] = None
+        self._free.append(row)
+
+    def row_of(self, key: str) -> Optional[int]:
+        return self._rows.get(key)
+
+    def key_of(self, row: int) -> Optional[str]:
+        return self._keys[row]
+
+    @property
+    def size(self) -> int:
+        """Number of allocated rows (including free ones)."""
+        return len(self._keys)
+
+
+class SimilarityEngine:
+    """Batched similarity search over a FeatureMatrix."""
+
+    def __init__(self):
+        self.features = FeatureMatrix()
+
+    def add(self, key: str, track: Any):
+        self.features.add(key, track)
+
+    def remove(self, key: str):
+        self.features.remove(key)
+
+    def _score_block(self, seeds: List[Dict[str, float]]) -> np.ndarray:
+        """Score a block of encoded seeds against every row: (seeds, rows)."""
+        f = self.features
+        n = f.size
+        genre, bpm, energy = f.genre[:n], f.bpm[:n], f.energy[:n]
+        key, loudness = f.key[:n], f.loudness[:n]
+
+        s_genre = np.array([s["genre"] for s in seeds], dtype=np.int16)[:, None]
+        s_bpm = np.array([s["bpm"] for s in seeds], dtype=np.float32)[:, None]
+        s_energy = np.array([s["energy"] for s in seeds], dtype=np.int8)[:, None]
+        s_key = np.array([s["key"] for s in seeds], dtype=np.int8)[:, None]
+        s_loud = np.array([s["loudness"] for s in seeds], dtype=np.float32)[:, None]
+
+        scores = np.zeros((len(seeds), n), dtype=np.float32)
+        mask = np.empty((len(seeds), n), dtype=bool)
+        term = np.empty((len(seeds), n), dtype=np.float32)
+
+        def add(weight: float):
+            np.multiply(mask, np.float32(weight), out=term)
+            np.add(scores, term, out=scores)
+
+        # NaN comparisons are False, so missing BPM/loudness never score
+        with np.errstate(invalid="ignore"):
+            np.equal(genre, s_genre, out=mask)
+            add(GENRE_WEIGHT)
+            np.less_equal(np.abs(bpm - s_bpm), BPM_TOLERANCE, out=mask)
+            add(BPM_WEIGHT)
+            np.equal(energy, s_energy, out=mask)
+            add(ENERGY_WEIGHT)
+            # Unknown keys (-1) index the all-zero padding of the table
+            np.add(scores, KEY_SCORES[s_key, key], out=scores)
+            np.less_equal(np.abs(loudness - s_loud), LOUDNESS_TOLERANCE, out=mask)
+            add(LOUDNESS_WEIGHT)
+        return scores
+
+    def query(
+        self,
+        seeds: List[Any],
+        limit: int = 10,
+        exclude: Iterable[str] = ()
+    ) -> List[List[str]]:
+        """
+        Find the most similar catalog keys for each seed track.
+
+        Args:
+            seeds: Tracks to find neighbours for (need not be in the catalog)
+            limit: Maximum neighbours per seed
+            exclude: Keys never returned (e.g. the seeds themselves)
+
+        Returns:
+            One list of keys per seed, best first; only positive scores
+        """
+        f = self.features
+        n = f.size
+        if not seeds or n == 0 or limit <= 0:
+            return [[] for _ in seeds]
+
+        encoded = [f.encode(seed) for seed in seeds]
+        blocked = ~f.valid[:n]
+        for key in exclude:
+            row = f.row_of(key)
+            if row is not None:
+                blocked[row] = True
+
+        block = max(1, MAX_BLOCK_CELLS // n)
+        k = min(limit, n)
+        results: List[List[str]] = []
+
+        for start in range(0, len(encoded), block):
+            scores = self._score_block(encoded[start:start + block])
+            scores[:, blocked] = -np.inf
+
+            if k < n:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            else:
+                top = np.tile(np.arange(n), (scores.shape[0], 1))
+            top_scores = np.take_along_axis(scores, top, axis=1)
+
+            for rows, row_scores in zip(top, top_scores):
+                # Best score first, catalog order among ties
+                order = np.lexsort((rows, -row_scores))
+                results.append([
+                    f.key_of(int(rows[i])) for i in order if row_scores[i] > 0
+                ])
+
+        return results
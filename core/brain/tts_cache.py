@@ -0,0 +1,227 @@
+"""
+TTS Cache for Neon Frequency
+============================
+Synthesized speech, addressed by what was asked for.
+
+An utterance is fully determined by its text, the voice, the model and
+the voice settings, so the cache key is a hash of exactly those. Every
+TTS client asks the cache first and only calls the API on a miss; the
+same line is never paid for twice, whichever part of the station wants
+it. Files are written atomically, the directory is capped in size and
+least recently used utterances are evicted first.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable
+
+logger = logging.getLogger("AEN.TTSCache")
+
+
+# Bump when stored audio must no longer be served for the same request
+TTS_CACHE_VERSION = 1
+DEFAULT_MAX_MB = 512
+EXTENSION = ".mp3"
+
+
+def tts_key(text: str, voice_id: str, model_id: str, settings: Optional[Dict[str, Any]] = None) -> str:
+    """Content key of an utterance."""
+    parts = {
+        "version": TTS_CACHE_VERSION,
+        "text": text,
+        "voice": voice_id,
+        "model": model_id,
+        "settings": settings or {},
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """
+    Size-capped directory of utterances named by their key.
+
+    The LRU index is read from the directory when the cache is created
+    (oldest modification time first) and kept in memory from then on;
+    files added by other processes count once this one sees them.
+    Concurrent requests for the same key wait for the first one instead of
+    synthesizing it again.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None):
+        if cache_dir is None:
+            cache_dir = os.getenv("TTS_CACHE_DIR", os.path.join(
+                os.getenv("AUDIO_CACHE_DIR", tempfile.gettempdir()), "tts_cache"
+            ))
+        if max_bytes is None:
+            max_bytes = int(os.getenv("TTS_CACHE_MB", DEFAULT_MAX_MB)) * 1024 * 1024
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # key -> size
+        self._bytes = 0
+        self._inflight: Dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        found = []
+        with os.scandir(self.cache_dir) as scan:
+            for entry in scan:
+                if entry.is_file() and entry.name.endswith(EXTENSION) and ".part" not in entry.name:
+                    stat = entry.stat()
+                    found.append((stat.st_mtime, entry.name[:-len(EXTENSION)], stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._bytes += size
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}{EXTENSION}")
+
+    def get(self, key: str) -> Optional[str]:
+        """Path of a stored utterance, or None."""
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            with self._lock:
+                self.misses += 1
+                if key in self._entries:  # Removed behind our back
+                    self._bytes -= self._entries.pop(key)
+            return None
+        try:
+            os.utime(path)  # Mark as recently used
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:
+                size = os.path.getsize(path)
+                self._entries[key] = size
+                self._bytes += size
+        return path
+
+    def read(self, key: str) -> Optional[bytes]:
+        """Stored audio of an utterance, or None."""
+        path = self.get(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, key: str, data: bytes) -> str:
+        """Store audio under ``key`` atomically and evict to fit."""
+        path = self.path_for(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        with self._lock:
+            self.writes += 1
+            self._bytes -= self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                victim, size = self._entries.popitem(last=False)
+                self._bytes -= size
+                self.evictions += 1
+                try:
+                    os.unlink(self.path_for(victim))
+                except OSError:
+                    pass
+        return path
+
+    def get_or_generate(
+        self,
+        key: str,
+        generate: Callable[[], Optional[bytes]],
+        output_path: Optional[str] = None
+    ) -> Optional[bytes]:
+        """
+        Audio for ``key``, calling ``generate`` only on a miss.
+
+        Empty or None results are not stored; exceptions from ``generate``
+        propagate. With ``output_path`` the audio is also made available
+        there (hard-linked from the cache where possible).
+        """
+        with self._lock:
+            key_lock = self._inflight.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                data = self.read(key)
+                if data is None:
+                    data = generate()
+                    if not data:
+                        return data
+                    self.put(key, data)
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is key_lock:
+                    del self._inflight[key]
+
+        if output_path:
+            self._deliver(key, data, output_path)
+        return data
+
+    def _deliver(self, key: str, data: bytes, output_path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        tmp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            os.link(self.path_for(key), tmp_path)
+        except OSError:
+            with open(tmp_path, "wb") as f:  # Other filesystem, or already evicted
+                f.write(data)
+        os.replace(tmp_path, output_path)
+
+    def clear(self):
+        """Delete every stored utterance."""
+        with self._lock:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Singleton instance
+_tts_cache: Optional[TTSCache] = None
+
+
+def get_tts_cache() -> TTSCache:
+    """Get the shared TTS cache."""
+    global _tts_cache
+    if _tts_cache is None:
+        _tts_cache = TTSCache()
+    return _tts_cache
@@ -2,6 +2,7 @@
 ElevenLabs Voice Client
 =======================
 Handles text-to-speech generation for station personalities.
+Generated speech goes through the shared TTS cache (see tts_cache.py).
 """
 
 import os
@@ -9,16 +10,22 @@ import logging
 import httpx
 from typing import Optional
 
+from core.brain.tts_cache import TTSCache, get_tts_cache, tts_key
+
 logger = logging.getLogger("AEN.Voice")
 
+MODEL_ID = "eleven_monolingual_v1"
+VOICE_SETTINGS = {"stability": 0.5, "similarity_boost": 0.5}
+
 class ElevenLabsClient:
     """
     Client for ElevenLabs API.
     Auto-detects API key or switches to Mock Mode.
     """
     
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, cache: TTSCache = None):
         self.api_key = api_key or os.getenv("ELEVENLABS_API_KEY")
+        self.cache = cache
         self.base_url = "https://api.elevenlabs.io/v1"
         self.default_voice = os.getenv("ELEVENLABS_VOICE_ID", "21m00Tcm4TlvDq8ikWAM") # Rachel
         
@@ -33,39 +40,41 @@ class ElevenLabsClient:
                 timeout=30.0
             )
 
+    def cache_key(self, text: str) -> str:
+        """TTS cache key of ``text`` in this client's voice."""
+        return tts_key(text, self.default_voice, MODEL_ID, VOICE_SETTINGS)
+
     def generate(self, text: str, output_path: str = None) -> Optional[bytes]:
         """
-        Generate audio from text.
+        Generate audio from text, served from the TTS cache when possible.
         """
-        logger.info(f"Generating voice for: '{text}'")
-        
         if self.mock_mode:
+            logger.info(f"Generating voice for: '{text}'")
             return self._mock_generate(text, output_path)
             
         try:
-            # Call actual API
-            response = self.client.post(
-                f"/text-to-speech/{self.default_voice}",
-                json={
-                    "text": text,
-                    "model_id": "eleven_monolingual_v1",
-                    "voice_settings": {"stability": 0.5, "similarity_boost": 0.5}
-                }
-            )
-            response.raise_for_status()
-            audio_data = response.content
-            
-            if output_path:
-                with open(output_path, "wb") as f:
-                    f.write(audio_data)
-                
-            return audio_data
+            cache = self.cache or get_tts_cache()
+            return cache.get_or_generate(self.cache_key(text), lambda: self._request(text), output_path)
             
         except Exception as e:
             logger.error(f"ElevenLabs API successful generation failed: {e}")
             logger.info("Falling back to mock generation due to error.")
             return self._mock_generate(text, output_path)
 
+    def _request(self, text: str) -> bytes:
+        """Call the API (only on a cache miss)."""
+        logger.info(f"Generating voice for: '{text}'")
+        response = self.client.post(
+            f"/text-to-speech/{self.default_voice}",
+            json={
+                "text": text,
+                "model_id": MODEL_ID,
+                "voice_settings": VOICE_SETTINGS
+            }
+        )
+        response.raise_for_status()
+        return response.content
+
     def _mock_generate(self, text: str, output_path: str = None) -> bytes:
         """Create a dummy MP3 file for testing."""
         logger.info("[MOCK] Generating silent MP3...")
@@ -12,12 +12,54 @@ import logging
 import asyncio
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import List, Optional, Dict, Any, Literal
+from typing import List, Optional, Dict, Any, Literal, Sequence, Iterator, Tuple
 from pathlib import Path
+from concurrent.futures.process import BrokenProcessPool
 import tempfile
 
+from core.brain.mix_engine import MixPlan, render_mix
+from core.brain.bed_cache import BedCache
+from core.brain.render_cache import RenderCache, stored_measurement
+from core.brain.mp3_splice import splice_intro, audio_seconds
+from core.brain.mix_pool import MixPool, MixQueueFull, MixJobCancelled
+from core.brain.loudness import TARGET_LUFS
+
 logger = logging.getLogger("AEN.VoiceMixer")
 
+# Extra bed attenuation while the voice is audible
+DUCK_DB = 6.0
+# Voice offset and boost (over the loudness target) when talking over a song intro
+RAMP_VOICE_OFFSET = 0.5
+RAMP_VOICE_GAIN_DB = 2.0
+
+
+def _render_job(
+    voice_path: str,
+    bed_path: Optional[str],
+    plan: MixPlan,
+    output_path: str,
+    bed_cache: Optional[BedCache],
+    splice: bool,
+    loudness_dir: str
+) -> str:
+    """
+    Render one mix to ``output_path`` (runs in a mix pool worker).
+
+    The voice's loudness is read from (or measured once into) ``loudness_dir``.
+    """
+    if splice and splice_intro(voice_path, bed_path, plan, output_path, loudness_dir=loudness_dir):
+        return "spliced"
+    bed, voice_loudness, bed_loudness = bed_path, None, None
+    if bed_path and bed_cache:
+        bed = bed_cache.get(bed_path)
+        if plan.bed_lufs is not None or plan.output_lufs is not None:
+            bed_loudness = bed_cache.loudness(bed_path, bed)
+    if plan.voice_lufs is not None or plan.output_lufs is not None:
+        voice_loudness = stored_measurement(voice_path, loudness_dir)
+    duration = render_mix(voice_path, bed, plan, output_path,
+                          voice_loudness=voice_loudness, bed_loudness=bed_loudness)
+    return f"{duration:.1f}s"
+
 
 @dataclass
 class BedConfig:
@@ -34,13 +76,28 @@ class MixSettings:
     """Settings for voice + bed mixing."""
     intro_duration: float = 2.0  # Seconds of intro before voice starts
     outro_duration: float = 2.0  # Seconds of outro after voice ends
-    bed_volume: float = -12.0  # dB level for background bed
-    voice_volume: float = 0.0  # dB level for voice
+    bed_volume: float = -12.0  # Bed loudness relative to the voice (LU)
+    voice_volume: float = 0.0  # dB trim on the normalized voice
     crossfade_duration: float = 0.5  # Seconds for fade transitions
     ducking_attack: float = 0.1  # Seconds to duck bed when voice starts
     ducking_release: float = 0.3  # Seconds to restore bed after voice ends
 
 
+@dataclass
+class MixJob:
+    """One mix for ``VoiceMixer.mix_batch``."""
+    voice_path: str
+    bed_path: Optional[str] = None  # Bed, or the song for an intro mix
+    bed_style: str = "default"  # Used when bed_path is not set
+    settings: Optional[MixSettings] = None
+    intro_duration: Optional[float] = None  # Seconds to the post; set to talk over a song's intro instead
+    output_path: Optional[str] = None
+
+    @property
+    def over_intro(self) -> bool:
+        return self.intro_duration is not None
+
+
 class VoiceMixer:
     """
     Mixes TTS voiceovers with music beds.
@@ -52,7 +109,15 @@ class VoiceMixer:
     - Multiple bed styles (energetic, chill, news, promo)
     """
     
-    def __init__(self, beds_directory: str = None):
+    def __init__(
+        self,
+        beds_directory: str = None,
+        bed_cache: BedCache = None,
+        render_cache: RenderCache = None,
+        pool: MixPool = None,
+        target_lufs: Optional[float] = None,
+        splice_mp3: Optional[bool] = None
+    ):
         self.beds_directory = beds_directory or os.getenv(
             "MUSIC_BEDS_DIR",
             os.path.join(os.path.dirname(__file__), "..", "..", "broadcast", "beds")
@@ -65,6 +130,23 @@ class VoiceMixer:
         # Ensure output directory exists
         Path(self.output_directory).mkdir(parents=True, exist_ok=True)
         
+        # Decoded beds, reused across mixes
+        self.bed_cache = bed_cache or BedCache(cache_dir=os.getenv("BED_CACHE_DIR"))
+        # Finished mixes, keyed by input contents and mix plan
+        self.render_cache = render_cache or RenderCache(os.getenv(
+            "RENDER_CACHE_DIR", os.path.join(self.output_directory, "render_cache")
+        ))
+        # Decoding and encoding run here, off the caller's event loop
+        self.pool = pool or MixPool()
+        # Voices and mixes are normalized to this loudness as they render
+        self.target_lufs = target_lufs if target_lufs is not None else float(
+            os.getenv("MIX_TARGET_LUFS", TARGET_LUFS)
+        )
+        # Re-encode only the intro of MP3 songs under a voice (see mp3_splice)
+        self.splice_mp3 = splice_mp3 if splice_mp3 is not None else (
+            os.getenv("MIX_SPLICE_MP3", "").lower() in ("1", "true", "yes")
+        )
+        
         # Available bed styles
         self._beds: Dict[str, BedConfig] = {}
         self._load_beds()
@@ -130,94 +212,157 @@ class VoiceMixer:
             if bed_config:
                 bed_path = bed_config.file_path
         
-        # Generate output path
-        if output_path is None:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_path = os.path.join(
-                self.output_directory,
-                f"mixed_{timestamp}.mp3"
-            )
-        
-        # Check if pydub is available for mixing
         try:
-            from pydub import AudioSegment
-            return await self._mix_with_pydub(
+            return await self._mix_streaming(
                 voice_path, bed_path, settings, output_path
             )
-        except ImportError:
-            logger.warning("pydub not installed, using fallback (voice only)")
+        except (MixQueueFull, MixJobCancelled, BrokenProcessPool):
+            raise  # The pool is busy or going away; the mix itself did not fail
+        except (OSError, RuntimeError) as e:
+            logger.warning(f"Mixing unavailable ({e}), using fallback (voice only)")
+            if output_path is None:
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                output_path = os.path.join(self.output_directory, f"mixed_{timestamp}.mp3")
             return await self._fallback_copy(voice_path, output_path)
     
-    async def _mix_with_pydub(
+    async def _mix_streaming(
         self,
         voice_path: str,
         bed_path: str,
         settings: MixSettings,
-        output_path: str
+        output_path: Optional[str]
     ) -> str:
-        """Mix audio using pydub library."""
-        from pydub import AudioSegment
-        
-        # Load audio files
-        voice = AudioSegment.from_file(voice_path)
-        
-        if bed_path and os.path.exists(bed_path):
-            bed = AudioSegment.from_file(bed_path)
-        else:
+        """Mix audio block by block with the streaming mix engine."""
+        if not (bed_path and os.path.exists(bed_path)):
             # No bed available, just process voice
             logger.info("No bed file available, outputting voice only")
-            voice.export(output_path, format="mp3")
-            return output_path
+            return await self._render_async(voice_path, None, self._voice_plan(), output_path)
         
-        # Calculate durations
-        intro_ms = int(settings.intro_duration * 1000)
-        outro_ms = int(settings.outro_duration * 1000)
-        crossfade_ms = int(settings.crossfade_duration * 1000)
-        
-        # Adjust volumes
-        voice = voice + settings.voice_volume
-        bed = bed + settings.bed_volume
-        
-        # Calculate total duration needed
-        total_duration = intro_ms + len(voice) + outro_ms
-        
-        # Loop bed if necessary
-        if len(bed) < total_duration:
-            loops_needed = (total_duration // len(bed)) + 1
-            bed = bed * loops_needed
-        
-        # Trim bed to exact duration
-        bed = bed[:total_duration]
-        
-        # Apply ducking to bed during voice
-        # Create ducked version of bed
-        duck_amount = settings.bed_volume - 6  # Additional 6dB duck during voice
-        ducked_bed = bed + duck_amount
-        
-        # Create the mix
-        # Part 1: Intro (full bed)
-        intro = bed[:intro_ms]
-        
-        # Part 2: Voice section (ducked bed + voice)
-        voice_section_bed = ducked_bed[intro_ms:intro_ms + len(voice)]
-        voice_section = voice_section_bed.overlay(voice)
-        
-        # Part 3: Outro (full bed with fade)
-        outro_start = intro_ms + len(voice)
-        outro = bed[outro_start:outro_start + outro_ms]
-        outro = outro.fade_out(outro_ms)
-        
-        # Combine all parts
-        mixed = intro + voice_section + outro
-        
-        # Apply fade in at start
-        mixed = mixed.fade_in(crossfade_ms)
-        
-        # Export
-        mixed.export(output_path, format="mp3")
-        logger.info(f"Mixed audio exported to: {output_path}")
+        plan = self._bed_plan(settings)
+        return await self._render_async(voice_path, bed_path, plan, output_path, cache_bed=True)
+    
+    def _voice_plan(self) -> MixPlan:
+        return MixPlan(voice_lufs=self.target_lufs)
+    
+    def _bed_plan(self, settings: MixSettings) -> MixPlan:
+        # Intro (full bed) -> voice over a looping bed, ducked by the voice level
+        # with the settings' attack/release -> outro fading out. The voice is
+        # normalized to the target and the bed to bed_volume below it, then
+        # the finished mix is brought to the target as a whole.
+        return MixPlan(
+            voice_offset=settings.intro_duration,
+            voice_gain_db=settings.voice_volume,
+            voice_lufs=self.target_lufs,
+            bed_lufs=self.target_lufs + settings.bed_volume,
+            output_lufs=self.target_lufs,
+            duck_db=DUCK_DB,
+            duck_attack=settings.ducking_attack,
+            duck_release=settings.ducking_release,
+            tail=settings.outro_duration,
+            fade_in=settings.crossfade_duration,
+            fade_out=settings.outro_duration,
+            loop_bed=True
+        )
+    
+    def _intro_plan(self, voice_path: str, intro_duration: float) -> MixPlan:
+        # Voice comes in just after the song starts, or earlier if that is
+        # what it takes to finish on the post; normalized and boosted slightly
+        # to cut through, while the song plays out untouched
+        voice_seconds = audio_seconds(voice_path)
+        offset = RAMP_VOICE_OFFSET
+        if voice_seconds is not None:
+            offset = min(offset, max(0.0, intro_duration - voice_seconds))
+        return MixPlan(
+            voice_offset=offset,
+            voice_gain_db=RAMP_VOICE_GAIN_DB,
+            voice_lufs=self.target_lufs,
+            tail=None
+        )
+    
+    def _lookup(
+        self,
+        voice_path: str,
+        bed_path: Optional[str],
+        plan: MixPlan,
+        output_path: Optional[str],
+        splice: bool,
+        prefix: str = "mixed"
+    ) -> Tuple[Optional[str], str, str]:
+        """
+        (stored render or None, cache path to render into, output path).
         
-        return output_path
+        Cache entries can be evicted at any time, so callers only ever get
+        a path of their own: ``output_path``, or a file named after the
+        render under the output directory.
+        """
+        extension = os.path.splitext(output_path)[1] if output_path else ".mp3"
+        key = self.render_cache.key(voice_path, bed_path, plan, extension, splice=splice)
+        if output_path is None:
+            output_path = os.path.join(self.output_directory, f"{prefix}_{key[:16]}{extension}")
+        return self.render_cache.get(key, extension), self.render_cache.path_for(key, extension), output_path
+    
+    def _store(self, target: str, result: str):
+        logger.info(f"Mixed audio rendered: {target} ({result})")
+        self.render_cache.add(target)
+    
+    def _render(
+        self,
+        voice_path: str,
+        bed_path: Optional[str],
+        plan: MixPlan,
+        output_path: Optional[str],
+        cache_bed: bool = False,
+        splice: bool = False,
+        prefix: str = "mixed"
+    ) -> str:
+        """
+        Render a mix through the render cache, blocking until it is done.
+        
+        A render with the same input contents and plan is linked from the
+        cache without decoding or encoding. Otherwise the mix is rendered
+        in the mix pool into the cache and then linked to ``output_path``
+        (``<prefix>_<key>`` in the output directory if not given).
+        With ``splice`` an MP3 bed is only re-encoded where the voice is
+        (see mp3_splice).
+        """
+        cached, target, output_path = self._lookup(voice_path, bed_path, plan, output_path, splice, prefix)
+        if cached is not None:
+            delivered = self.render_cache.deliver_cached(cached, output_path)
+            if delivered is not None:
+                return delivered
+        result = self.pool.run_sync(
+            _render_job, voice_path, bed_path, plan, target,
+            self.bed_cache if cache_bed else None, splice, self.render_cache.loudness_dir,
+            label=os.path.basename(target)
+        )
+        self._store(target, result)
+        return self.render_cache.deliver(target, output_path)
+    
+    async def _render_async(
+        self,
+        voice_path: str,
+        bed_path: Optional[str],
+        plan: MixPlan,
+        output_path: Optional[str],
+        cache_bed: bool = False,
+        splice: bool = False,
+        prefix: str = "mixed"
+    ) -> str:
+        """``_render`` for async callers; the event loop is never blocked."""
+        cached, target, output_path = await asyncio.to_thread(
+            self._lookup, voice_path, bed_path, plan, output_path, splice, prefix
+        )
+        if cached is not None:
+            delivered = await asyncio.to_thread(self.render_cache.deliver_cached, cached, output_path)
+            if delivered is not None:
+                return delivered
+        result = await self.pool.run(
+            _render_job, voice_path, bed_path, plan, target,
+            self.bed_cache if cache_bed else None, splice, self.render_cache.loudness_dir,
+            label=os.path.basename(target)
+        )
+        await asyncio.to_thread(self._store, target, result)
+        return await asyncio.to_thread(self.render_cache.deliver, target, output_path)
     
     async def _fallback_copy(self, voice_path: str, output_path: str) -> str:
         """Fallback: just copy voice file if mixing not available."""
@@ -252,7 +397,8 @@ class VoiceMixer:
             voice_path = f.name
         
         # Generate TTS
-        voice_path = voice_generator.generate_audio(
+        voice_path = await asyncio.to_thread(
+            voice_generator.generate_audio,
             text=text,
             output_path=voice_path
         )
@@ -326,65 +472,97 @@ class VoiceMixer:
         Returns:
             Path to mixed file, or None if failed
         """
-        if output_path is None:
-            import hashlib
-            # Create deterministic filename based on inputs so we cache mixes
-            h = hashlib.md5(f"{voice_path}{song_path}{intro_duration}".encode()).hexdigest()
-            output_path = os.path.join(self.output_directory, f"ramp_mix_{h}.mp3")
-
-        # Check cache
-        if os.path.exists(output_path):
-            return output_path
-
         try:
-            from pydub import AudioSegment
-
             # Load files
             if not os.path.exists(voice_path) or not os.path.exists(song_path):
                 logger.error(f"Missing input files for mixing: {voice_path}, {song_path}")
                 return None
 
-            voice = AudioSegment.from_file(voice_path)
-            song = AudioSegment.from_file(song_path)
-
-            # Logic:
-            # Voice starts at 0. Song starts at 0.
-            # Voice should end before intro_duration.
-            # Ideally, we align the END of the voice with the END of the intro (hitting the post).
-            # But standard practice is usually start immediately and hope it fits (since we constrained generation).
-            # Let's align START for now, as that's safer than voice starting late and clashing if we calculated wrong.
-            # But let's add a small padding (0.5s) so it doesn't start INSTANTLY with the first drum kick.
-
-            start_offset_ms = 500 # 0.5s
-
-            # Adjust levels
+            # Voice should end before intro_duration (the post). It starts after a
+            # small padding (0.5s) so it doesn't come in with the first drum kick,
+            # unless it is too long for that and has to start earlier.
             # Song dips slightly? Usually not for intro ramps, just voice sits on top.
-            # Maybe duck song -2dB during voice.
-
-            voice_len = len(voice)
-
-            # Create a ducked version of song during the voice segment
-            # We need to overlay voice onto song at start_offset_ms
-
-            # Simple overlay
-            # song.overlay(voice, position=start_offset_ms)
-            # However, pydub overlay handles volume.
-            # Let's boost voice slightly to cut through
-            voice = voice + 2
-
-            mixed = song.overlay(voice, position=start_offset_ms)
-
-            mixed.export(output_path, format="mp3")
-            logger.info(f"Ramp mix created: {output_path}")
+            plan = self._intro_plan(voice_path, intro_duration)
+            # Cached by input contents, so a repeated ramp is not re-rendered; with
+            # splice_mp3 an MP3 song is only re-encoded up to just past the voice
+            output_path = self._render(voice_path, song_path, plan, output_path,
+                                       splice=self.splice_mp3, prefix="ramp_mix")
+            logger.info(f"Ramp mix ready: {output_path}")
             return output_path
 
-        except ImportError:
-            logger.error("pydub not installed, cannot mix ramp.")
-            return None
         except Exception as e:
             logger.error(f"Failed to mix ramp: {e}")
             return None
 
+    def mix_batch(self, jobs: Sequence[MixJob]) -> Iterator[Tuple[int, Optional[str]]]:
+        """
+        Render many mixes in parallel.
+        
+        Identical jobs (same input contents and mix) are rendered once,
+        stored renders are returned straight away, and the rest run across
+        the mix pool.
+        
+        Args:
+            jobs: Bed mixes and intro mixes, in any combination
+        
+        Yields:
+            (index into jobs, output path or None if the mix failed), in
+            order of completion
+        """
+        renders: Dict[str, List[int]] = {}  # Cache path -> jobs it serves
+        outputs: Dict[int, str] = {}
+        job_args: List[Tuple] = []
+        for index, job in enumerate(jobs):
+            try:
+                bed_path, plan, cache_bed, splice = self._job_plan(job)
+                cached, target, outputs[index] = self._lookup(
+                    job.voice_path, bed_path, plan, job.output_path, splice,
+                    "ramp_mix" if job.over_intro else "mixed"
+                )
+            except (OSError, ValueError) as e:
+                logger.error(f"Cannot mix {job.voice_path}: {e}")
+                yield index, None
+                continue
+            if cached is not None:
+                delivered = self.render_cache.deliver_cached(cached, outputs[index])
+                if delivered is not None:
+                    yield index, delivered
+                    continue
+            if target in renders:
+                renders[target].append(index)
+            else:
+                renders[target] = [index]
+                job_args.append((job.voice_path, bed_path, plan, target, self.bed_cache if cache_bed else None,
+                                 splice, self.render_cache.loudness_dir))
+        
+        targets = list(renders)
+        logger.info(f"Mix batch: {len(jobs)} jobs, {len(targets)} to render")
+        labels = [os.path.basename(target) for target in targets]
+        for position, result, error in self.pool.run_many(_render_job, job_args, labels):
+            target = targets[position]
+            if error is not None:
+                logger.error(f"Batch mix failed for {jobs[renders[target][0]].voice_path}: {error}")
+                for index in renders[target]:
+                    yield index, None
+                continue
+            self._store(target, result)
+            for index in renders[target]:
+                yield index, self.render_cache.deliver(target, outputs[index])
+    
+    def _job_plan(self, job: MixJob) -> Tuple[Optional[str], MixPlan, bool, bool]:
+        """(bed path, plan, cache the bed, splice) for a batch job."""
+        if job.over_intro:
+            if not (os.path.exists(job.voice_path) and job.bed_path and os.path.exists(job.bed_path)):
+                raise FileNotFoundError(f"Missing input files for mixing: {job.voice_path}, {job.bed_path}")
+            return job.bed_path, self._intro_plan(job.voice_path, job.intro_duration), False, self.splice_mp3
+        bed_path = job.bed_path
+        if bed_path is None:
+            bed_config = self.get_bed_by_style(job.bed_style)
+            bed_path = bed_config.file_path if bed_config else None
+        if not (bed_path and os.path.exists(bed_path)):
+            return None, self._voice_plan(), False, False
+        return bed_path, self._bed_plan(job.settings or MixSettings()), True, False
+
 
 # Singleton instance
 _voice_mixer: Optional[VoiceMixer] = None
@@ -0,0 +1,64 @@
+import unittest
+
+import numpy as np
+
+from core.brain.loudness import BlockIIR, LoudnessMeter, integrated_loudness, k_weighting, gain_to_target
+
+
+def sine(seconds: float, level_db: float, rate: int = 48000, frequency: float = 1000.0) -> np.ndarray:
+    """Stereo sine with the same peak level on both channels."""
+    t = np.arange(int(seconds * rate)) / rate
+    wave = 10 ** (level_db / 20) * np.sin(2 * np.pi * frequency * t)
+    return np.stack([wave, wave], axis=1)
+
+
+class TestLoudness(unittest.TestCase):
+    def test_k_weighting_matches_bs1770_at_48k(self):
+        b, a = k_weighting(48000)
+        # Published coefficients of the two stages
+        shelf_b = [1.53512485958697, -2.69169618940638, 1.19839281085285]
+        shelf_a = [1.0, -1.69065929318241, 0.73248077421585]
+        highpass_a = [1.0, -1.99004745483398, 0.99007225036621]
+        np.testing.assert_allclose(b, np.convolve(shelf_b, [1.0, -2.0, 1.0]), atol=1e-7)
+        np.testing.assert_allclose(a, np.convolve(shelf_a, highpass_a), atol=1e-7)
+
+    def test_block_filter_matches_direct_recursion_across_chunks(self):
+        b, a = k_weighting(44100)
+        x = np.random.default_rng(1).standard_normal((3000, 2))
+        expected = np.zeros_like(x)
+        for n in range(len(x)):
+            expected[n] = sum(b[i] * x[n - i] for i in range(len(b)) if n >= i)
+            expected[n] -= sum(a[j] * expected[n - j] for j in range(1, len(a)) if n >= j)
+
+        block_filter = BlockIIR(b, a, channels=2, block=128)
+        chunks = [x[:1], x[1:500], x[500:501], x[501:]]
+        filtered = np.concatenate([block_filter.process(chunk) for chunk in chunks])
+        np.testing.assert_allclose(filtered, expected, atol=1e-6)
+
+    def test_reference_tone_levels(self):
+        # EBU Tech 3341 case 1: a -23 dBFS stereo 1 kHz tone reads -23 LUFS
+        for rate in (22050, 44100, 48000):
+            self.assertAlmostEqual(integrated_loudness(sine(5, -23, rate), rate), -23.0, delta=0.1)
+        self.assertAlmostEqual(integrated_loudness(sine(5, -33), 48000), -33.0, delta=0.1)
+        # One channel of the pair is 3 dB quieter
+        self.assertAlmostEqual(integrated_loudness(sine(5, -23)[:, 0], 48000), -26.01, delta=0.1)
+
+    def test_relative_gate_ignores_quiet_passages(self):
+        # EBU Tech 3341 case 3, shortened: quiet edges 13 LU down are gated out
+        signal = np.concatenate([sine(5, -36), sine(20, -23), sine(5, -36)])
+        meter = LoudnessMeter(48000)
+        for start in range(0, len(signal), 7000):
+            meter.feed(signal[start:start + 7000])
+        self.assertAlmostEqual(meter.integrated(), -23.0, delta=0.1)
+
+        self.assertIsNone(integrated_loudness(np.zeros((48000, 2)), 48000))
+        self.assertIsNone(integrated_loudness(sine(0.3, -23), 48000))  # Shorter than one block
+
+    def test_gain_to_target(self):
+        self.assertEqual(gain_to_target(-20.0, -14.0), 6.0)
+        self.assertEqual(gain_to_target(-60.0, -14.0), 20.0)  # Capped
+        self.assertEqual(gain_to_target(None, -14.0), 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,222 @@
+import unittest
+import os
+import shutil
+import tempfile
+import subprocess
+import wave
+from unittest.mock import patch
+
+import numpy as np
+
+from core.brain.mix_engine import MixPlan, PCMReader, render_mix, ffmpeg_available
+from core.brain.mp3_splice import (
+    scan_mp3, find_splice_frame, reservoir_needed, splice_intro, audio_seconds, crc16, crc16_shift
+)
+
+RATE = 44100
+FRAME_SIZE = 417  # MPEG-1 Layer III, 128 kbps, 44.1 kHz, unpadded
+
+
+def mp3_frame(main_data_begin: int = 0, fill: int = 0) -> bytes:
+    header = bytes([0xFF, 0xFB, 0x90, 0x00])
+    side_info = (main_data_begin << 7).to_bytes(2, "big") + bytes(30)
+    return header + side_info + bytes([fill]) * (FRAME_SIZE - 36)
+
+
+def info_frame(encoder_delay: int, music: bytes) -> bytes:
+    """Info frame with a LAME tag describing ``music`` (constant-size frames)."""
+    frame = bytearray(mp3_frame())
+    count, total = len(music) // FRAME_SIZE, FRAME_SIZE + len(music)
+    toc = bytes((FRAME_SIZE * (1 + i * count // 100)) * 256 // total for i in range(100))
+    tag = b"Info" + (0x0F).to_bytes(4, "big") + count.to_bytes(4, "big") + total.to_bytes(4, "big")
+    tag += toc + bytes(4) + b"LAME3.100" + bytes(12)
+    tag += bytes([encoder_delay >> 4, (encoder_delay & 0x0F) << 4, 0]) + bytes(4)
+    tag += total.to_bytes(4, "big") + crc16(music).to_bytes(2, "big")
+    frame[36:36 + len(tag)] = tag
+    return bytes(frame)
+
+
+def song_data(count: int) -> bytes:
+    """ID3v2 + Info frame + ``count`` frames + ID3v1; frames 10 and 30 do not use the bit reservoir."""
+    frames = b"".join(mp3_frame(0 if i in (10, 30) else 100, fill=i % 255 + 1) for i in range(count))
+    return id3v2(20) + info_frame(576, frames) + frames + b"TAG" + bytes(125)
+
+
+def id3v2(size: int) -> bytes:
+    return b"ID3\x04\x00\x00" + bytes([0, 0, 0, size]) + bytes(size)
+
+
+class TestMp3Splice(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.data = song_data(50)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_scan_frames_and_lame_tag(self):
+        stream = scan_mp3(self.data)
+        self.assertEqual((stream.sample_rate, stream.channels, stream.samples_per_frame), (RATE, 2, 1152))
+        self.assertEqual(stream.start, 30)
+        self.assertEqual(stream.encoder_delay, 576)
+        self.assertEqual(len(stream.frames), 50)  # ID3v1 tag is not a frame
+        self.assertEqual(stream.frames[0].offset, 30 + FRAME_SIZE)
+        self.assertEqual([f.main_data_begin for f in stream.frames[9:12]], [100, 0, 100])
+        self.assertEqual(len(scan_mp3(self.data, max_seconds=0.5).frames), 20)
+        self.assertIsNone(scan_mp3(b"RIFF" + bytes(100)))
+
+        path = os.path.join(self.test_dir, "song.mp3")
+        with open(path, "wb") as f:
+            f.write(self.data)
+        self.assertAlmostEqual(audio_seconds(path), 50 * 1152 / RATE)
+
+    def test_splice_frame_and_reservoir(self):
+        stream = scan_mp3(self.data)
+        # 0.2 s plus the 1105-sample delay lands in frame 8; the next frame starts after it
+        self.assertEqual(find_splice_frame(stream, 0.2), 9)
+        self.assertIsNone(find_splice_frame(stream, 2.0))
+        self.assertEqual(reservoir_needed(stream, 9), 100)
+        self.assertEqual(reservoir_needed(stream, 10), 0)
+
+    def write_inputs(self, data: bytes):
+        song = os.path.join(self.test_dir, "song.mp3")
+        with open(song, "wb") as f:
+            f.write(data)
+        voice = os.path.join(self.test_dir, "voice.wav")
+        with wave.open(voice, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(RATE)
+            f.writeframes(bytes(2 * RATE // 10))  # 0.1 s
+        return voice, song
+
+    def test_splice_bridges_the_reservoir_and_rewrites_the_tag(self):
+        data = song_data(400)
+        voice, song = self.write_inputs(data)
+        output = os.path.join(self.test_dir, "out.mp3")
+        encoded_intro = b"".join(mp3_frame(7, fill=0xEE) for _ in range(40))
+
+        def fake_render(voice_path, bed, plan, path, **options):
+            with open(path, "wb") as f:
+                f.write(encoded_intro)
+
+        with patch("core.brain.mp3_splice.ffmpeg_available", return_value=True), \
+                patch("core.brain.mp3_splice.render_mix", side_effect=fake_render) as render, \
+                patch("core.brain.mp3_splice.scan_mp3", wraps=scan_mp3) as scan:
+            self.assertTrue(splice_intro(voice, song, MixPlan(tail=None), output))
+        # Only the head of the song is read and scanned
+        self.assertLess(max(len(call.args[0]) for call in scan.call_args_list), len(data) // 2)
+
+        # Voice ends at 0.6 s -> the song is kept from frame 24
+        options = render.call_args.kwargs["writer_options"]
+        self.assertEqual(options, {"bitrate": "128k", "shift": 0, "info_tag": False})
+        self.assertAlmostEqual(render.call_args.args[2].length, (26 * 1152 - 1105) / RATE)
+        with open(output, "rb") as f:
+            spliced = f.read()
+        tag_end = 30 + FRAME_SIZE
+        tail_start = tag_end + FRAME_SIZE * 24
+        self.assertEqual(spliced[:30], data[:30])
+        self.assertEqual(spliced[tag_end:tail_start - FRAME_SIZE], encoded_intro[:23 * FRAME_SIZE])
+        self.assertEqual(spliced[tail_start:], data[tail_start:])
+
+        # The bridge keeps the intro's side info and ends with the 100 bytes frame 24 borrows
+        bridge = spliced[tail_start - FRAME_SIZE:tail_start]
+        self.assertEqual(bridge[:36], encoded_intro[:36])
+        self.assertEqual(bridge[-101:], bytes([0]) + bytes([24]) * 100)
+        stream = scan_mp3(spliced)
+        self.assertEqual(len(stream.frames), 400)
+
+        # Info tag: frames, bytes, TOC and the LAME music length/CRCs describe the new file
+        xing = stream.xing_offset
+        self.assertEqual(int.from_bytes(spliced[xing + 8:xing + 12], "big"), 400)
+        self.assertEqual(int.from_bytes(spliced[xing + 12:xing + 16], "big"), 401 * FRAME_SIZE)
+        self.assertEqual(spliced[xing + 16:xing + 116], data[xing + 16:xing + 116])  # Same frame sizes
+        lame = xing + 120
+        self.assertEqual(int.from_bytes(spliced[lame + 28:lame + 32], "big"), 401 * FRAME_SIZE)
+        self.assertEqual(int.from_bytes(spliced[lame + 32:lame + 34], "big"), crc16(spliced[tag_end:stream.end]))
+        self.assertEqual(int.from_bytes(spliced[lame + 34:lame + 36], "big"), crc16(spliced[30:lame + 34]))
+        self.assertEqual(sorted(os.listdir(self.test_dir)), ["out.mp3", "song.mp3", "voice.wav"])
+
+    def test_crc_of_joined_data_from_its_parts(self):
+        head, tail = bytes(range(256)) * 3, b"neon frequency" * 1000
+        self.assertEqual(crc16_shift(crc16(head), len(tail)) ^ crc16(tail), crc16(head + tail))
+        self.assertEqual(crc16_shift(crc16(head), 0), crc16(head))
+
+    def test_songs_without_encoder_delay_are_not_spliced(self):
+        untagged = self.data[:30] + self.data[30 + FRAME_SIZE:]
+        voice, song = self.write_inputs(untagged)
+        output = os.path.join(self.test_dir, "out.mp3")
+        with patch("core.brain.mp3_splice.ffmpeg_available", return_value=True), \
+                patch("core.brain.mp3_splice.render_mix") as render:
+            self.assertFalse(splice_intro(voice, song, MixPlan(tail=None), output))
+        render.assert_not_called()
+        self.assertFalse(os.path.exists(output))
+
+    @unittest.skipUnless(ffmpeg_available(), "ffmpeg not installed")
+    def test_spliced_file_decodes_like_a_full_render(self):
+        t = np.arange(6 * RATE) / RATE
+        rng = np.random.default_rng(0)
+        music = 0.3 * np.sin(2 * np.pi * 220 * t) * (1 + 0.5 * np.sin(np.pi * t)) + 0.05 * rng.standard_normal(len(t))
+        song_wav = os.path.join(self.test_dir, "song.wav")
+        voice = os.path.join(self.test_dir, "voice.wav")
+        for path, samples in ((song_wav, music), (voice, 0.3 * np.sin(2 * np.pi * 880 * t[:RATE]))):
+            with wave.open(path, "wb") as f:
+                f.setnchannels(1)
+                f.setsampwidth(2)
+                f.setframerate(RATE)
+                f.writeframes((samples * 32767).astype("<i2").tobytes())
+        song = os.path.join(self.test_dir, "song.mp3")
+        subprocess.run(["ffmpeg", "-v", "error", "-y", "-i", song_wav, "-ac", "2", "-c:a", "libmp3lame",
+                        "-b:a", "128k", song], check=True)
+
+        plan = MixPlan(voice_offset=0.5, tail=None)
+        spliced = os.path.join(self.test_dir, "spliced.mp3")
+        full = os.path.join(self.test_dir, "full.wav")
+        self.assertTrue(splice_intro(voice, song, plan, spliced))
+        render_mix(voice, song, plan, full)
+
+        def decode(path):
+            with PCMReader(path) as reader:
+                return reader.read(10 * RATE)
+
+        spliced_pcm, full_pcm, song_pcm = decode(spliced), decode(full), decode(song)
+        self.assertEqual(len(spliced_pcm), len(song_pcm))
+        with open(song, "rb") as f:
+            stream = scan_mp3(f.read())
+        seam = find_splice_frame(stream, 0.5 + 1.0 + 0.5) * 1152 - 1105
+        # Around the seam the splice matches the full render to within coding noise...
+        window = slice(seam - RATE // 4, seam + RATE // 4)
+        self.assertLess(np.abs(spliced_pcm[window] - full_pcm[window]).max(), 0.1)
+        # ...and once the last re-encoded frame has faded out it is the song itself
+        np.testing.assert_array_equal(spliced_pcm[seam + 1152:], song_pcm[seam + 1152:])
+
+    def test_non_mp3_songs_are_not_spliced(self):
+        song = os.path.join(self.test_dir, "song.wav")
+        with wave.open(song, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(RATE)
+            f.writeframes(bytes(2 * RATE))
+        output = os.path.join(self.test_dir, "out.mp3")
+        self.assertFalse(splice_intro(song, song, MixPlan(), output))
+        self.assertFalse(os.path.exists(output))
+
+    def test_intro_window_is_length_limited_and_shifted(self):
+        song = os.path.join(self.test_dir, "song.wav")
+        with wave.open(song, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(RATE)
+            f.writeframes((np.arange(2 * RATE) % 1000).astype("<i2").tobytes())
+        output = os.path.join(self.test_dir, "intro.wav")
+        plan = MixPlan(tail=None, length=0.5)
+
+        render_mix(song, song, plan, output, channels=1, writer_options={"shift": -100})
+        with wave.open(output, "rb") as f:
+            samples = np.frombuffer(f.readframes(f.getnframes()), dtype="<i2")
+        self.assertEqual(len(samples), RATE // 2 - 100)
+        self.assertAlmostEqual(samples[0], 2 * 100, delta=1)  # Voice and song are the same file here
+
+
+if __name__ == "__main__":
+    unittest.main()
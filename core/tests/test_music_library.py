@@ -0,0 +1,626 @@
+import unittest
+import os
+import shutil
+import tempfile
+import json
+import sqlite3
+import time
+import wave
+from datetime import datetime
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+
+from core.brain.music_library import (
+    MusicLibrary, TrackMetadata, Genre, Energy, create_track_from_file, hash_file
+)
+from core.brain.library_scanner import LibraryScanner
+from core.brain.audio_analysis import analyze_file
+from core.brain.compact_catalog import CompactCatalog
+from core.brain.playlist_solver import solve_duration
+from core.brain.radio_automation import PlaylistOptimizer, Track
+from core.brain.rotation import RotationEngine, RotationRules
+from core.brain.library_watcher import LibraryWatcher, PollingBackend, InotifyBackend, _load_libc
+
+
+def write_file(path: Path, content: bytes = b"audio"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(content)
+
+
+class TestLibraryCatalog(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.music_dir = Path(self.test_dir) / "music"
+        self.db_path = os.path.join(self.test_dir, "library.db")
+
+        write_file(self.music_dir / "trance" / "Artist A - Song One.mp3", b"one")
+        write_file(self.music_dir / "house" / "Artist B - Song Two.mp3", b"two")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_track_round_trip(self):
+        track = TrackMetadata(
+            file_path="/music/a.mp3", title="A", artist="B",
+            genre=Genre.TRANCE, energy=Energy.HIGH, tags=["anthem"], bpm=140
+        )
+        restored = TrackMetadata.from_dict(track.to_dict())
+        self.assertEqual(restored, track)
+
+    def test_catalog_persists_between_instances(self):
+        library = MusicLibrary(str(self.music_dir), db_path=self.db_path)
+        self.assertEqual(library.scan_directory(), 2)
+
+        reopened = MusicLibrary(str(self.music_dir), db_path=self.db_path)
+        titles = sorted(t.title for t in reopened.tracks.values())
+        self.assertEqual(titles, ["Song One", "Song Two"])
+        genres = {t.title: t.genre for t in reopened.tracks.values()}
+        self.assertEqual(genres["Song One"], Genre.TRANCE)
+
+    def test_v1_catalog_is_rehashed_in_place(self):
+        path = str((self.music_dir / "trance" / "Artist A - Song One.mp3").absolute())
+        track = create_track_from_file(path)
+        track.file_hash, track.play_count, track.rotation_category = "v1hash", 3, "power"
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript(
+            "CREATE TABLE tracks (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime REAL NOT NULL,"
+            " file_hash TEXT, data TEXT NOT NULL);"
+            "CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);"
+            "INSERT INTO meta VALUES ('schema_version', '1');"
+        )
+        stat = os.stat(path)
+        conn.execute("INSERT INTO tracks VALUES (?, ?, ?, ?, ?)",
+                     (path, stat.st_size, stat.st_mtime, "v1hash", json.dumps(track.to_dict())))
+        conn.commit()
+        conn.close()
+
+        library = MusicLibrary(str(self.music_dir), db_path=self.db_path)
+        new_hash = hash_file(path)
+        self.assertEqual(library.tracks[new_hash].play_count, 3)
+        self.assertEqual(library.tracks[new_hash].rotation_category, "power")
+        known = library.store.get_file_stats(str(self.music_dir))
+        probed = [Path(r.file_path).name for r in library.iter_scan(known=known)]
+        self.assertEqual(probed, ["Artist B - Song Two.mp3"])  # The migrated row is not re-read
+
+    def test_rescan_only_reads_changed_files(self):
+        library = MusicLibrary(str(self.music_dir), db_path=self.db_path)
+        library.scan_directory()
+
+        changed = self.music_dir / "house" / "Artist B - Song Two.mp3"
+        changed.write_bytes(b"two, remastered")
+        os.utime(changed, (1_000_000, 1_000_000))
+        write_file(self.music_dir / "Artist C - Song Three.mp3", b"three")
+        (self.music_dir / "trance" / "Artist A - Song One.mp3").unlink()
+
+        reopened = MusicLibrary(str(self.music_dir), db_path=self.db_path)
+        with patch.object(reopened, "_hash_file", wraps=reopened._hash_file) as hasher:
+            self.assertEqual(reopened.scan_directory(), 2)
+
+        hashed = sorted(Path(call.args[0]).name for call in hasher.call_args_list)
+        self.assertEqual(hashed, ["Artist B - Song Two.mp3", "Artist C - Song Three.mp3"])
+        titles = sorted(t.title for t in reopened.tracks.values())
+        self.assertEqual(titles, ["Song Three", "Song Two"])
+        self.assertEqual(len(reopened.store), 2)
+
+    def test_rescan_after_move_keeps_play_history(self):
+        library = MusicLibrary(str(self.music_dir), db_path=self.db_path)
+        library.scan_directory()
+        old = self.music_dir / "trance" / "Artist A - Song One.mp3"
+        key = library._path_keys[str(old)]
+        library.update_play_count(key)
+
+        new = self.music_dir / "archive" / "Artist A - Song One (Live).mp3"
+        new.parent.mkdir()
+        os.rename(old, new)
+        reopened = MusicLibrary(str(self.music_dir), db_path=self.db_path)
+        self.assertEqual(reopened.scan_directory(), 2)
+
+        track = reopened.get_by_path(str(new))
+        self.assertEqual((track.title, track.play_count), ("Song One (Live)", 1))
+        self.assertIsNotNone(track.last_played)
+        self.assertIsNone(reopened.get_by_path(str(old)))
+        again = MusicLibrary(str(self.music_dir), db_path=self.db_path)
+        self.assertEqual(again.tracks[key].play_count, 1)
+
+    def test_play_count_is_persisted(self):
+        library = MusicLibrary(str(self.music_dir), db_path=self.db_path)
+        library.scan_directory()
+        key = next(iter(library.tracks))
+        library.update_play_count(key)
+
+        reopened = MusicLibrary(str(self.music_dir), db_path=self.db_path)
+        self.assertEqual(reopened.tracks[key].play_count, 1)
+        self.assertIsNotNone(reopened.tracks[key].last_played)
+
+
+    def test_snapshot_fast_start(self):
+        library = MusicLibrary(str(self.music_dir), db_path=self.db_path)
+        library.scan_directory()
+        snapshot = library.save_snapshot()
+
+        # Writes after the snapshot are replayed from the store on load
+        key = library._path_keys[str(self.music_dir / "trance" / "Artist A - Song One.mp3")]
+        library.update_play_count(key)
+        write_file(self.music_dir / "Artist C - Song Three.mp3", b"three")
+        library.scan_directory()
+
+        reopened = MusicLibrary(str(self.music_dir), db_path=self.db_path)
+        self.assertIsInstance(reopened.tracks, CompactCatalog)
+        self.assertEqual(sorted(t.title for t in reopened.tracks.values()),
+                         ["Song One", "Song Three", "Song Two"])
+        self.assertEqual(reopened.tracks[key].play_count, 1)
+        self.assertEqual([t.title for t in reopened.search("three")], ["Song Three"])
+
+        # A snapshot of another catalog is ignored
+        other = MusicLibrary(str(self.music_dir), db_path=os.path.join(self.test_dir, "other.db"),
+                             snapshot_path=snapshot)
+        self.assertEqual(len(other.tracks), 0)
+
+
+class TestLibraryScanner(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        for i in range(10):
+            write_file(Path(self.test_dir) / f"dir{i % 3}" / f"Artist - Song {i}.mp3", bytes([i]))
+        write_file(Path(self.test_dir) / "cover.jpg")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_pool_scan_streams_progress(self):
+        scanner = LibraryScanner(create_track_from_file, max_workers=2, batch_size=3, inline_threshold=0)
+        results = list(scanner.scan(self.test_dir))
+
+        self.assertEqual(len(results), 10)
+        self.assertEqual([r.processed for r in results], list(range(1, 11)))
+        self.assertTrue(all(r.total == 10 for r in results))
+        titles = sorted(r.track.title for r in results)
+        self.assertEqual(titles, sorted(f"Song {i}" for i in range(10)))
+
+    def test_pool_is_fed_while_files_are_listed(self):
+        listed = []
+
+        def pending():
+            for i in range(10):
+                listed.append(i)
+                yield os.path.join(self.test_dir, f"dir{i % 3}", f"Artist - Song {i}.mp3"), 1, 0.0
+
+        scanner = LibraryScanner(create_track_from_file, max_workers=1, batch_size=1, inline_threshold=2,
+                                 use_processes=False)
+        results = scanner.probe_files(pending())
+        first = next(results)
+        # One worker keeps four batches in flight: the listing is still going
+        self.assertLess(len(listed), 10)
+        self.assertLess(first.total, 10)
+        rest = list(results)
+        self.assertEqual(len(listed), 10)
+        self.assertEqual(rest[-1].total, 10)
+        self.assertEqual(len({first.file_path} | {r.file_path for r in rest}), 10)
+
+    def test_library_commits_in_batches(self):
+        library = MusicLibrary(self.test_dir, db_path=os.path.join(self.test_dir, "library.db"))
+        progress = []
+        found = library.scan_directory(batch_size=4, progress=lambda done, total: progress.append(done))
+
+        self.assertEqual(found, 10)
+        self.assertEqual(len(library.tracks), 10)
+        self.assertEqual(progress[-1], 10)
+        self.assertEqual(len(library.store), 10)
+
+
+class TestLibraryWatcher(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.music_dir = Path(self.test_dir) / "music"
+        write_file(self.music_dir / "Artist - Old.mp3", b"old")
+        self.library = MusicLibrary(str(self.music_dir), db_path=os.path.join(self.test_dir, "library.db"))
+        self.library.scan_directory()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def titles(self):
+        return sorted(t.title for t in self.library.tracks.values())
+
+    def exercise(self, watcher, timeout):
+        try:
+            write_file(self.music_dir / "trance" / "Artist - New.mp3", b"new")
+            watcher.poll(timeout)
+            self.assertEqual(watcher.poll(timeout, now=time.monotonic() + 10), (1, 0))
+            self.assertEqual(self.titles(), ["New", "Old"])
+            self.assertEqual(self.library.get_by_genre(Genre.TRANCE)[0].title, "New")
+
+            os.rename(self.music_dir / "Artist - Old.mp3", self.music_dir / "Artist - Moved.mp3")
+            (self.music_dir / "trance" / "Artist - New.mp3").unlink()
+            watcher.poll(timeout)
+            watcher.poll(timeout, now=time.monotonic() + 10)
+            self.assertEqual(self.titles(), ["Moved"])
+            self.assertEqual(self.library.search("new"), [])
+            self.assertEqual(set(self.library.store.get_file_stats()),
+                             {str(self.music_dir / "Artist - Moved.mp3")})
+        finally:
+            watcher.stop()
+
+    def test_polling_watcher(self):
+        watcher = LibraryWatcher(self.library, debounce=1.0, poll_interval=0, use_inotify=False)
+        self.assertIsInstance(watcher.backend, PollingBackend)
+        self.exercise(watcher, 0)
+
+    @unittest.skipUnless(_load_libc(), "inotify not available")
+    def test_inotify_watcher(self):
+        watcher = LibraryWatcher(self.library, debounce=1.0, use_inotify=True)
+        self.assertIsInstance(watcher.backend, InotifyBackend)
+        self.exercise(watcher, 0.2)
+
+    def test_modified_file_keeps_play_history(self):
+        key = next(iter(self.library.tracks))
+        self.library.update_play_count(key)
+        path = self.music_dir / "Artist - Old.mp3"
+        write_file(path, b"retagged")
+
+        self.assertEqual(self.library.apply_file_changes([str(path)]), (1, 0))
+        track = self.library.tracks[self.library._path_keys[str(path)]]
+        self.assertEqual(track.play_count, 1)
+
+    def test_moved_file_keeps_play_history(self):
+        key = next(iter(self.library.tracks))
+        self.library.update_play_count(key)
+        self.library.tracks[key].rotation_category = "power"
+        old = self.music_dir / "Artist - Old.mp3"
+        new = self.music_dir / "archive" / "Artist - Renamed.mp3"
+        new.parent.mkdir()
+        os.rename(old, new)
+
+        self.assertEqual(self.library.apply_file_changes([str(new)], [str(old)]), (1, 1))
+        track = self.library.tracks[self.library._path_keys[str(new)]]
+        self.assertEqual((track.title, track.play_count, track.rotation_category), ("Renamed", 1, "power"))
+        self.assertIsNotNone(track.last_played)
+        reopened = MusicLibrary(str(self.music_dir), db_path=self.library.store.db_path)
+        self.assertEqual(reopened.tracks[key].play_count, 1)
+
+
+class TestLibrarySearch(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.library = MusicLibrary(self.test_dir, db_path=os.path.join(self.test_dir, "library.db"))
+        self.library.add_tracks([
+            TrackMetadata("/m/1.mp3", "Neon Nights", "Vector Hold", file_hash="h1"),
+            TrackMetadata("/m/2.mp3", "Night Drive", "Neon Ghost", file_hash="h2", tags=["synth"]),
+            TrackMetadata("/m/3.mp3", "Sunrise", "Someone", album="Neon Dawn", file_hash="h3"),
+            TrackMetadata("/m/4.mp3", "Pad Loop", "AI DJ", file_hash="h4", is_generated=True,
+                          generation_prompt="dreamy synth pads"),
+        ])
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_ranked_prefix_search(self):
+        titles = [t.title for t in self.library.search("neon")]
+        # Title match outranks artist match, which outranks album match
+        self.assertEqual(titles, ["Neon Nights", "Night Drive", "Sunrise"])
+        self.assertEqual([t.title for t in self.library.search("neon nig")], ["Neon Nights", "Night Drive"])
+        self.assertEqual([t.title for t in self.library.search("synth")], ["Night Drive", "Pad Loop"])
+        self.assertEqual([t.title for t in self.library.search("generated dreamy")], ["Pad Loop"])
+        self.assertEqual(len(self.library.search("neon", limit=1)), 1)
+
+    def test_short_prefixes_expand_lazily(self):
+        self.assertEqual({t.title for t in self.library.search("n")}, {"Neon Nights", "Night Drive", "Sunrise"})
+        self.library.add_tracks([
+            TrackMetadata(f"/m/w{i}.mp3", f"Word{i:03d}", "Filler", file_hash=f"w{i}") for i in range(200)
+        ])
+        self.library.add_tracks([
+            TrackMetadata(f"/m/l{i}.mp3", "Track", "Filler", album=f"lo{i:03d}", file_hash=f"l{i}")
+            for i in range(100)
+        ] + [TrackMetadata("/m/love.mp3", "Love", "Someone", file_hash="love")])
+        # A match sorting behind a hundred sibling tokens is still reached
+        self.assertEqual({t.title for t in self.library.search("lo", limit=2)}, {"Love", "Pad Loop"})
+        index = self.library._search_index
+        # Ten title-prefix hits are as good as a prefix can score: expansion stops there
+        self.assertEqual(len(index._match("wo", limit=10)), 10)
+        self.assertEqual(len(self.library.search("wo", limit=10)), 10)
+
+    def test_index_follows_catalog_changes(self):
+        self.library.remove_track("h1")
+        self.assertEqual([t.title for t in self.library.search("vector")], [])
+
+        self.library.add_track(TrackMetadata("/m/5.mp3", "Echo", "First", file_hash="h5"))
+        self.library.add_track(TrackMetadata("/m/6.mp3", "Echo", "Second", file_hash="h6"))
+        self.library.update_play_count("h6")
+        self.assertEqual([t.artist for t in self.library.search("echo")], ["Second", "First"])
+
+
+class TestLibraryFilters(unittest.TestCase):
+    compact = False
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.library = MusicLibrary(self.test_dir, db_path=os.path.join(self.test_dir, "library.db"),
+                                    compact=self.compact)
+        self.library.add_tracks([
+            TrackMetadata("/m/1.mp3", "A", "X", genre=Genre.TRANCE, energy=Energy.HIGH, bpm=138,
+                          rotation_category="hot", file_hash="h1"),
+            TrackMetadata("/m/2.mp3", "B", "X", genre=Genre.TRANCE, energy=Energy.MEDIUM, bpm=128,
+                          file_hash="h2"),
+            TrackMetadata("/m/3.mp3", "C", "Y", genre=Genre.HOUSE, energy=Energy.HIGH, bpm=124,
+                          rotation_category="hot", file_hash="h3"),
+            TrackMetadata("/m/4.mp3", "D", "Y", genre=Genre.TRANCE, energy=Energy.HIGH, file_hash="h4"),
+        ])
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_single_attribute_lookups(self):
+        self.assertEqual([t.title for t in self.library.get_by_genre(Genre.TRANCE)], ["A", "B", "D"])
+        self.assertEqual([t.title for t in self.library.get_by_genre(Genre.TRANCE, limit=1)], ["A"])
+        self.assertEqual([t.title for t in self.library.get_by_energy(Energy.HIGH)], ["A", "C", "D"])
+        self.assertEqual([t.title for t in self.library.get_by_bpm_range(124, 130)], ["C", "B"])
+        self.assertEqual(self.library.get_stats()["genres"], {"trance": 3, "house": 1})
+
+    def test_compound_filters_intersect(self):
+        results = self.library.filter_tracks(genre=Genre.TRANCE, energy=Energy.HIGH, bpm_range=(120, 140))
+        self.assertEqual([t.title for t in results], ["A"])
+        hot = self.library.filter_tracks(rotation_category="hot", energy=Energy.HIGH)
+        self.assertEqual(sorted(t.title for t in hot), ["A", "C"])
+
+    def test_find_similar_tracks(self):
+        seed = self.library.tracks["h1"]
+        # h2: genre + BPM, h4: genre + energy (tie keeps catalog order), h3: energy
+        self.assertEqual([t.title for t in self.library.find_similar_tracks(seed)], ["B", "D", "C"])
+        self.assertEqual([t.title for t in self.library.find_similar_tracks(seed, limit=1)], ["B"])
+
+    def test_find_similar_tracks_prefers_compatible_keys(self):
+        self.library.add_tracks([
+            TrackMetadata("/m/5.mp3", "E", "Z", genre=Genre.AMBIENT, energy=Energy.LOW, key="F#", file_hash="h5"),
+            TrackMetadata("/m/6.mp3", "F", "Z", genre=Genre.AMBIENT, energy=Energy.LOW, key="C", file_hash="h6"),
+        ])
+        seed = TrackMetadata("/m/seed.mp3", "S", "Q", genre=Genre.AMBIENT, energy=Energy.HIGH, key="Am")
+        # Both share genre; C is Am's relative major, F# clashes
+        self.assertEqual([t.title for t in self.library.find_similar_tracks(seed)][:2], ["F", "E"])
+
+    def test_find_similar_batch_excludes_all_seeds(self):
+        seeds = [self.library.tracks["h1"], self.library.tracks["h3"]]
+        results = self.library.find_similar_batch(seeds, limit=5)
+        self.assertEqual([[t.title for t in r] for r in results], [["B", "D"], ["B", "D"]])
+
+    def test_update_track_reindexes(self):
+        track = self.library.tracks["h4"]
+        track.bpm = 126
+        track.genre = Genre.HOUSE
+        self.library.update_track("h4")
+
+        self.assertEqual([t.title for t in self.library.get_by_bpm_range(125, 127)], ["D"])
+        self.assertEqual([t.title for t in self.library.get_by_genre(Genre.HOUSE)], ["C", "D"])
+
+
+
+    def test_exact_smart_playlist(self):
+        durations = [187, 203, 241, 176, 222, 198, 265, 214, 231, 189, 207, 244, 193, 219, 236, 181, 258]
+        self.library.add_tracks([
+            TrackMetadata(f"/m/x{i}.mp3", f"X{i}", "Z", genre=Genre.AMBIENT, duration_seconds=d,
+                          file_hash=f"x{i}")
+            for i, d in enumerate(durations)
+        ])
+        playlist = self.library.create_smart_playlist("Hour", duration_minutes=30, genre=Genre.AMBIENT,
+                                                      exact=True, tolerance_seconds=0)
+        self.assertEqual(playlist.total_duration, 1800)
+        self.assertTrue(all(t.genre == Genre.AMBIENT for t in playlist.tracks))
+        self.assertEqual(len({t.file_hash for t in playlist.tracks}), playlist.track_count)
+
+    def test_solver_reports_infeasible_targets(self):
+        self.assertIsNone(solve_duration([100, 200], 250, tolerance=10))
+        self.assertEqual(sorted(solve_duration([100, 200, 140], 240, tolerance=0)), [0, 2])
+
+
+class TestCompactLibraryFilters(TestLibraryFilters):
+    """The same queries, backed by the columnar catalog."""
+    compact = True
+
+
+
+class TestRotation(unittest.TestCase):
+    def setUp(self):
+        self.tracks = {
+            "a1": TrackMetadata("/m/a1.mp3", "One", "A", rotation_category="hot"),
+            "a2": TrackMetadata("/m/a2.mp3", "Two", "A", rotation_category="hot"),
+            "b1": TrackMetadata("/m/b1.mp3", "Three", "B", rotation_category="hot"),
+            "c1": TrackMetadata("/m/c1.mp3", "Four", "C", rotation_category="hot"),
+        }
+        rules = RotationRules(artist_separation=3600, category_rest={"hot": 7200})
+        self.engine = RotationEngine(rules)
+        for key, track in self.tracks.items():
+            self.engine.add(key, track)
+
+    def test_picks_respect_separation_and_rest(self):
+        first = self.engine.pick("hot", 3, now=0)
+        self.assertEqual(len({self.tracks[k].artist for k in first}), 3)
+
+        # Only the other A track is rested, and its artist is clear after an hour
+        self.assertEqual(self.engine.pick("hot", 3, now=1800, relax=False), [])
+        second = self.engine.pick("hot", 3, now=4000, relax=False)
+        self.assertEqual(len(second), 1)
+        self.assertEqual(self.tracks[second[0]].artist, "A")
+        self.assertNotIn(second[0], first)
+
+    def test_starved_category_still_fills(self):
+        self.engine.pick("hot", 4, now=0)
+        again = self.engine.pick("hot", 4, now=60)
+        # One A track only: the batch never repeats an artist
+        self.assertEqual(sorted(self.tracks[k].artist for k in again), ["A", "B", "C"])
+
+    def test_unrecorded_picks_leave_the_rotation_alone(self):
+        preview = self.engine.pick("hot", 4, now=0, record=False)
+        self.assertEqual(self.engine.pick("hot", 4, now=0, record=False), preview)
+        self.assertEqual(self.engine.pick("hot", 4, now=0), preview)
+        self.assertEqual(self.engine.pick("hot", 1, now=60, relax=False), [])  # All resting now
+
+    def test_preview_leaves_blocked_tracks_queued(self):
+        first = self.engine.pick("hot", 3, now=0)
+        other = next(k for k in self.tracks if k not in first)
+        self.assertEqual(self.engine.pick("hot", 3, now=1800, relax=False, record=False), [])
+        self.assertEqual(self.engine.eligible_at(other), 0.0)  # Not moved to the end of its separation
+        self.assertEqual(self.engine.pick("hot", 3, now=1800, relax=False), [])
+        self.assertEqual(self.engine.eligible_at(other), 3600.0)
+
+    def test_library_play_reschedules(self):
+        test_dir = tempfile.mkdtemp()
+        try:
+            library = MusicLibrary(test_dir, db_path=os.path.join(test_dir, "library.db"))
+            library.add_tracks([
+                TrackMetadata(f"/m/{k}.mp3", t.title, t.artist, rotation_category="hot", file_hash=k)
+                for k, t in self.tracks.items()
+            ])
+            library.update_play_count("b1")
+            eligible = library.rotation.eligible_at("b1")
+            self.assertGreater(eligible, time.time() + 3600)
+            picks = library.get_rotation_picks("hot", count=2)
+            self.assertNotIn("b1", [t.file_hash for t in picks])
+        finally:
+            shutil.rmtree(test_dir)
+
+
+class TestCompactCatalog(unittest.TestCase):
+    def test_views_round_trip(self):
+        catalog = CompactCatalog()
+        track = TrackMetadata(
+            "/m/a.mp3", "Title", "Artist", album="Album", genre=Genre.SYNTHWAVE, bpm=110,
+            key="Am", duration_seconds=200, energy=Energy.HIGH, loudness_lufs=-9.5,
+            last_played=datetime(2024, 1, 2, 3, 4, 5), tags=["retro"], hook_start=42.0,
+            is_generated=True, generation_prompt="neon", file_hash="ha"
+        )
+        catalog["ha"] = track
+        view = catalog["ha"]
+        self.assertEqual(view.to_dict(), track.to_dict())
+        self.assertEqual(view, track)
+
+        view.play_count += 1
+        view.tags = ["retro", "night"]
+        self.assertEqual(catalog["ha"].play_count, 1)
+        self.assertEqual(catalog["ha"].tags, ["retro", "night"])
+
+        removed = catalog.pop("ha")
+        self.assertIsInstance(removed, TrackMetadata)
+        self.assertEqual(removed.tags, ["retro", "night"])
+        self.assertNotIn("ha", catalog)
+
+    def test_compact_library_persists(self):
+        test_dir = tempfile.mkdtemp()
+        try:
+            db_path = os.path.join(test_dir, "library.db")
+            library = MusicLibrary(test_dir, db_path=db_path, compact=True)
+            library.store.upsert_tracks([
+                (TrackMetadata(f"/m/{i}.mp3", f"T{i}", "A", file_hash=f"h{i}").to_dict(), 1, 1.0)
+                for i in range(3)
+            ])
+            library.update_play_count("h1")
+
+            reloaded = MusicLibrary(test_dir, db_path=db_path, compact=True)
+            self.assertIsInstance(reloaded.tracks, CompactCatalog)
+            self.assertEqual(len(reloaded.tracks), 3)
+            self.assertEqual(reloaded.tracks["h1"].play_count, 1)
+            self.assertEqual([t.title for t in reloaded.search("t2")], ["T2"])
+        finally:
+            shutil.rmtree(test_dir)
+
+
+def write_test_wav(path: str, rate: int = 22050, bpm: int = 120, intro: float = 4.0,
+                   body: float = 30.0, notes=(220.0, 261.63, 329.63), progression=None):
+    """
+    A quiet pad intro, then a chord with a kick drum on every beat.
+
+    ``progression`` (a list of chords) changes chord every two seconds.
+    """
+    t_intro = np.arange(int(intro * rate)) / rate
+    t_body = np.arange(int(body * rate)) / rate
+    if progression:
+        step = (t_body // 2).astype(int) % len(progression)
+        chord = np.zeros_like(t_body)
+        for i, chord_notes in enumerate(progression):
+            part = step == i
+            chord[part] = sum(np.sin(2 * np.pi * f * t_body[part]) for f in chord_notes) / len(chord_notes)
+    else:
+        chord = sum(np.sin(2 * np.pi * f * t_body) for f in notes) / len(notes)
+    kicks = np.zeros_like(t_body)
+    beat = int(rate * 60 / bpm)
+    decay = np.exp(-np.arange(beat) / (0.03 * rate))
+    for start in range(0, len(kicks) - beat, beat):
+        kicks[start:start + beat] = decay * np.sin(2 * np.pi * 60 * np.arange(beat) / rate)
+    pad = 0.01 * np.sin(2 * np.pi * notes[0] * t_intro)
+    signal = np.concatenate([pad, 0.3 * chord + 0.6 * kicks])
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes((signal * 32767).astype("<i2").tobytes())
+
+
+class TestAudioAnalysis(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.wav_path = os.path.join(self.test_dir, "Artist - Ramp.wav")
+        write_test_wav(self.wav_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_analyze_file(self):
+        result = analyze_file(self.wav_path)
+        self.assertEqual(result.duration_seconds, 34.0)
+        self.assertAlmostEqual(result.bpm, 120, delta=1)
+        self.assertEqual(result.key, "Am")
+        self.assertAlmostEqual(result.intro_seconds, 4.0, delta=0.6)
+        self.assertLess(result.outro_seconds, 1.0)
+        self.assertIsNotNone(result.loudness_lufs)
+
+    def test_segue_planned_from_envelope(self):
+        result = analyze_file(self.wav_path)
+        track = Track("Ramp", "Artist", 34, bpm=result.bpm, envelope=result.envelope)
+        segue = PlaylistOptimizer().plan_segues([track, track])[0]
+        # Hard ending: the next track's 4 s pad intro plays under the last beats
+        self.assertAlmostEqual(segue.start_next_at, 30.5, delta=0.6)
+        self.assertAlmostEqual(segue.crossfade_ms, 3500, delta=600)
+        self.assertEqual(segue.next_offset, 0.0)
+        self.assertIsNone(PlaylistOptimizer().plan_segues([track, Track("Plain", "X", 200)])[0])
+
+    def test_library_analysis_is_cached(self):
+        library = MusicLibrary(self.test_dir, db_path=os.path.join(self.test_dir, "library.db"))
+        library.scan_directory()  # Cataloguing does not decode the audio
+        track = next(iter(library.tracks.values()))
+        self.assertEqual(track.intro_seconds, 0.0)
+        self.assertEqual(library.analyze_tracks(), 1)
+        self.assertGreater(track.intro_seconds, 3.0)
+        with patch("core.brain.audio_analysis._analyze_safe") as analyze:
+            self.assertEqual(library.analyze_tracks(), 1)  # Served from the cache
+        analyze.assert_not_called()
+        self.assertEqual(track.duration_seconds, 34)
+        self.assertGreater(track.intro_seconds, 3.0)
+        self.assertIsNotNone(track.envelope)
+
+        reopened = MusicLibrary(self.test_dir, db_path=os.path.join(self.test_dir, "library.db"))
+        self.assertEqual(next(iter(reopened.tracks.values())).intro_seconds, track.intro_seconds)
+        self.assertIn(track.file_hash, reopened.store.get_analysis([track.file_hash]))
+
+    def test_near_duplicates_share_a_fingerprint(self):
+        song = [(220.0, 261.63, 329.63), (174.61, 220.0, 261.63), (261.63, 329.63, 392.0)]
+        other = [(146.83, 174.61, 220.0), (196.0, 246.94, 293.66), (164.81, 207.65, 246.94)]
+        os.remove(self.wav_path)
+        write_test_wav(os.path.join(self.test_dir, "A - Song.wav"), progression=song)
+        # Same recording at another sample rate
+        write_test_wav(os.path.join(self.test_dir, "A - Song (16k).wav"), rate=16000, progression=song)
+        write_test_wav(os.path.join(self.test_dir, "B - Other.wav"), progression=other, bpm=100)
+
+        library = MusicLibrary(self.test_dir, db_path=os.path.join(self.test_dir, "library.db"))
+        library.scan_directory()
+        self.assertEqual(library.analyze_tracks(max_workers=1), 3)
+
+        clusters = library.find_duplicates()
+        self.assertEqual([sorted(t.title for t in c) for c in clusters], [["Song", "Song (16k)"]])
+        original = library.search("song")[0]
+        self.assertEqual(len(library.find_near_duplicates(original)), 1)
+        other_track = library.search("other")[0]
+        self.assertEqual(library.find_near_duplicates(other_track), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+import os
+import random
+import shutil
+import tempfile
+
+import numpy as np
+
+from core.brain.agents.music import FlowMaster, metadata_to_track
+from core.brain.music_library import MusicLibrary, TrackMetadata, Genre, Energy
+from core.brain.radio_automation import PlaylistOptimizer, Track
+from core.brain.sequencing import greedy_path, optimize_path, path_score
+
+
+def random_tracks(count, seed=1):
+    rng = random.Random(seed)
+    return [
+        Track(
+            title=f"Track {i}",
+            artist=f"Artist {i % 7}",
+            duration=200,
+            genre=rng.choice(["synthwave", "pop", "rock", None]),
+            bpm=rng.choice([None, 0] + list(range(70, 180))),
+            energy=rng.choice([None, 0.0, rng.random(), rng.random()]),
+            key=rng.choice([None, "Am", "C", "Em", "F#", "8A", "Dbm", "??"]),
+        )
+        for i in range(count)
+    ]
+
+
+class TestPlaylistOptimizer(unittest.TestCase):
+    def setUp(self):
+        self.optimizer = PlaylistOptimizer()
+
+    def test_matrix_matches_pairwise_scores(self):
+        tracks = random_tracks(40)
+        matrix = self.optimizer.transition_matrix(tracks)
+        expected = np.array([
+            [self.optimizer.calculate_transition_score(a, b) for b in tracks]
+            for a in tracks
+        ])
+        np.testing.assert_allclose(matrix, expected)
+
+    def test_harmonic_keys_shape_transitions(self):
+        a = Track("A", "X", 200, key="Am")
+        self.assertGreater(
+            self.optimizer.calculate_transition_score(a, Track("B", "Y", 200, key="C")),
+            self.optimizer.calculate_transition_score(a, Track("C", "Y", 200, key="F#"))
+        )
+        self.assertEqual(
+            self.optimizer.calculate_transition_score(a, Track("D", "Y", 200)),
+            self.optimizer.calculate_transition_score(Track("A", "X", 200), Track("D", "Y", 200))
+        )
+
+    def test_optimize_queue_keeps_first_track_and_all_tracks(self):
+        tracks = random_tracks(50)
+        queue = self.optimizer.optimize_queue(tracks)
+        self.assertIs(queue[0], tracks[0])
+        self.assertEqual(sorted(map(id, queue)), sorted(map(id, tracks)))
+
+    def test_local_search_improves_on_greedy(self):
+        matrix = np.random.default_rng(0).random((60, 60))
+        greedy = greedy_path(matrix)
+        order = optimize_path(matrix, time_budget=1.0)
+        self.assertEqual(order[0], 0)
+        self.assertEqual(sorted(order), list(range(60)))
+        self.assertGreater(path_score(matrix, order), path_score(matrix, greedy))
+
+
+class TestFlowMaster(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.library = MusicLibrary(self.test_dir, db_path=os.path.join(self.test_dir, "library.db"))
+        rng = random.Random(3)
+        self.library.add_tracks([
+            TrackMetadata(f"/m/{i}.mp3", f"Track {i}", f"Artist {i % 20}",
+                          genre=rng.choice([Genre.SYNTHWAVE, Genre.HOUSE]),
+                          energy=rng.choice(list(Energy)), bpm=rng.randint(100, 130),
+                          duration_seconds=200, file_hash=f"h{i}")
+            for i in range(300)
+        ])
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_craft_set_fills_length_and_follows_energy_curve(self):
+        seed = metadata_to_track(self.library.get_by_path("/m/0.mp3"))
+        tracks = FlowMaster().craft_set(seed, 60, self.library, energy_curve=[0.2, 1.0])
+
+        self.assertIs(tracks[0], seed)
+        self.assertGreaterEqual(sum(t.duration for t in tracks), 3600)
+        self.assertEqual(len({t.path for t in tracks}), len(tracks))
+        self.assertLess(tracks[1].energy, tracks[-1].energy)
+
+    def test_analyze_segue(self):
+        a = Track("A", "X", 200, bpm=120, energy=0.4)
+        b = Track("B", "Y", 200, bpm=124, energy=0.8)
+        segue = FlowMaster().analyze_segue(a, b)
+        self.assertEqual(segue["bpm_diff"], 4)
+        self.assertAlmostEqual(segue["energy_change"], 0.4)
+        self.assertEqual(segue["crossfade_duration"], 3000)
+
+
+if __name__ == "__main__":
+    unittest.main()
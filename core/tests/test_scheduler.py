@@ -1,7 +1,9 @@
 import unittest
+import hashlib
 import os
 import shutil
 import tempfile
+from datetime import datetime, timedelta
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 
@@ -9,6 +11,18 @@ from core.brain.playlist_manager import PlaylistManager
 from core.brain.music_library import TrackMetadata
 from core.brain.scheduler import RadioScheduler
 
+def fake_tts(client):
+    """Make a mocked ElevenLabsClient speak each text as its own bytes."""
+    def generate(text, output_path=None):
+        if output_path:
+            with open(output_path, "wb") as f:
+                f.write(text.encode())
+        return text.encode()
+
+    client.generate.side_effect = generate
+    client.cache_key.side_effect = lambda text: hashlib.sha256(text.encode()).hexdigest()
+
+
 class TestPlaylistManager(unittest.TestCase):
     def setUp(self):
         self.test_dir = tempfile.mkdtemp()
@@ -67,9 +81,7 @@ class TestRadioScheduler(unittest.TestCase):
         mock_news_instance = mock_news.return_value
         mock_news_instance.get_top_stories.return_value = ["AI takes over world"]
 
-        mock_voice_instance = mock_voice.return_value
-        # Mock generate to return dummy bytes
-        mock_voice_instance.generate.return_value = b"fake audio data"
+        fake_tts(mock_voice.return_value)
 
         # Mock Music Library
         mock_library_instance = mock_library.return_value
@@ -102,5 +114,70 @@ class TestRadioScheduler(unittest.TestCase):
         self.assertTrue(has_voice, "Playlist should contain voice tracks")
         self.assertTrue(has_music, "Playlist should contain music tracks")
 
+    @patch('core.brain.scheduler.get_voice_mixer')
+    @patch('core.brain.scheduler.MusicLibrary')
+    @patch('core.brain.scheduler.ElevenLabsClient')
+    @patch('core.brain.scheduler.WeatherClient')
+    @patch('core.brain.scheduler.NewsAgent')
+    def test_ramp_mixes_render_as_one_batch(self, mock_news, mock_weather, mock_voice, mock_library, mock_mixer):
+        mock_weather.return_value.get_weather.return_value = "20C, Sunny"
+        mock_news.return_value.get_top_stories.return_value = ["AI takes over world"]
+        fake_tts(mock_voice.return_value)
+        mock_library.return_value.get_rotation_picks.return_value = [
+            TrackMetadata(f"/music/ramp{i}.mp3", f"Ramp {i}", "Artist", duration_seconds=180, intro_seconds=12)
+            for i in range(12)
+        ]
+        batches = []
+
+        def mix_batch(jobs):
+            batches.append(jobs)
+            # First ramp mixes, the rest fail and fall back to a stop set
+            return iter([(0, "/mixed/ramp.mp3")] + [(i, None) for i in range(1, len(jobs))])
+
+        mock_mixer.return_value.mix_batch.side_effect = mix_batch
+
+        scheduler = RadioScheduler(audio_output_dir=self.test_dir)
+        tracks = PlaylistManager.parse_m3u(scheduler.generate_hour_block(10, self.test_dir))
+        mock_library.return_value.analyze_tracks.assert_not_called()  # Planning reads stored analysis
+
+        self.assertEqual(len(batches), 1)
+        self.assertGreater(len(batches[0]), 1)
+        self.assertTrue(all(job.over_intro and job.bed_path.startswith("/music/ramp") for job in batches[0]))
+        paths = [t.file_path for t in tracks]
+        self.assertIn("/mixed/ramp.mp3", paths)
+        self.assertNotIn(batches[0][0].bed_path, paths)  # Replaced by its mix
+        for job in batches[0][1:]:
+            self.assertIn(job.bed_path, paths)  # Played after a separate intro
+
+    @patch('core.brain.scheduler.MusicLibrary')
+    @patch('core.brain.scheduler.ElevenLabsClient')
+    @patch('core.brain.scheduler.WeatherClient')
+    @patch('core.brain.scheduler.NewsAgent')
+    def test_daily_schedule_picks_for_each_hour(self, mock_news, mock_weather, mock_voice, mock_library):
+        mock_weather.return_value.get_weather.return_value = "20C, Sunny"
+        mock_news.return_value.get_top_stories.return_value = ["AI takes over world"]
+        fake_tts(mock_voice.return_value)
+        picks = mock_library.return_value.get_rotation_picks
+        picks.return_value = [TrackMetadata("/music/a.mp3", "A", "Artist", duration_seconds=180)]
+
+        scheduler = RadioScheduler(audio_output_dir=self.test_dir)
+        self.assertEqual(len(scheduler.generate_daily_schedule(self.test_dir, day=datetime(2026, 3, 1, 15))), 24)
+        air_times = [call.kwargs["air_time"] for call in picks.call_args_list]
+        self.assertEqual(air_times, [datetime(2026, 3, 1) + timedelta(hours=h) for h in range(24)])
+
+    @patch('core.brain.scheduler.MusicLibrary')
+    @patch('core.brain.scheduler.ElevenLabsClient')
+    @patch('core.brain.scheduler.WeatherClient')
+    @patch('core.brain.scheduler.NewsAgent')
+    def test_voice_lines_always_go_through_the_tts_cache(self, mock_news, mock_weather, mock_voice, mock_library):
+        fake_tts(mock_voice.return_value)
+        scheduler = RadioScheduler(audio_output_dir=self.test_dir)
+
+        first = scheduler._generate_audio_file("Good morning")
+        self.assertEqual(scheduler._generate_audio_file("Good morning"), first)
+        # No second cache in the output directory: the TTS cache serves (and counts) both
+        self.assertEqual(mock_voice.return_value.generate.call_count, 2)
+        mock_voice.return_value.generate.assert_called_with("Good morning", output_path=first)
+
 if __name__ == '__main__':
     unittest.main()
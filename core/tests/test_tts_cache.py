@@ -0,0 +1,97 @@
+import unittest
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+from core.brain.tts_cache import TTSCache, tts_key
+from core.brain.voice_generator import ElevenLabsClient
+
+
+class TestTTSCache(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.cache = TTSCache(os.path.join(self.test_dir, "tts"), max_bytes=1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_key_covers_voice_model_and_settings(self):
+        key = tts_key("Hello", "rachel", "v1", {"stability": 0.5, "similarity_boost": 0.5})
+        self.assertEqual(key, tts_key("Hello", "rachel", "v1", {"similarity_boost": 0.5, "stability": 0.5}))
+        self.assertEqual(len({
+            key,
+            tts_key("Hello!", "rachel", "v1", {"stability": 0.5, "similarity_boost": 0.5}),
+            tts_key("Hello", "adam", "v1", {"stability": 0.5, "similarity_boost": 0.5}),
+            tts_key("Hello", "rachel", "v2", {"stability": 0.5, "similarity_boost": 0.5}),
+            tts_key("Hello", "rachel", "v1", {"stability": 0.7, "similarity_boost": 0.5}),
+        }), 5)
+
+    def test_generates_once_and_delivers(self):
+        generate = MagicMock(return_value=b"speech")
+        output = os.path.join(self.test_dir, "out", "voice.mp3")
+
+        self.assertEqual(self.cache.get_or_generate("k", generate), b"speech")
+        self.assertEqual(self.cache.get_or_generate("k", generate, output_path=output), b"speech")
+        self.assertEqual(generate.call_count, 1)
+        with open(output, "rb") as f:
+            self.assertEqual(f.read(), b"speech")
+
+        # Failures and empty audio are not stored
+        self.assertIsNone(self.cache.get_or_generate("none", lambda: None))
+        with self.assertRaises(RuntimeError):
+            self.cache.get_or_generate("error", MagicMock(side_effect=RuntimeError("API down")))
+        self.assertEqual(sorted(os.listdir(self.cache.cache_dir)), ["k.mp3"])
+
+        stats = self.cache.get_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["writes"]), (1, 3, 1))
+        self.assertEqual(stats["bytes"], len(b"speech"))
+
+    def test_evicts_least_recently_used_and_reloads_index(self):
+        for key in ("a", "b", "c"):
+            self.cache.put(key, b"x" * 300)
+        self.cache.get("a")  # b is now the oldest
+        self.cache.put("d", b"x" * 300)
+
+        self.assertEqual(sorted(os.listdir(self.cache.cache_dir)), ["a.mp3", "c.mp3", "d.mp3"])
+        self.assertEqual(self.cache.get_stats()["evictions"], 1)
+
+        reopened = TTSCache(self.cache.cache_dir, max_bytes=1000)
+        self.assertEqual(reopened.get_stats()["entries"], 3)
+        self.assertEqual(reopened.read("d"), b"x" * 300)
+
+    def test_concurrent_requests_synthesize_once(self):
+        calls = []
+
+        def slow_generate():
+            calls.append(1)
+            time.sleep(0.1)
+            return b"speech"
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.cache.get_or_generate("k", slow_generate)))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [b"speech"] * 4)
+        self.assertEqual(len(calls), 1)
+
+    def test_elevenlabs_client_calls_api_once_per_utterance(self):
+        client = ElevenLabsClient(api_key="test", cache=self.cache)
+        response = MagicMock(content=b"rachel says hi")
+        output = os.path.join(self.test_dir, "hi.mp3")
+        with patch.object(client.client, "post", return_value=response) as post:
+            self.assertEqual(client.generate("Hi"), b"rachel says hi")
+            self.assertEqual(client.generate("Hi", output_path=output), b"rachel says hi")
+            client.default_voice = "another-voice"
+            client.generate("Hi")
+        self.assertEqual(post.call_count, 2)  # A different voice is a different utterance
+        self.assertTrue(os.path.exists(output))
+
+
+if __name__ == "__main__":
+    unittest.main()
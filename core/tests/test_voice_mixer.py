@@ -0,0 +1,426 @@
+import unittest
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+import wave
+import threading
+from unittest.mock import patch
+
+import numpy as np
+
+from core.brain.mix_engine import PCMReader, PCMWriter, SidechainDucker, MixPlan, render_mix, measure_loudness
+from core.brain.bed_cache import BedCache
+from core.brain.render_cache import RenderCache
+from core.brain.mix_pool import MixPool, MixQueueFull
+from core.brain.voice_mixer import VoiceMixer, MixSettings, MixJob
+
+RATE = 44100
+
+
+def write_wav(path: str, samples: np.ndarray, rate: int = RATE):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes((np.clip(samples, -1, 1) * 32767).astype("<i2").tobytes())
+
+
+def read_wav(path: str) -> np.ndarray:
+    with PCMReader(path) as reader:
+        return reader.read(1 << 30)
+
+
+def tone(seconds: float, amplitude: float, frequency: float) -> np.ndarray:
+    return amplitude * np.sin(2 * np.pi * frequency * np.arange(int(seconds * RATE)) / RATE)
+
+
+def gain(db: float) -> float:
+    return 10 ** (db / 20)
+
+
+def normalizing_gain(path: str, target: float) -> float:
+    return gain(target - measure_loudness(path))
+
+
+def slow_job(seconds: float, value: str) -> str:
+    time.sleep(seconds)
+    return value
+
+
+class TestVoiceMixer(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.bed = os.path.join(self.test_dir, "bed.wav")
+        self.voice = os.path.join(self.test_dir, "voice.wav")
+        write_wav(self.bed, tone(1, 0.5, 440))  # 1 s, looped as needed
+        write_wav(self.voice, tone(3, 0.25, 1000))
+        self.mixer = VoiceMixer(beds_directory=self.test_dir,
+                                render_cache=RenderCache(os.path.join(self.test_dir, "renders")),
+                                target_lufs=-14.0)
+        self.voice_gain = normalizing_gain(self.voice, -14.0)
+
+    def tearDown(self):
+        self.mixer.pool.shutdown()
+        shutil.rmtree(self.test_dir)
+
+    def test_mix_with_bed_loops_ducks_and_fades(self):
+        output = os.path.join(self.test_dir, "mixed.wav")
+        asyncio.run(self.mixer.mix_with_bed(self.voice, bed_path=self.bed,
+                                            settings=MixSettings(), output_path=output))
+        mixed = read_wav(output)[:, 0]
+        bed, voice = read_wav(self.bed)[:, 0], read_wav(self.voice)[:, 0]
+
+        self.assertAlmostEqual(len(mixed) / RATE, 7.0, places=2)  # 2 s intro + 3 s voice + 2 s outro
+        # Bed 12 LU under the voice, then the whole mix brought to the target
+        self.assertAlmostEqual(measure_loudness(output), -14.0, delta=0.1)
+        output_gain = mixed[RATE + 10] / (bed[10] * normalizing_gain(self.bed, -26.0))
+        bed_gain = normalizing_gain(self.bed, -26.0) * output_gain
+        self.assertAlmostEqual(mixed[3 * RATE + 10],
+                               bed[10] * bed_gain * gain(-6) + voice[RATE + 10] * self.voice_gain * output_gain,
+                               places=3)
+        self.assertLess(abs(mixed[-1]), 0.01)
+        self.assertFalse(any(name.endswith(".part.wav") for name in os.listdir(self.test_dir)))
+
+    def test_concurrent_writers_of_one_path_do_not_share_a_temp_file(self):
+        output = os.path.join(self.test_dir, "same.wav")
+        ready = threading.Barrier(2)
+        writers = []
+
+        def render(value):
+            writer = PCMWriter(output)
+            writers.append(writer)
+            ready.wait()  # Both temp files are open at once
+            writer.write(np.full((RATE, 2), value, dtype=np.float32))
+            writer.close()
+
+        threads = [threading.Thread(target=render, args=(v,)) for v in (0.25, 0.5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertNotEqual(writers[0]._tmp_path, writers[1]._tmp_path)
+        self.assertEqual(len(read_wav(output)), RATE)
+        self.assertEqual([name for name in os.listdir(self.test_dir) if ".part" in name], [])
+
+    def test_mix_over_intro_overlays_voice_on_song(self):
+        output = os.path.join(self.test_dir, "ramp.wav")
+        self.assertEqual(self.mixer.mix_over_intro(self.voice, self.bed, 5.0, output_path=output), output)
+        mixed = read_wav(output)[:, 0]
+        song, voice = read_wav(self.bed)[:, 0], read_wav(self.voice)[:, 0]
+
+        # The song sets the length and keeps its level; the voice comes in after 0.5 s
+        self.assertEqual(len(mixed), RATE)
+        self.assertAlmostEqual(mixed[100], song[100], places=3)
+        at = int(0.75 * RATE)
+        self.assertAlmostEqual(mixed[at], song[at] + voice[at - RATE // 2] * self.voice_gain * gain(2), places=3)
+
+    def test_intro_voice_starts_early_to_end_on_the_post(self):
+        self.assertEqual(self.mixer._intro_plan(self.voice, 5.0).voice_offset, 0.5)
+        self.assertAlmostEqual(self.mixer._intro_plan(self.voice, 3.2).voice_offset, 0.2)
+        self.assertEqual(self.mixer._intro_plan(self.voice, 2.0).voice_offset, 0.0)
+        job = MixJob(self.voice, self.bed, intro_duration=3.2)
+        self.assertAlmostEqual(self.mixer._job_plan(job)[1].voice_offset, 0.2)
+
+    def test_identical_mixes_come_from_the_render_cache(self):
+        def mix(name, **settings):
+            output = os.path.join(self.test_dir, name)
+            return asyncio.run(self.mixer.mix_with_bed(self.voice, bed_path=self.bed,
+                                                       settings=MixSettings(**settings), output_path=output))
+
+        first = mix("first.wav")
+        again = mix("again.wav")
+        self.assertEqual(self.mixer.pool.get_stats()["submitted"], 1)  # Nothing decoded or encoded
+        with open(first, "rb") as a, open(again, "rb") as b:
+            self.assertEqual(a.read(), b.read())
+
+        # Different settings or different voice content render anew
+        mix("quieter.wav", bed_volume=-6.0)
+        write_wav(self.voice, np.full(2 * RATE, 0.25))
+        os.utime(self.voice, ns=(0, os.stat(self.voice).st_mtime_ns + 10**9))
+        self.assertAlmostEqual(len(read_wav(mix("shorter.wav"))) / RATE, 6.0, places=2)
+        self.assertEqual(self.mixer.render_cache.get_stats()["hits"], 1)
+
+    def test_mix_batch_dedupes_and_reports_failures(self):
+        song = os.path.join(self.test_dir, "song.wav")
+        write_wav(song, np.full(5 * RATE, 0.5))
+        outputs = [os.path.join(self.test_dir, f"batch{i}.wav") for i in range(4)]
+        jobs = [
+            MixJob(self.voice, self.bed, output_path=outputs[0]),
+            MixJob(self.voice, self.bed, output_path=outputs[1]),  # Same mix as the first
+            MixJob(self.voice, song, intro_duration=5.0, output_path=outputs[2]),
+            MixJob(os.path.join(self.test_dir, "missing.wav"), self.bed, output_path=outputs[3]),
+        ]
+        results = dict(self.mixer.mix_batch(jobs))
+
+        self.assertEqual(results, {0: outputs[0], 1: outputs[1], 2: outputs[2], 3: None})
+        self.assertEqual(self.mixer.pool.get_stats()["completed"], 2)
+        np.testing.assert_array_equal(read_wav(outputs[0]), read_wav(outputs[1]))
+        self.assertEqual(len(read_wav(outputs[2])), 5 * RATE)
+
+        # Everything is cached now
+        self.assertEqual(dict(self.mixer.mix_batch(jobs[:3])), {0: outputs[0], 1: outputs[1], 2: outputs[2]})
+        self.assertEqual(self.mixer.pool.get_stats()["submitted"], 2)
+
+    def test_voices_and_mixes_are_normalized_to_target(self):
+        quiet = os.path.join(self.test_dir, "quiet.wav")
+        write_wav(quiet, tone(4, 0.02, 1000))
+        outputs = [os.path.join(self.test_dir, name) for name in ("voice_only.wav", "over_bed.wav")]
+        jobs = [MixJob(quiet, bed_style="missing", output_path=outputs[0]),
+                MixJob(quiet, self.bed, output_path=outputs[1])]
+        self.assertEqual(dict(self.mixer.mix_batch(jobs)), {0: outputs[0], 1: outputs[1]})
+
+        self.assertAlmostEqual(measure_loudness(outputs[0]), -14.0, delta=0.1)
+        self.assertAlmostEqual(measure_loudness(outputs[1]), -14.0, delta=0.1)
+
+    def test_voice_loudness_is_measured_once(self):
+        output = os.path.join(self.test_dir, "over_bed.wav")
+        asyncio.run(self.mixer.mix_with_bed(self.voice, bed_path=self.bed, output_path=output))
+        loudness_dir = self.mixer.render_cache.loudness_dir
+        records = os.listdir(loudness_dir)
+        self.assertEqual(len(records), 1)
+        with open(os.path.join(loudness_dir, records[0])) as f:
+            stored = json.load(f)
+        self.assertAlmostEqual(stored["seconds"], 3.0, places=2)
+
+        # Later mixes of the voice read the record instead of decoding it first
+        stored["lufs"] -= 6.0
+        with open(os.path.join(loudness_dir, records[0]), "w") as f:
+            json.dump(stored, f)
+        output = os.path.join(self.test_dir, "voice_only.wav")
+        self.assertEqual(dict(self.mixer.mix_batch([MixJob(self.voice, bed_style="missing", output_path=output)])),
+                         {0: output})
+        self.assertAlmostEqual(measure_loudness(output), -8.0, delta=0.1)
+        self.assertEqual(os.listdir(loudness_dir), records)
+
+    def test_default_outputs_are_not_cache_entries(self):
+        self.mixer.output_directory = os.path.join(self.test_dir, "output")
+        for prefix in ("mixed", "ramp_mix"):
+            _, target, output = self.mixer._lookup(self.voice, self.bed, MixPlan(), None, False, prefix)
+            self.assertEqual(os.path.dirname(output), self.mixer.output_directory)
+            self.assertTrue(os.path.basename(output).startswith(prefix + "_"))
+            self.assertEqual(os.path.dirname(target), self.mixer.render_cache.cache_dir)
+
+        # Delivered files outlive their cache entries
+        output = os.path.join(self.test_dir, "delivered.wav")
+        self.assertEqual(self.mixer.mix_over_intro(self.voice, self.bed, 5.0, output_path=output), output)
+        shutil.rmtree(self.mixer.render_cache.cache_dir)
+        self.assertEqual(len(read_wav(output)), RATE)
+
+    def test_busy_pool_is_not_hidden_by_the_fallback(self):
+        self.mixer.pool.shutdown()
+        self.mixer.pool = MixPool(max_workers=1, max_pending=1, use_processes=False)
+        self.mixer.pool._submit(slow_job, (0.2, "other"))
+        output = os.path.join(self.test_dir, "busy.wav")
+        with self.assertRaises(MixQueueFull):
+            asyncio.run(self.mixer.mix_with_bed(self.voice, bed_path=self.bed, output_path=output))
+        self.assertFalse(os.path.exists(output))
+
+    def test_render_cache_evicts_least_recently_used(self):
+        cache = RenderCache(os.path.join(self.test_dir, "small"), max_bytes=250)
+        for name in ("a", "b", "c"):
+            path = cache.path_for(name, ".wav")
+            with open(path, "wb") as f:
+                f.write(b"x" * 100)
+            cache.add(path)
+            if name == "b":
+                cache.get("a", ".wav")  # a is now more recent than b
+        self.assertEqual(sorted(os.listdir(cache.cache_dir)), ["a.wav", "c.wav"])
+        stats = cache.get_stats()
+        self.assertEqual((stats["entries"], stats["bytes"], stats["evictions"]), (2, 200, 1))
+
+        # A new cache reads the index back from the directory once
+        self.assertEqual(RenderCache(cache.cache_dir, max_bytes=250).get_stats()["bytes"], 200)
+
+    def test_render_evicted_by_another_process_is_rendered_again(self):
+        output = os.path.join(self.test_dir, "first.wav")
+        asyncio.run(self.mixer.mix_with_bed(self.voice, bed_path=self.bed, output_path=output))
+
+        real_get = self.mixer.render_cache.get
+        def get_then_evict(key, extension):
+            path = real_get(key, extension)
+            if path:
+                os.unlink(path)  # Evicted between lookup and delivery
+            return path
+
+        again = os.path.join(self.test_dir, "again.wav")
+        with patch.object(self.mixer.render_cache, "get", side_effect=get_then_evict):
+            self.assertEqual(asyncio.run(self.mixer.mix_with_bed(self.voice, bed_path=self.bed,
+                                                                 output_path=again)), again)
+        self.assertEqual(self.mixer.pool.get_stats()["submitted"], 2)
+        np.testing.assert_array_equal(read_wav(output), read_wav(again))
+
+
+class TestBedCache(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.beds = []
+        for i in range(3):
+            path = os.path.join(self.test_dir, f"bed{i}.wav")
+            write_wav(path, np.full(RATE, 0.1 * (i + 1)))
+            self.beds.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_lru_eviction_and_disk_tier(self):
+        disk = os.path.join(self.test_dir, "cache")
+        one_bed = RATE * 2 * 4
+        cache = BedCache(max_bytes=2 * one_bed, cache_dir=disk)
+
+        first = cache.get(self.beds[0])
+        self.assertIs(cache.get(self.beds[0]), first)
+        cache.get(self.beds[1])
+        cache.get(self.beds[2])  # Evicts bed0
+        stats = cache.get_stats()
+        self.assertEqual((stats["entries"], stats["hits"], stats["misses"]), (2, 1, 3))
+        self.assertLessEqual(stats["bytes"], cache.max_bytes)
+
+        # A fresh cache maps the saved decode instead of decoding again
+        fresh = BedCache(cache_dir=disk)
+        samples = fresh.get(self.beds[0])
+        self.assertEqual(fresh.get_stats()["disk_hits"], 1)
+        self.assertIsInstance(samples, np.memmap)
+        np.testing.assert_array_equal(samples, first)
+
+        # Changing the file invalidates its entry
+        write_wav(self.beds[0], np.full(RATE // 2, 0.5))
+        os.utime(self.beds[0], ns=(0, os.stat(self.beds[0]).st_mtime_ns + 10**9))
+        self.assertEqual(len(fresh.get(self.beds[0])), RATE // 2)
+        self.assertEqual(len(os.listdir(disk)), 3)
+
+    def test_cached_bed_mixes_identically(self):
+        voice = os.path.join(self.test_dir, "voice.wav")
+        write_wav(voice, np.full(RATE, 0.25))
+        mixer = VoiceMixer(beds_directory=self.test_dir,
+                           render_cache=RenderCache(os.path.join(self.test_dir, "renders")),
+                           pool=MixPool(use_processes=False))
+        outputs = []
+        for volume in (-12.0, -6.0):
+            outputs.append(os.path.join(self.test_dir, f"mix{volume}.wav"))
+            asyncio.run(mixer.mix_with_bed(voice, bed_path=self.beds[1], output_path=outputs[-1],
+                                           settings=MixSettings(bed_volume=volume)))
+        self.assertEqual(mixer.bed_cache.get_stats()["hits"], 1)
+
+        # Same result as streaming the bed from its file
+        streamed = os.path.join(self.test_dir, "streamed.wav")
+        plan = MixPlan(voice_offset=2.0, duck_db=6.0, duck_attack=0.1, duck_release=0.3, tail=2.0,
+                       fade_in=0.5, fade_out=2.0, loop_bed=True, voice_lufs=mixer.target_lufs,
+                       bed_lufs=mixer.target_lufs - 6.0, output_lufs=mixer.target_lufs)
+        render_mix(voice, self.beds[1], plan, streamed)
+        np.testing.assert_array_equal(read_wav(outputs[1]), read_wav(streamed))
+
+
+class TestMixPool(unittest.TestCase):
+    def test_jobs_run_in_parallel_off_the_loop(self):
+        pool = MixPool(max_workers=2, max_pending=2)
+
+        async def scenario():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            clock = asyncio.create_task(ticker())
+            begin = time.perf_counter()
+            jobs = [asyncio.create_task(pool.run(slow_job, 0.3, name)) for name in "ab"]
+            await asyncio.sleep(0)
+            with self.assertRaises(MixQueueFull):
+                await pool.run(slow_job, 0.3, "c")
+            results = await asyncio.gather(*jobs)
+            clock.cancel()
+            return results, time.perf_counter() - begin, ticks
+
+        try:
+            results, elapsed, ticks = asyncio.run(scenario())
+        finally:
+            pool.shutdown()
+        self.assertEqual(results, ["a", "b"])
+        self.assertLess(elapsed, 0.55)
+        self.assertGreater(ticks, 15)
+        stats = pool.get_stats()
+        self.assertEqual((stats["completed"], stats["rejected"], stats["pending"]), (2, 1, 0))
+        self.assertGreaterEqual(stats["avg_run_seconds"], 0.3)
+
+    def test_cancelled_waiting_job_never_runs(self):
+        pool = MixPool(max_workers=1, use_processes=False)
+
+        async def scenario():
+            first = asyncio.create_task(pool.run(slow_job, 0.2, "first"))
+            second = asyncio.create_task(pool.run(slow_job, 0.2, "second"))
+            await asyncio.sleep(0.05)
+            second.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await second
+            return await first
+
+        try:
+            self.assertEqual(asyncio.run(scenario()), "first")
+        finally:
+            pool.shutdown()
+        stats = pool.get_stats()
+        self.assertEqual((stats["completed"], stats["cancelled"], stats["pending"]), (1, 1, 0))
+
+
+    def test_running_job_cancel_is_not_counted(self):
+        pool = MixPool(max_workers=1, use_processes=False)
+
+        async def scenario():
+            job = asyncio.create_task(pool.run(slow_job, 0.2, "running"))
+            await asyncio.sleep(0.05)
+            job.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await job
+
+        try:
+            asyncio.run(scenario())
+        finally:
+            pool.shutdown()
+        self.assertEqual(pool.get_stats()["cancelled"], 0)
+
+    def test_run_many_waits_for_other_callers_jobs(self):
+        pool = MixPool(max_workers=1, max_pending=1, use_processes=False)
+        try:
+            other, _ = pool._submit(slow_job, (0.2, "other"))
+            results = list(pool.run_many(slow_job, [(0.01, "mine")]))
+            self.assertTrue(other.done())
+        finally:
+            pool.shutdown()
+        self.assertEqual(results, [(0, "mine", None)])
+
+
+class TestSidechainDucker(unittest.TestCase):
+    def gains_db(self, voice, block):
+        ducker = SidechainDucker(RATE, 6.0, attack=0.1, release=0.3)
+        padded = np.concatenate([voice, np.zeros((ducker.lookahead, 1), np.float32)])
+        gains = [
+            ducker.process(padded[start:start + min(block, len(voice) - start) + ducker.lookahead],
+                           min(block, len(voice) - start))
+            for start in range(0, len(voice), block)
+        ]
+        return 20 * np.log10(np.concatenate(gains))
+
+    def test_attack_hold_and_release(self):
+        # 1 s silence, 1 s speech, 1 s silence
+        voice = np.zeros((3 * RATE, 1), np.float32)
+        voice[RATE:2 * RATE] = 0.3
+        gains = self.gains_db(voice, 4096)
+
+        self.assertAlmostEqual(gains[int(0.85 * RATE)], 0.0, places=3)
+        # Lookahead: fully ducked exactly when the voice starts
+        self.assertAlmostEqual(gains[RATE], -6.0, places=2)
+        # Held through the first 0.25 s of silence, then released over 0.3 s
+        self.assertAlmostEqual(gains[int(2.2 * RATE)], -6.0, places=2)
+        self.assertGreater(gains[int(2.4 * RATE)], -6.0)
+        self.assertAlmostEqual(gains[int(2.6 * RATE)], 0.0, places=3)
+        # Block size does not change the result
+        np.testing.assert_allclose(gains, self.gains_db(voice, 1000), atol=1e-5)
+
+
+if __name__ == "__main__":
+    unittest.main()